@@ -14,7 +14,13 @@ install_requires = [
     "numpy",
 ]
 
-mceditlib_ext_modules = cythonize("src/mceditlib/nbt.pyx")
+mceditlib_ext_modules = cythonize(
+    [
+        "src/mceditlib/nbt.pyx",
+        "src/mceditlib/floodfill.pyx",
+        "src/mceditlib/lightengine.pyx",
+    ]
+    )
 
 setup(name='mceditlib',
       version=version,
@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 import logging
 import os
+import sys
 
 from PySide import QtGui, QtCore
 from PySide.QtCore import Qt
@@ -100,6 +101,8 @@ class EditorSession(QtCore.QObject):
         self.actionPaste_Entities.setObjectName("actionPaste_Entities")
         self.actionClear = QtGui.QAction(self.tr("Clear"), self, triggered=self.clear, enabled=False)
         self.actionClear.setObjectName("actionClear")
+        self.actionRelight_World = QtGui.QAction(self.tr("Relight World"), self, triggered=self.relightWorld)
+        self.actionRelight_World.setObjectName("actionRelight_World")
 
         undoAction = self.undoStack.createUndoAction(self.menuEdit)
         undoAction.setShortcut(QtGui.QKeySequence.Undo)
@@ -114,6 +117,8 @@ class EditorSession(QtCore.QObject):
         self.menuEdit.addAction(self.actionPaste_Blocks)
         self.menuEdit.addAction(self.actionPaste_Entities)
         self.menuEdit.addAction(self.actionClear)
+        self.menuEdit.addSeparator()
+        self.menuEdit.addAction(self.actionRelight_World)
 
         self.actionCut.setShortcut(QtGui.QKeySequence.Cut)
         self.actionCopy.setShortcut(QtGui.QKeySequence.Copy)
@@ -259,6 +264,15 @@ class EditorSession(QtCore.QObject):
     def clear(self):
         self.selectionTool.deleteSelection()
 
+    def relightWorld(self):
+        command = SimpleRevisionCommand(self, "Relight World")
+        with command.begin():
+            # Worker processes are untested in the frozen build, so relight on this process there
+            workers = 1 if getattr(sys, 'frozen', False) else None
+            task = self.currentDimension.generateLightsIter(workers=workers)
+            showProgress("Relighting...", task)
+        self.undoStack.push(command)
+
     # --- Undo support ---
 
     def undoIndexChanged(self, index):
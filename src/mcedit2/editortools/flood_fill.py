@@ -4,14 +4,12 @@
 from __future__ import absolute_import, division, print_function
 from PySide import QtGui
 import logging
-import collections
-import time
 from mcedit2.editortools import EditorTool
 from mcedit2.command import SimplePerformCommand
 from mcedit2.util.showprogress import showProgress
 from mcedit2.widgets.blockpicker import BlockTypeButton
 from mcedit2.widgets.layout import Column, Row
-from mceditlib import faces
+from mceditlib import floodfill
 
 log = logging.getLogger(__name__)
 
@@ -52,55 +50,22 @@ class FloodFillCommand(SimplePerformCommand):
         point = self.point
 
         doomedBlock = dim.getBlockID(*point)
-        doomedBlockData = dim.getBlockData(*point)
         checkData = (doomedBlock not in (8, 9, 10, 11))
         indiscriminate = self.indiscriminate
 
         if doomedBlock == self.blockInfo.ID:
             return
+
+        matchIDs = ()
         if indiscriminate:
             checkData = False
-            if doomedBlock == 2:  # grass
-                doomedBlock = 3  # dirt
-
-        x, y, z = point
-        dim.setBlockID(x, y, z, self.blockInfo.ID)
-        dim.setBlockData(x, y, z, self.blockInfo.meta)
-
-        def processCoords(coords):
-            newcoords = collections.deque()
-
-            for (x, y, z) in coords:
-                for face, offsets in faces.faceDirections:
-                    dx, dy, dz = offsets
-                    p = (x + dx, y + dy, z + dz)
-
-                    nx, ny, nz = p
-                    b = dim.getBlockID(nx, ny, nz)
-                    if indiscriminate:
-                        if b == 2:
-                            b = 3
-                    if b == doomedBlock:
-                        if checkData:
-                            if dim.getBlockData(nx, ny, nz) != doomedBlockData:
-                                continue
-
-                        dim.setBlockID(nx, ny, nz, self.blockInfo.ID)
-                        dim.setBlockData(nx, ny, nz, self.blockInfo.meta)
-                        newcoords.append(p)
-
-            return newcoords
-
-        def spread(coords):
-            start = time.time()
-            num = 0
-            while len(coords):
-                num += len(coords)
-                coords = processCoords(coords)
-                d = time.time() - start
-                progress = "Did {0} coords in {1}".format(num, d)
-                log.debug(progress)
-                yield progress
-
-
-        showProgress("Flood fill...", spread([point]), cancel=True)
+            matchIDs = (2, 3)  # grass and dirt
+
+        # Stay inside the selection if the fill starts inside it
+        bounds = self.editorSession.currentSelection
+        if bounds is not None and point not in bounds:
+            bounds = None
+
+        task = floodfill.floodFillIter(dim, point, self.blockInfo.ID, self.blockInfo.meta, bounds=bounds,
+                                       checkData=checkData, matchIDs=matchIDs)
+        showProgress("Flood fill...", task, cancel=True)
@@ -3,6 +3,7 @@
 """
 #!/usr/bin/env python
 from __future__ import absolute_import, division, print_function, unicode_literals
+import multiprocessing
 import sys
 import traceback
 
@@ -161,4 +162,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Worker processes started by a frozen build run this script again, and must not start the app
+    multiprocessing.freeze_support()
     main()
@@ -2,7 +2,7 @@
     ${NAME}
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
-from collections import deque
+from collections import deque, defaultdict
 import logging
 import time
 
@@ -57,6 +57,15 @@ class IChunkLoaderClient(object):
         :rtype: None or iterator
         """
 
+    def chunkInvalid(self, (cx, cz), sections=None):
+        """
+        Notifies the client that a chunk was modified. If sections is given, only the blocks or lights of the
+        sections at those Y positions were changed.
+
+        :param (cx, cz): chunk position
+        :type sections: set of int | None
+        """
+
     def chunkNotLoaded(self, (cx, cz), exc):
         """
         Notifies the client that a chunk failed to load with an exception.
@@ -150,10 +159,15 @@ class ChunkLoader(QtCore.QObject):
                 log.debug("ChunkLoader: No clients!")
                 return
 
+            # Chunks that only had some sections changed are listed with those sections
             invalidChunks = self.dimension.getRecentDirtyChunks()
+            invalidSections = defaultdict(set)
+            for cx, cy, cz in self.dimension.getRecentDirtySections():
+                invalidSections[cx, cz].add(cy)
             for c in invalidChunks:
+                sections = invalidSections.get(c)
                 for client in self.clients:
-                    client.chunkInvalid(c)
+                    client.chunkInvalid(c, sections)
 
             for client in self.clients:
                 c = client.requestChunk()
@@ -26,6 +26,8 @@ class ChunkRenderInfo(object):
         self.worldScene = worldScene
         self.detailLevel = worldScene.minlod
         self.invalidLayers = set(layers.Layer.AllLayers)
+        self.invalidSections = None  # Y positions of sections whose block meshes are invalid, or None for all
+        self.sectionMeshes = {}  # Y position -> block meshes of that section
         self.chunkPosition = chunkPosition
         self.bufferSize = 0
         self.vertexNodes = []
@@ -17,6 +17,7 @@ from mcedit2.util.lazyprop import lazyprop
 from mceditlib import faces
 from mceditlib import exceptions
 from mceditlib.geometry import SectionBox, BoundingBox
+from mceditlib.multi_block import readSectionArray
 
 
 log = logging.getLogger(__name__)
@@ -166,12 +167,23 @@ class ChunkUpdate(object):
         else:
             sections = chunk.sectionPositions()
 
+        invalidSections = self.chunkInfo.invalidSections
+        sectionMeshes = self.chunkInfo.sectionMeshes
         for cy in sections:
+            if invalidSections is not None and cy not in invalidSections and cy in sectionMeshes:
+                blockMeshes.extend(sectionMeshes[cy])
+                continue
+
             chunkSection = chunk.getSection(cy, False)
             if chunkSection:
-                sectionUpdate = SectionUpdate(self, chunkSection, blockMeshes)
+                meshes = []
+                sectionUpdate = SectionUpdate(self, chunkSection, meshes)
                 for _i in sectionUpdate:
                     yield
+                sectionMeshes[cy] = meshes
+                blockMeshes.extend(meshes)
+            else:
+                sectionMeshes.pop(cy, None)
 
 
 class SectionUpdate(object):
@@ -198,9 +210,7 @@ class SectionUpdate(object):
         # 2: item?
         # 3: block model
 
-        self.renderType = numpy.zeros((256*256,), 'uint8')
-        for block in self.blocktypes:
-            self.renderType[block.ID] = block.renderType
+        self.renderType = self.blocktypes.tables.renderType
 
 
 
@@ -224,7 +234,7 @@ class SectionUpdate(object):
         """
         chunk = self.chunkUpdate.chunk
 
-        chunkWidth, chunkLength, chunkHeight = self.chunkSection.Blocks.shape
+        chunkWidth, chunkLength, chunkHeight = readSectionArray(self.chunkSection, "Blocks").shape
         cy = self.chunkSection.Y
 
         areaBlocks = numpy.empty((chunkWidth + 2, chunkLength + 2, chunkHeight + 2), numpy.uint16)
@@ -243,36 +253,36 @@ class SectionUpdate(object):
             if mask is None:
                 return areaBlocks
 
-        areaBlocks[1:-1, 1:-1, 1:-1] = self.chunkSection.Blocks
+        areaBlocks[1:-1, 1:-1, 1:-1] = readSectionArray(self.chunkSection, "Blocks")
         neighboringChunks = self.chunkUpdate.neighboringChunks
 
         if faces.FaceXDecreasing in neighboringChunks:
             ncs = neighboringChunks[faces.FaceXDecreasing].getSection(cy)
             if ncs:
-                areaBlocks[1:-1, 1:-1, :1] = ncs.Blocks[:, :, -1:]
+                areaBlocks[1:-1, 1:-1, :1] = readSectionArray(ncs, "Blocks")[:, :, -1:]
 
         if faces.FaceXIncreasing in neighboringChunks:
             ncs = neighboringChunks[faces.FaceXIncreasing].getSection(cy)
             if ncs:
-                areaBlocks[1:-1, 1:-1, -1:] = ncs.Blocks[:, :, :1]
+                areaBlocks[1:-1, 1:-1, -1:] = readSectionArray(ncs, "Blocks")[:, :, :1]
 
         if faces.FaceZDecreasing in neighboringChunks:
             ncs = neighboringChunks[faces.FaceZDecreasing].getSection(cy)
             if ncs:
-                areaBlocks[1:-1, :1, 1:-1] = ncs.Blocks[:chunkWidth, -1:, :chunkHeight]
+                areaBlocks[1:-1, :1, 1:-1] = readSectionArray(ncs, "Blocks")[:chunkWidth, -1:, :chunkHeight]
 
         if faces.FaceZIncreasing in neighboringChunks:
             ncs = neighboringChunks[faces.FaceZIncreasing].getSection(cy)
             if ncs:
-                areaBlocks[1:-1, -1:, 1:-1] = ncs.Blocks[:chunkWidth, :1, :chunkHeight]
+                areaBlocks[1:-1, -1:, 1:-1] = readSectionArray(ncs, "Blocks")[:chunkWidth, :1, :chunkHeight]
 
         aboveSection = chunk.getSection(self.chunkSection.Y + 1)
         if aboveSection:
-            areaBlocks[-1:, 1:-1, 1:-1] = aboveSection.Blocks[:1, :, :]
+            areaBlocks[-1:, 1:-1, 1:-1] = readSectionArray(aboveSection, "Blocks")[:1, :, :]
 
         belowSection = chunk.getSection(self.chunkSection.Y - 1)
         if belowSection:
-            areaBlocks[:1, 1:-1, 1:-1] = belowSection.Blocks[-1:, :, :]
+            areaBlocks[:1, 1:-1, 1:-1] = readSectionArray(belowSection, "Blocks")[-1:, :, :]
 
 
         if mask is not None:
@@ -314,11 +324,13 @@ class SectionUpdate(object):
 
     def areaLights(self, lightName):
         chunkSection = self.chunkSection
-        if not hasattr(chunkSection, lightName):
+        try:
+            readSectionArray(chunkSection, lightName)
+        except AttributeError:
             return numpy.array([[[15]]], numpy.uint8)
 
         def Light(cs):
-            return getattr(cs, lightName)
+            return readSectionArray(cs, lightName)
 
         neighboringChunks = self.chunkUpdate.neighboringChunks
 
@@ -382,10 +394,16 @@ class SectionUpdate(object):
 
     @property
     def Data(self):
-        return self.chunkSection.Data
+        return readSectionArray(self.chunkSection, "Data")
 
     @profiler.iterator("SectionUpdate")
     def __iter__(self):
+        # A section that is entirely air has nothing to draw. Neighboring sections draw their own faces.
+        uniformValue = getattr(self.chunkSection, "uniformValue", None)
+        if uniformValue is not None and uniformValue("Blocks") == 0:  # xxx hardcoded air ID
+            yield
+            return
+
         renderTypeCounts = numpy.bincount(self.blockRenderTypes.ravel())
 
         cx, cz = self.chunkUpdate.chunk.chunkPosition
@@ -86,6 +86,7 @@ class SceneUpdateTask(object):
                     yield
 
             chunkInfo.invalidLayers = set()
+            chunkInfo.invalidSections = set()
             meshesByRS = collections.defaultdict(list)
             for mesh in chunkUpdate.blockMeshes:
                 meshesByRS[mesh.renderstate].append(mesh)
@@ -186,13 +187,22 @@ class WorldScene(scenegraph.Node):
             groupNode.clear()
         self.chunkRenderInfo.clear()
 
-    def invalidateChunk(self, cx, cz, invalidLayers=None):
+    def invalidateChunk(self, cx, cz, invalidLayers=None, invalidSections=None):
         """
-        Mark the chunk for regenerating vertex data
+        Mark the chunk for regenerating vertex data. If invalidSections is given, only the blocks of the sections at
+        those Y positions were changed, and the block meshes of the other sections are kept.
         """
         node = self.chunkRenderInfo.get((cx, cz))
-        if node:
-            node.invalidLayers = invalidLayers or Layer.AllLayers
+        if not node:
+            return
+
+        node.invalidLayers = invalidLayers or Layer.AllLayers
+        if invalidSections is None:
+            node.invalidSections = None
+        elif node.invalidSections is not None:
+            # Faces at the top and bottom of a section depend on the sections above and below it
+            for cy in invalidSections:
+                node.invalidSections.update((cy - 1, cy, cy + 1))
 
     _fastLeaves = False
 
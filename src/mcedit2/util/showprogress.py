@@ -51,6 +51,10 @@ def showProgress(text, iter, cancel=False):
         dialog.setLabelText(status)
         QtGui.QApplication.processEvents()
         if dialog.wasCanceled():
+            # Let the task finish the work it has done so far
+            close = getattr(iter, "close", None)
+            if close is not None:
+                close()
             return False
 
     LoaderTimer.startAll()
@@ -148,9 +148,9 @@ class SlicedWorldScene(scenegraph.Node):
             for _ in mesh.workOnChunk(c, sections):
                 yield _
 
-    def chunkInvalid(self, c):
+    def chunkInvalid(self, c, sections=None):
         for mesh in self.sliceScenes.values():
-            mesh.invalidateChunk(*c)
+            mesh.invalidateChunk(*c, invalidSections=sections)
 
 
 class CutawayWorldView(WorldView):
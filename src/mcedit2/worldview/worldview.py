@@ -498,8 +498,8 @@ class WorldView(QGLWidget):
 
         return self.worldScene.workOnChunk(chunk, visibleSections)
 
-    def chunkInvalid(self, (cx, cz)):
-        self.worldScene.invalidateChunk(cx, cz)
+    def chunkInvalid(self, (cx, cz), sections=None):
+        self.worldScene.invalidateChunk(cx, cz, invalidSections=sections)
         self.resetLoadOrder()
 
 
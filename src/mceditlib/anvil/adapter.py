@@ -20,6 +20,8 @@ from mceditlib.blocktypes import pc_blocktypes
 from mceditlib.geometry import Vector, BoundingBox
 from mceditlib import nbtattr
 from mceditlib.exceptions import PlayerNotFound
+from mceditlib.pc import regionfile
+from mceditlib.pc.regionfile import decompress
 from mceditlib.revisionhistory import RevisionHistory
 
 
@@ -101,6 +103,56 @@ def sanitizeBlocks(section, blocktypes):
 # --- Sections and chunks ---
 
 
+def uniformNibbleValue(packedData):
+    """
+    If every element of the packed nibble array has the same value, return that value, otherwise return None.
+    """
+    first = packedData.flat[0]
+    if (first >> 4) == (first & 0xf) and (packedData == first).all():
+        return int(first & 0xf)
+    return None
+
+
+def uniformValue(array):
+    """
+    If every element of the array has the same value, return that value, otherwise return None.
+    """
+    first = array.flat[0]
+    if (array == first).all():
+        return int(first)
+    return None
+
+
+NIBBLE_ARRAY_NAMES = ("Data", "SkyLight", "BlockLight")
+SAVED_ARRAY_NAMES = ("Blocks", "Add") + NIBBLE_ARRAY_NAMES
+SECTION_SHAPE = (16, 16, 16)
+
+
+class _SectionArray(object):
+    """
+    Unpacks an array of an AnvilSection the first time it is accessed, and stores it in the section's __dict__.
+
+    The caller may change the array it gets, so every access marks the section as permanently dirty. Code that only
+    reads the array should use readArray instead.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, section, owner):
+        if section is None:
+            return self
+        section._exposeArrays()
+        array = section.__dict__.get(self.name)
+        if array is None:
+            array = section._unpack(self.name)
+        return array
+
+    def __set__(self, section, array):
+        section._exposeArrays()
+        section._packed.pop(self.name, None)
+        section.__dict__[self.name] = array
+
+
 class AnvilSection(object):
     """
     Internal representation of a 16x16x16 chunk section. Arrays are indexed YZX.
@@ -110,71 +162,329 @@ class AnvilSection(object):
     To create the full 12-bit block ID, the Blocks array is extended to 16 bits and the Add array is merged into
     the Blocks array.
 
+    An array where every element has the same value is stored as just that value until it is accessed by name
+    (section.Blocks etc.), which creates the full array. New sections are entirely uniform. Use uniformValue,
+    setUniform and readArray to work with uniform arrays without creating the full array.
+
+    A packed section also keeps its other arrays in the form they are saved in to use less memory: Blocks is left
+    as 8 bits if there is no Add array, and 4-bit arrays stay packed. Each array is unpacked the first time it is
+    accessed by name. getArrayFlat and setArrayFlat read and write packed and uniform arrays without unpacking them.
+
+    The section's tag is kept with its saved arrays until the section is changed, and buildNBTTag returns it
+    unchanged while the section is not dirty. setArrayFlat and setUniform mark the section dirty. Since the array
+    returned by accessing it by name may be changed at any time, doing so marks the section dirty for as long as it
+    is loaded.
+
     :ivar Y: section's Y value [0..(world.Height+15) >> 4]
     :ivar Blocks: Block IDs [0..4095]
     :ivar Data: Block sub-data [0..15]
     :ivar BlockLight: Light emitted by blocks [0..15]
     :ivar SkyLight: Light emitted by the sun/moon [0..15]
+    :ivar dirty: True if the section was changed since it was loaded or last saved
     """
 
-    def __init__(self, section_tag=None):
+    Blocks = _SectionArray("Blocks")
+    Data = _SectionArray("Data")
+    BlockLight = _SectionArray("BlockLight")
+    SkyLight = _SectionArray("SkyLight")
+
+    def __init__(self, section_tag=None, packed=False):
+        self._packed = {}  # name -> packed array, or the value of every element
+        self._keepPacked = packed
+        self._exposed = False
+        self.old_section_tag = None
+        self.dirty = False
         if section_tag:
             self._load(section_tag)
         else:
             self._create()
 
     def _load(self, section_tag):
-        self.Y = section_tag.pop("Y").value
-        self.Blocks = section_tag.pop("Blocks").value.astype("uint16")
-        self.Blocks.shape = 16, 16, 16
+        # The arrays are left in section_tag, which is saved unchanged until the section becomes dirty
+        self.Y = section_tag["Y"].value
+        Blocks = section_tag["Blocks"].value
+        Blocks.shape = SECTION_SHAPE
+        tag = section_tag.get("Add")
 
-        for name in "Data", "SkyLight", "BlockLight":
-            section_array = section_tag.pop(name).value
-            section_array.shape = 16, 16, 8
-            setattr(self, name, unpackNibbleArray(section_array))
-
-        tag = section_tag.pop("Add", None)
         if tag is not None:
             tag.value.shape = 16, 16, 8
             add = unpackNibbleArray(tag.value)
-            self.Blocks |= numpy.array(add, 'uint16') << 8
+            Blocks = Blocks.astype("uint16")
+            Blocks |= numpy.array(add, 'uint16') << 8
+            self.__dict__["Blocks"] = Blocks
+        else:
+            value = uniformValue(Blocks)
+            if value is not None:
+                self._packed["Blocks"] = value
+            elif self._keepPacked:
+                self._packed["Blocks"] = Blocks
+            else:
+                self.__dict__["Blocks"] = Blocks.astype("uint16")
+
+        for name in NIBBLE_ARRAY_NAMES:
+            section_array = section_tag[name].value
+            section_array.shape = 16, 16, 8
+            value = uniformNibbleValue(section_array)
+            if value is not None:
+                self._packed[name] = value
+            elif self._keepPacked:
+                self._packed[name] = section_array
+            else:
+                self.__dict__[name] = unpackNibbleArray(section_array)
 
         self.old_section_tag = section_tag
 
     def _create(self):
-        shape = 16, 16, 16
         self.Y = 0
-
-        self.Blocks = numpy.zeros(shape, 'uint16')
-        self.Data = numpy.zeros(shape, 'uint8')
-        self.SkyLight = numpy.zeros(shape, 'uint8')
-        self.BlockLight = numpy.zeros(shape, 'uint8')
+        for name in ("Blocks",) + NIBBLE_ARRAY_NAMES:
+            self._packed[name] = 0
         self.old_section_tag = nbt.TAG_Compound()
+        self.dirty = True
+
+    # --- Dirty state ---
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    @dirty.setter
+    def dirty(self, value):
+        self._dirty = bool(value)
+        if value and self.old_section_tag is not None:
+            # Release the saved arrays; they are replaced by buildNBTTag
+            for name in SAVED_ARRAY_NAMES:
+                self.old_section_tag.pop(name, None)
+
+    def _exposeArrays(self):
+        if not self._exposed:
+            self._exposed = True
+            self.dirty = True
+
+    # --- Packed and uniform arrays ---
+
+    def _expand(self, name):
+        # Return the full form of an array that is packed or uniform
+        packed = self._packed[name]
+        if not isinstance(packed, numpy.ndarray):
+            array = numpy.empty(SECTION_SHAPE, 'uint16' if name == "Blocks" else 'uint8')
+            array.fill(packed)
+            return array
+        if name == "Blocks":
+            return packed.astype('uint16')
+        return unpackNibbleArray(packed)
+
+    def _unpack(self, name):
+        if name not in self._packed:
+            raise AttributeError(name)
+
+        array = self._expand(name)
+        del self._packed[name]
+        self.__dict__[name] = array
+        return array
+
+    def _packedNibbles(self, name):
+        array = self.__dict__.get(name)
+        if array is not None:
+            return packNibbleArray(array)
+
+        packed = self._packed[name]
+        if isinstance(packed, numpy.ndarray):
+            return packed
+        array = numpy.empty((16, 16, 8), 'uint8')
+        array.fill(packed * 0x11)
+        return array
+
+    def uniformValue(self, name):
+        """
+        If the named array is stored as a single value, return it, otherwise return None. Does not examine full
+        arrays.
+
+        :type name: str
+        :rtype: int | None
+        """
+        if name in self.__dict__:
+            return None
+        value = self._packed.get(name)
+        if isinstance(value, numpy.ndarray):
+            return None
+        return value
+
+    def setUniform(self, name, value):
+        """
+        Set every element of the named array to value, discarding the array.
+
+        :type name: str
+        :type value: int
+        """
+        self.__dict__.pop(name, None)
+        self._packed[name] = int(value)
+        self.dirty = True
+
+    def readArray(self, name):
+        """
+        Return the named array for reading. Packed arrays are unpacked into a temporary array, and a uniform array
+        is returned as a read-only array that uses no memory.
+
+        :type name: str
+        :rtype: ndarray
+        """
+        array = self.__dict__.get(name)
+        if array is not None:
+            return array
+
+        packed = self._packed.get(name)
+        if packed is None:
+            raise AttributeError(name)
+        if not isinstance(packed, numpy.ndarray):
+            value = numpy.array(packed, 'uint16' if name == "Blocks" else 'uint8')
+            return numpy.broadcast_to(value, SECTION_SHAPE)
+        return self._expand(name)
+
+    def getArrayFlat(self, name, index):
+        """
+        Return the elements of the named array at the given flat (YZX) indexes.
+
+        :type name: str
+        :type index: ndarray
+        :rtype: ndarray
+        """
+        array = self.__dict__.get(name)
+        if array is not None:
+            return array.take(index)
+
+        packed = self._packed[name]
+        if not isinstance(packed, numpy.ndarray):
+            result = numpy.empty(index.shape, 'uint16' if name == "Blocks" else 'uint8')
+            result.fill(packed)
+            return result
+        if name == "Blocks":
+            return packed.take(index)
+
+        values = packed.take(index >> 1)
+        return ((values >> ((index & 1) << 2)) & 0xf).astype('uint8')
+
+    def setArrayFlat(self, name, index, values):
+        """
+        Set the elements of the named array at the given flat (YZX) indexes. If values has one element, it is used
+        for every index.
+
+        :type name: str
+        :type index: ndarray
+        :type values: ndarray
+        """
+        array = self.__dict__.get(name)
+        if array is None:
+            packed = self._packed[name]
+            values = numpy.asarray(values)
+            if not isinstance(packed, numpy.ndarray) and (values == packed).all():
+                return
+
+        self.dirty = True
+        if array is None:
+            if not isinstance(packed, numpy.ndarray):
+                if not self._keepPacked or (name == "Blocks" and packed > 255):
+                    array = self._unpack(name)
+                elif name == "Blocks":
+                    value = packed
+                    packed = self._packed[name] = numpy.empty(SECTION_SHAPE, 'uint8')
+                    packed.fill(value)
+                else:
+                    packed = self._packed[name] = self._packedNibbles(name)
+
+            if array is None:
+                if name != "Blocks":
+                    putNibbles(packed, index, values)
+                    return
+                if not values.size or values.max() <= 255:
+                    packed.put(index, values)
+                    return
+                array = self._unpack(name)
+
+        array.put(index, values)
+
+    def isUniform(self, name, value):
+        """
+        Return True if every element of the named array equals value.
+        """
+        array = self.__dict__.get(name)
+        if array is None:
+            packed = self._packed[name]
+            if not isinstance(packed, numpy.ndarray):
+                return packed == value
+            if name != "Blocks":
+                return bool((packed == value * 0x11).all())
+            array = packed
+
+        return bool((array == value).all())
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by this section's arrays.
+        """
+        size = 0
+        for name in ("Blocks",) + NIBBLE_ARRAY_NAMES:
+            array = self.__dict__.get(name)
+            if array is None:
+                array = self._packed.get(name)
+            if isinstance(array, numpy.ndarray):
+                size += array.nbytes
+
+        if not self.dirty:
+            for name in SAVED_ARRAY_NAMES:
+                tag = self.old_section_tag.get(name)
+                if tag is not None and tag.value is not self._packed.get(name):
+                    size += tag.value.nbytes
+        return size
 
     def buildNBTTag(self):
         """
-        Return a TAG_Compound for saving this section to a chunk.
+        Return a TAG_Compound for saving this section to a chunk. If the section is not dirty, its tag is returned
+        as it was loaded or last built.
         """
         section_tag = self.old_section_tag
+        if not self.dirty:
+            return section_tag
 
-        Blocks = self.Blocks
-        Data = packNibbleArray(self.Data)
-        BlockLight = packNibbleArray(self.BlockLight)
-        SkyLight = packNibbleArray(self.SkyLight)
-
-        add = Blocks >> 8
-        if add.any():
-            section_tag["Add"] = nbt.TAG_Byte_Array(packNibbleArray(add).astype('uint8'))
+        Blocks = self._packed.get("Blocks")
+        if isinstance(Blocks, numpy.ndarray) and "Blocks" not in self.__dict__:
+            section_tag.pop("Add", None)
+        else:
+            Blocks = self.readArray("Blocks")
+            add = Blocks >> 8
+            if add.any():
+                section_tag["Add"] = nbt.TAG_Byte_Array(packNibbleArray(add).astype('uint8'))
+            else:
+                section_tag.pop("Add", None)
 
-        section_tag['Blocks'] = nbt.TAG_Byte_Array(numpy.array(Blocks, 'uint8'))
-        section_tag['Data'] = nbt.TAG_Byte_Array(Data)
-        section_tag['BlockLight'] = nbt.TAG_Byte_Array(BlockLight)
-        section_tag['SkyLight'] = nbt.TAG_Byte_Array(SkyLight)
+        section_tag['Blocks'] = nbt.TAG_Byte_Array(numpy.ascontiguousarray(Blocks, 'uint8'))
+        section_tag['Data'] = nbt.TAG_Byte_Array(self._packedNibbles("Data"))
+        section_tag['BlockLight'] = nbt.TAG_Byte_Array(self._packedNibbles("BlockLight"))
+        section_tag['SkyLight'] = nbt.TAG_Byte_Array(self._packedNibbles("SkyLight"))
 
         section_tag["Y"] = nbt.TAG_Byte(self.Y)
+        self._dirty = self._exposed  # Keeps the arrays just added to section_tag
         return section_tag
 
 
+def putNibbles(packedData, index, values):
+    """
+    Set the 4-bit elements at the given flat indexes of a packed nibble array. If values has one element, it is used
+    for every index.
+    """
+    flat = packedData.reshape(-1)
+    values = numpy.asarray(values, 'uint8') & 0xf
+
+    # Even and odd indexes are written separately so that two elements sharing a byte don't overwrite each other
+    odd = (index & 1).astype(bool)
+    for selected, mask, shift in ((~odd, 0xf0, 0), (odd, 0x0f, 4)):
+        if not selected.any():
+            continue
+        byteIndex = index[selected] >> 1
+        selectedValues = values if values.size == 1 else values.reshape(-1)[selected]
+        flat[byteIndex] = (flat[byteIndex] & mask) | (selectedValues << shift)
+
+
 class AnvilChunkData(object):
     """ This is the chunk data backing a WorldEditorChunk. Chunk data is retained by the WorldEditor until its
     WorldEditorChunk is no longer used, then it is either cached in memory, discarded, or written to disk according to
@@ -200,6 +510,8 @@ class AnvilChunkData(object):
         self.rootTag = rootTag
         self.dirty = False
         self._sections = {}
+        self._Entities = None
+        self._TileEntities = None
 
         if create:
             self._create()
@@ -211,11 +523,6 @@ class AnvilChunkData(object):
             levelTag["Biomes"] = nbt.TAG_Byte_Array(numpy.empty((16, 16), 'uint8'))
             levelTag["Biomes"].value[:] = -1
 
-        self.Entities = [PCEntityRef(tag) for tag in self.rootTag["Level"]["Entities"]]
-        del self.rootTag["Level"]["Entities"]
-        self.TileEntities = [PCTileEntityRef(tag) for tag in self.rootTag["Level"]["TileEntities"]]
-        del self.rootTag["Level"]["TileEntities"]
-
     def _create(self):
         chunkTag = nbt.TAG_Compound()
         chunkTag.name = ""
@@ -242,7 +549,7 @@ class AnvilChunkData(object):
 
         for sec in self.rootTag["Level"].pop("Sections", []):
             y = sec["Y"].value
-            self._sections[y] = AnvilSection(sec)
+            self._sections[y] = AnvilSection(sec, self.adapter.packedSections)
 
 
     def buildNBTTag(self):
@@ -254,17 +561,21 @@ class AnvilChunkData(object):
         sections = nbt.TAG_List()
         for _, section in self._sections.iteritems():
 
-            if (not section.Blocks.any() and
-                    not section.BlockLight.any() and
-                    (section.SkyLight == 15).all()):
+            if (section.isUniform("Blocks", 0) and
+                    section.isUniform("BlockLight", 0) and
+                    section.isUniform("SkyLight", 15)):
                 continue
 
             sanitizeBlocks(section, self.adapter.blocktypes)
             sections.append(section.buildNBTTag())
 
-        tag["Level"]["Sections"] = sections
-        tag["Level"]["Entities"] = nbt.TAG_List([ref.rootTag for ref in self.Entities])
-        tag["Level"]["TileEntities"] = nbt.TAG_List([ref.rootTag for ref in self.TileEntities])
+        levelTag = tag["Level"]
+        levelTag["Sections"] = sections
+        # Entity lists that were never accessed are still in rootTag and were copied unchanged
+        if self._Entities is not None or "Entities" not in levelTag:
+            levelTag["Entities"] = nbt.TAG_List([ref.rootTag for ref in self.Entities])
+        if self._TileEntities is not None or "TileEntities" not in levelTag:
+            levelTag["TileEntities"] = nbt.TAG_List([ref.rootTag for ref in self.TileEntities])
 
         log.debug(u"Saved chunk {0}".format(self))
         return tag
@@ -292,8 +603,11 @@ class AnvilChunkData(object):
             if not create:
                 return None
             else:
-                section = AnvilSection()
+                section = AnvilSection(packed=self.adapter.packedSections)
                 section.Y = cy
+                if not any(y > cy for y in self._sections):
+                    # A new section above the chunk's other sections is in full skylight
+                    section.setUniform("SkyLight", 15)
                 self._sections[cy] = section
 
         return section
@@ -307,6 +621,33 @@ class AnvilChunkData(object):
     def blocktypes(self):
         return self.adapter.blocktypes
 
+    # --- Entities ---
+
+    # Entity and tile entity tags are converted to refs on first access. Until then, they stay in rootTag, where
+    # they may not have been parsed yet.
+
+    @property
+    def Entities(self):
+        if self._Entities is None:
+            self._Entities = [PCEntityRef(tag) for tag in self.rootTag["Level"].pop("Entities", [])]
+        return self._Entities
+
+    @Entities.setter
+    def Entities(self, value):
+        self.rootTag["Level"].pop("Entities", None)
+        self._Entities = value
+
+    @property
+    def TileEntities(self):
+        if self._TileEntities is None:
+            self._TileEntities = [PCTileEntityRef(tag) for tag in self.rootTag["Level"].pop("TileEntities", [])]
+        return self._TileEntities
+
+    @TileEntities.setter
+    def TileEntities(self, value):
+        self.rootTag["Level"].pop("TileEntities", None)
+        self._TileEntities = value
+
     @property
     def Biomes(self):
         return self.rootTag["Level"]["Biomes"].value.reshape((16, 16))
@@ -375,6 +716,15 @@ class AnvilWorldAdapter(object):
     EntityRef = PCEntityRef
     TileEntityRef = PCTileEntityRef
 
+    # If True, chunk sections are kept in memory in their saved form and unpacked when needed. See AnvilSection.
+    packedSections = False
+
+    # zlib compression levels for chunks written to undo revisions, which are written often and discarded, and for
+    # chunks written to the world folder by saveChanges. If they are equal, saveChanges copies chunks from the undo
+    # revisions without recompressing them.
+    revisionCompressionLevel = regionfile.DEFAULT_COMPRESSION_LEVEL
+    saveCompressionLevel = regionfile.DEFAULT_COMPRESSION_LEVEL
+
     def __init__(self, filename=None, create=False, readonly=False, resume=None):
         """
         Load a Minecraft for PC level (Anvil format) from the given filename. It can point to either
@@ -491,6 +841,7 @@ class AnvilWorldAdapter(object):
         if self.metadata.dirty:
             self.selectedRevision.writeFile("level.dat", self.metadata.metadataTag.save())
             self.metadata.dirty = False
+        self.selectedRevision.syncToDisk()
 
     def saveChanges(self):
         """
@@ -503,7 +854,11 @@ class AnvilWorldAdapter(object):
             raise IOError("World is opened read only.")
 
         self.checkSessionLock()
-        self.revisionHistory.writeAllChanges(self.selectedRevision)
+        if self.saveCompressionLevel != self.revisionCompressionLevel:
+            level = self.saveCompressionLevel
+        else:
+            level = None  # Chunks are copied from the undo revisions without recompressing them
+        self.revisionHistory.writeAllChanges(self.selectedRevision, level)
         self.selectedRevision = self.revisionHistory.getHead()
 
     def close(self):
@@ -714,7 +1069,7 @@ class AnvilWorldAdapter(object):
         """
         try:
             data = self.selectedRevision.readChunkBytes(cx, cz, dimName)
-            chunkTag = nbt.load(buf=data)
+            chunkTag = nbt.load(buf=data, lazy=True)
             log.debug("_getChunkData: Chunk %s loaded (%s bytes)", (cx, cz), len(data))
             chunkData = AnvilChunkData(self, cx, cz, dimName, chunkTag)
 
@@ -723,14 +1078,112 @@ class AnvilWorldAdapter(object):
 
         return chunkData
 
+    def readChunkCompressed(self, cx, cz, dimName):
+        """
+        Return the compressed data of chunk (cx, cz) in the given dimension as a (data, fmt) tuple, to be passed to
+        decodeChunk. Raise ChunkNotPresent if not found.
+
+        Optional. WorldEditor uses this and decodeChunk to decompress and parse chunks on worker threads.
+
+        :type cx: int or dtype
+        :type cz: int or dtype
+        :type dimName: str
+        :return:
+        :rtype: (str, int)
+        """
+        data, fmt = self.selectedRevision.readChunkCompressed(cx, cz, dimName)
+        return str(data), fmt  # copy out of a memory-mapped region file before handing it to another thread
+
+    def decodeChunk(self, cx, cz, dimName, data, fmt):
+        """
+        Decompress and parse data returned by readChunkCompressed and return it as an AnvilChunkData. Does not access
+        the world's files, so it is safe to call from a worker thread.
+
+        :type cx: int or dtype
+        :type cz: int or dtype
+        :type dimName: str
+        :type data: str
+        :type fmt: int
+        :return:
+        :rtype: AnvilChunkData
+        """
+        try:
+            chunkTag = nbt.load(buf=decompress(data, fmt), lazy=True)
+            chunkData = AnvilChunkData(self, cx, cz, dimName, chunkTag)
+
+        except (KeyError, IndexError, zlib.error) as e:  # Missing nbt keys, lists too short, decompression failure
+            raise AnvilChunkFormatError("Error loading chunk: %r" % e)
+
+        return chunkData
+
+    def scanChunkEntities(self, cx, cz, dimName, kw, tileEntities=False):
+        """
+        Return refs for the entities in chunk (cx, cz) whose tags have the values given by kw, without loading the
+        rest of the chunk. Entities that do not have a tag named in kw do not match. The refs are copies; changing
+        them does not change the chunk. Raise ChunkNotPresent if not found.
+
+        Optional. WorldEditorDimension uses this to search chunks that are not loaded.
+
+        :type cx: int or dtype
+        :type cz: int or dtype
+        :type dimName: str
+        :param kw: Maps tag names to values, e.g. {"id": "Chest"}
+        :type kw: dict
+        :param tileEntities: If True, search the chunk's tile entities instead of its entities
+        :type tileEntities: bool
+        :rtype: list of PCEntityRef | list of PCTileEntityRef
+        """
+        data, fmt = self.selectedRevision.readChunkCompressed(cx, cz, dimName)
+        try:
+            if tileEntities:
+                tags = nbt.scan(decompress(data, fmt), ("Level", "TileEntities"), kw)
+                return [PCTileEntityRef(tag) for tag in tags]
+            else:
+                tags = nbt.scan(decompress(data, fmt), ("Level", "Entities"), kw)
+                return [PCEntityRef(tag) for tag in tags]
+
+        except (nbt.NBTFormatError, zlib.error) as e:
+            raise AnvilChunkFormatError("Error scanning chunk: %r" % e)
+
     def writeChunk(self, chunk):
         """
         Write the given AnvilChunkData to the current revision.
 
         :type chunk: mceditlib.anvil.adapter.AnvilChunkData
         """
+        data, fmt = self.encodeChunk(chunk)
+        self.selectedRevision.writeChunkCompressed(chunk.cx, chunk.cz, chunk.dimName, data, fmt)
+
+    def encodeChunk(self, chunk):
+        """
+        Serialize and compress the given AnvilChunkData and return it as a (data, fmt) tuple, to be passed to
+        writeChunkCompressed. Does not access the world's files, so it is safe to call from a worker thread.
+
+        Optional. WorldEditor uses this and writeChunkCompressed to compress evicted chunks on a worker thread.
+
+        :type chunk: mceditlib.anvil.adapter.AnvilChunkData
+        :rtype: (str, int)
+        """
+        if self.selectedRevision is self.revisionHistory.rootNode:
+            level = self.saveCompressionLevel  # No undo revision, so this is written straight to the world folder
+        else:
+            level = self.revisionCompressionLevel
+
         tag = chunk.buildNBTTag()
-        self.selectedRevision.writeChunkBytes(chunk.cx, chunk.cz, chunk.dimName, tag.save(compressed=False))
+        data = tag.save(compressor=zlib.compressobj(level))
+        return data, regionfile.RegionFile.VERSION_DEFLATE
+
+    def writeChunkCompressed(self, cx, cz, dimName, data, fmt):
+        """
+        Write chunk data returned by encodeChunk to the current revision.
+
+        :type cx: int or dtype
+        :type cz: int or dtype
+        :type dimName: str
+        :type data: str
+        :type fmt: int
+        """
+        self.selectedRevision.writeChunkCompressed(cx, cz, dimName, data, fmt)
 
     def createChunk(self, cx, cz, dimName):
         """
@@ -745,7 +1198,7 @@ class AnvilWorldAdapter(object):
         if self.selectedRevision.containsChunk(cx, cz, dimName):
             raise ValueError("Chunk %s already exists in dim %s", (cx, cz), dimName)
         chunk = AnvilChunkData(self, cx, cz, dimName, create=True)
-        self.selectedRevision.writeChunkBytes(cx, cz, dimName, chunk.buildNBTTag().save(compressed=False))
+        self.writeChunk(chunk)
         return chunk
 
     def deleteChunk(self, cx, cz, dimName):
@@ -7,16 +7,22 @@ from mceditlib.exceptions import ChunkNotPresent
 
 log = logging.getLogger(__name__)
 
-from mceditlib.pc.regionfile import RegionFile
+from mceditlib.pc.regionfile import RegionFile, DEFAULT_COMPRESSION_LEVEL
 import os
 
 
 class AnvilWorldFolder(object):
-    def __init__(self, filename, create=False):
+    def __init__(self, filename, create=False, mmapRegionFiles=None, deferRegionHeaders=None):
         '''
 
         :type filename: str or unicode
         :type create: bool
+        :param mmapRegionFiles: If True, region files are kept open and memory-mapped until close() is called.
+            Defaults to the class attribute of the same name.
+        :type mmapRegionFiles: bool or None
+        :param deferRegionHeaders: If True, region file headers are only written by syncToDisk() and close().
+            Defaults to the class attribute of the same name.
+        :type deferRegionHeaders: bool or None
         '''
         if not os.path.exists(filename):
             if create:
@@ -27,6 +33,11 @@ class AnvilWorldFolder(object):
         elif not os.path.isdir(filename):
             raise IOError("AnvilWorldFolder: Not a folder: %s" % filename)
 
+        if mmapRegionFiles is not None:
+            self.mmapRegionFiles = mmapRegionFiles
+        if deferRegionHeaders is not None:
+            self.deferRegionHeaders = deferRegionHeaders
+
         self.filename = filename
         self.regionFiles = {}
         self._dimensionNames = set(self._findDimensions())
@@ -37,6 +48,16 @@ class AnvilWorldFolder(object):
     def __repr__(self):
         return "AnvilWorldFolder(%s)" % repr(self.filename)
 
+    # --- Resource limits ---
+
+    # Keep one filehandle and memory map open per region file instead of reopening the file for every chunk access.
+    # Each open region file holds a filehandle, so this is off by default.
+    mmapRegionFiles = False
+
+    # Keep region file offset and timestamp tables in memory and write them once per region file in syncToDisk()
+    # instead of rewriting both tables on every chunk write.
+    deferRegionHeaders = False
+
     # --- File paths ---
 
     def getFilePath(self, path):
@@ -147,16 +168,41 @@ class AnvilWorldFolder(object):
         if not os.path.exists(path):
             self._dimensionNames.add(dimName)
             self._regionPositionsByDim[dimName].add((rx, rz))
-        regionFile = RegionFile(path)
+        regionFile = RegionFile(path, mmapped=self.mmapRegionFiles, deferHeaderWrites=self.deferRegionHeaders)
         self.regionFiles[rx, rz, dimName] = regionFile
         return regionFile
 
+    def compactAll(self):
+        """
+        Compact every region file in every dimension, rewriting its chunks contiguously in spatial order and
+        truncating the file. See RegionFile.compact.
+
+        :return: Total number of bytes the region files shrank by
+        :rtype: int
+        """
+        saved = 0
+        for dimName in self.listDimensions():
+            for rx, rz in self._regionPositionsByDim[dimName]:
+                saved += self.getRegionFile(rx, rz, dimName).compact()
+
+        log.info(u"Compacted region files in %s, saved %d bytes", self.filename, saved)
+        return saved
+
     def getRegionForChunk(self, cx, cz, dimName):
         rx = cx >> 5
         rz = cz >> 5
         return self.getRegionFile(rx, rz, dimName)
 
+    def syncToDisk(self):
+        """
+        Write any deferred region file headers to disk.
+        """
+        for regionFile in self.regionFiles.itervalues():
+            regionFile.flush()
+
     def close(self):
+        for regionFile in self.regionFiles.itervalues():
+            regionFile.close()
         self.regionFiles = {}
 
     # --- Chunks and chunk listing ---
@@ -195,6 +241,7 @@ class AnvilWorldFolder(object):
                 log.info(u"Removing empty region file {0}".format(filename))
                 self._regionPositionsByDim[dimName].remove((rx, rz))
                 del self.regionFiles[rx, rz, dimName]
+                regionFile.close()
                 os.unlink(regionFile.path)
 
     def containsChunk(self, cx, cz, dimName):
@@ -213,6 +260,7 @@ class AnvilWorldFolder(object):
             rf.deleteChunk(cx & 0x1f, cz & 0x1f)
             if rf.chunkCount == 0:
                 del self.regionFiles[rx, rz, dimName]
+                rf.close()
                 os.unlink(rf.path)
 
     def readChunkBytes(self, cx, cz, dimName):
@@ -220,8 +268,16 @@ class AnvilWorldFolder(object):
             raise ChunkNotPresent((cx, cz))
         return self.getRegionForChunk(cx, cz, dimName).readChunkBytes(cx, cz)
 
-    def writeChunkBytes(self, cx, cz, dimName, data):
-        self.getRegionForChunk(cx, cz, dimName).writeChunkBytes(cx, cz, data)
+    def readChunkCompressed(self, cx, cz, dimName):
+        if not self.containsChunk(cx, cz, dimName):
+            raise ChunkNotPresent((cx, cz))
+        return self.getRegionForChunk(cx, cz, dimName).readChunkCompressed(cx, cz)
+
+    def writeChunkBytes(self, cx, cz, dimName, data, compressionLevel=DEFAULT_COMPRESSION_LEVEL):
+        self.getRegionForChunk(cx, cz, dimName).writeChunkBytes(cx, cz, data, compressionLevel)
+
+    def writeChunkCompressed(self, cx, cz, dimName, data, fmt):
+        self.getRegionForChunk(cx, cz, dimName).writeChunkCompressed(cx, cz, data, fmt)
 
     def copyChunkFrom(self, sourceFolder, cx, cz, dimName):
         """
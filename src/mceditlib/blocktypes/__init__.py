@@ -73,6 +73,48 @@ def openResource(filename):
     return file(path)
 
 
+# Bits of BlockTypeTables.flags
+BLOCK_OPAQUE_CUBE = 0x1  # Hides the faces of neighboring blocks
+BLOCK_TRANSPARENT = 0x2  # Has no opacity; full skylight passes through unchanged
+BLOCK_EMITS_LIGHT = 0x4  # Has brightness
+BLOCK_MODEL = 0x8  # Rendered using a block model (renderType 3)
+
+
+class BlockTypeTables(object):
+    def __init__(self, blocktypes, version):
+        """
+        Lookup tables derived from a BlockTypeSet, indexed by block ID unless noted. Get them from
+        `BlockTypeSet.tables`, which builds them once and rebuilds them after blocks are added. Do not modify them.
+
+        opacity: opacity clipped to 0..15
+        brightness: brightness clipped to 0..15
+        opaqueCube: boolean
+        renderType: 65536 entries, so any Blocks value may index it
+        flags: indexed by (ID, meta), combination of the BLOCK_ flags
+
+        :type blocktypes: BlockTypeSet
+        :param version: Value of `blocktypes.version` the tables were built from
+        :type version: int
+        """
+        self.version = version
+        self.opacity = numpy.clip(blocktypes.opacity, 0, 15).astype('uint8')
+        self.brightness = numpy.clip(blocktypes.brightness, 0, 15).astype('uint8')
+        self.opaqueCube = blocktypes.opaqueCube != 0
+
+        self.renderType = numpy.zeros((256*256,), 'uint8')
+        for block in blocktypes:
+            self.renderType[block.ID] = block.renderType
+
+        flags = numpy.zeros((id_limit, 16), 'uint8')
+        flags[self.opaqueCube] |= BLOCK_OPAQUE_CUBE
+        flags[self.opacity == 0] |= BLOCK_TRANSPARENT
+        flags[self.brightness != 0] |= BLOCK_EMITS_LIGHT
+        for block in blocktypes:
+            if block.renderType == 3:
+                flags[block.ID, block.meta] |= BLOCK_MODEL
+        self.flags = flags
+
+
 class BlockTypeSet(object):
     defaultColor = (0xc9, 0x77, 0xf0, 0xff)
 
@@ -114,6 +156,20 @@ class BlockTypeSet(object):
         self.name = "Unnamed Set"
         self.namePrefix = "minecraft:"
 
+        self.version = 0  # Incremented when blocks are added
+        self._tables = None
+
+    @property
+    def tables(self):
+        """
+        Lookup tables derived from this set's block attributes.
+
+        :rtype: BlockTypeTables
+        """
+        if self._tables is None or self._tables.version != self.version:
+            self._tables = BlockTypeTables(self, self.version)
+        return self._tables
+
     def getBlockTypeAttr(self, block, attr):
         """
         Called when accessing an attribute of a BlockType.
@@ -234,6 +290,7 @@ class BlockTypeSet(object):
 
                 self.IDsByState[nameAndState] = ID, meta
             self.statesByID = {v: k for (k, v) in self.IDsByState.iteritems()}
+            self.version += 1
             assert "minecraft:air" in self.IDsByState
             assert (0,0) in self.statesByID
         except EnvironmentError as e:
@@ -294,6 +351,7 @@ class BlockTypeSet(object):
             return
         ID, meta = IDmeta
         self.allBlocks.append(BlockType(ID, meta, self))
+        self.version += 1
 
         oldJson = self.blockJsons.get(internalName + blockState)
         if oldJson is None:
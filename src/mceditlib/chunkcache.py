@@ -0,0 +1,267 @@
+"""
+    chunkcache.py
+
+    Least-recently-used cache for the chunk data held in memory by a WorldEditor, and a write-behind queue for
+    dirty chunks evicted from it.
+"""
+from __future__ import absolute_import
+import collections
+import logging
+import sys
+import threading
+
+log = logging.getLogger(__name__)
+
+SECTION_ARRAY_NAMES = ("Blocks", "Data", "BlockLight", "SkyLight")
+
+
+def chunkDataMemoryUsage(chunkData):
+    """
+    Return the number of bytes used by the section arrays of the given chunk data. Other chunk contents such as
+    entities and tile entities are not counted. Sections that store their arrays in another form may report their
+    size with an `nbytes` attribute.
+    """
+    size = 0
+    for cy in chunkData.sectionPositions():
+        section = chunkData.getSection(cy)
+        if section is None:
+            continue
+        nbytes = getattr(section, "nbytes", None)
+        if nbytes is not None:
+            size += nbytes
+            continue
+        for name in SECTION_ARRAY_NAMES:
+            array = getattr(section, name, None)
+            if array is not None:
+                size += array.nbytes
+    return size
+
+
+class ChunkDataCache(object):
+    """
+    Maps (cx, cz, dimName) tuples to chunk data objects, ordered from least to most recently used.
+
+    Looking up a chunk with `get` marks it as recently used. The memory used by each chunk is measured when it is
+    stored and each time it is looked up, so `memoryUsed` is an estimate for chunks that gain sections while in use.
+
+    :ivar hits: Number of calls to `get` that found the chunk
+    :ivar misses: Number of calls to `get` that did not find the chunk
+    :ivar evictions: Number of chunks removed by `evict`
+    :ivar memoryUsed: Estimated bytes used by all cached chunks' section arrays
+    """
+
+    def __init__(self):
+        self._chunks = collections.OrderedDict()
+        self._sizes = {}
+        self.memoryUsed = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return "ChunkDataCache(chunks=%d, memoryUsed=%d, hits=%d, misses=%d, evictions=%d)" % (
+            len(self), self.memoryUsed, self.hits, self.misses, self.evictions)
+
+    # --- Mapping methods ---
+
+    def __contains__(self, key):
+        return key in self._chunks
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+    def itervalues(self):
+        return self._chunks.itervalues()
+
+    def iteritems(self):
+        return self._chunks.iteritems()
+
+    def get(self, key, default=None):
+        chunkData = self._chunks.pop(key, None)
+        if chunkData is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._chunks[key] = chunkData
+        self._measure(key, chunkData)
+        return chunkData
+
+    def store(self, key, chunkData):
+        self._chunks.pop(key, None)
+        self._chunks[key] = chunkData
+        self._measure(key, chunkData)
+
+    def pop(self, key, default=None):
+        chunkData = self._chunks.pop(key, None)
+        if chunkData is None:
+            return default
+        self.memoryUsed -= self._sizes.pop(key)
+        return chunkData
+
+    def clear(self):
+        self._chunks.clear()
+        self._sizes.clear()
+        self.memoryUsed = 0
+
+    def _measure(self, key, chunkData):
+        size = chunkDataMemoryUsage(chunkData)
+        self.memoryUsed += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+
+    # --- Eviction ---
+
+    def evict(self, chunkLimit, memoryLimit, canEvict):
+        """
+        Remove least recently used chunks until the cache holds no more than chunkLimit chunks and memoryLimit
+        bytes, and iterate over the removed (key, chunkData) pairs. Chunks for which canEvict(key) returns False
+        are kept and marked as recently used. Stops early if no more chunks can be evicted.
+
+        :type chunkLimit: int
+        :type memoryLimit: int
+        :type canEvict: callable
+        :rtype: iterator [((int, int, str), object)]
+        """
+        kept = 0
+        while len(self._chunks) > chunkLimit or self.memoryUsed > memoryLimit:
+            if kept >= len(self._chunks):
+                break
+
+            key, chunkData = self._chunks.popitem(last=False)
+            if not canEvict(key):
+                self._chunks[key] = chunkData
+                kept += 1
+                continue
+
+            self.memoryUsed -= self._sizes.pop(key)
+            self.evictions += 1
+            yield key, chunkData
+
+
+class ChunkWriteQueue(object):
+    """
+    Bounded queue that encodes (serializes and compresses) dirty chunks on a background thread. The encoded chunks
+    are written by calling `writeFinished` or `drain` on the thread that owns the world, so the world's files are
+    only ever accessed from one thread.
+
+    A queued chunk is not touched by any other thread, so it can be taken back with `take` and modified again
+    without waiting for it to be written.
+    """
+
+    def __init__(self, encodeFunc, writeFunc, limit=32):
+        """
+        :param encodeFunc: Called on the worker thread with a chunk data object. Returns the encoded chunk.
+        :type encodeFunc: callable
+        :param writeFunc: Called on the owning thread with the chunk data object and the result of encodeFunc.
+        :type writeFunc: callable
+        :param limit: Maximum number of chunks held by the queue before `put` blocks.
+        :type limit: int
+        """
+        self._encode = encodeFunc
+        self._write = writeFunc
+        self.limit = limit
+
+        self._condition = threading.Condition()
+        self._queued = collections.OrderedDict()  # key -> chunkData, waiting for the worker
+        self._working = None  # key of the chunk being encoded
+        self._finished = collections.deque()  # (key, chunkData, result, exc_info)
+        self._thread = None
+
+    def __len__(self):
+        with self._condition:
+            return len(self._queued) + len(self._finished) + (self._working is not None)
+
+    def __contains__(self, key):
+        with self._condition:
+            return key in self._queued or key == self._working or any(item[0] == key for item in self._finished)
+
+    def put(self, key, chunkData):
+        """
+        Queue a chunk to be encoded and written. Blocks while the queue is full.
+        """
+        self.writeFinished()
+        while len(self) >= self.limit:
+            with self._condition:
+                if not self._finished:
+                    self._condition.wait()
+            self.writeFinished()
+
+        with self._condition:
+            self._queued[key] = chunkData
+            self._condition.notify_all()
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ChunkWriteQueue")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def take(self, key):
+        """
+        Remove the chunk with the given key from the queue and return it, or return None if it is not queued. If the
+        chunk is being encoded, waits until the worker is done with it. The chunk is not written.
+        """
+        with self._condition:
+            chunkData = self._queued.pop(key, None)
+            if chunkData is not None:
+                return chunkData
+
+            while self._working == key:
+                self._condition.wait()
+
+            for item in self._finished:
+                if item[0] == key:
+                    self._finished.remove(item)
+                    return item[1]
+
+        return None
+
+    def writeFinished(self):
+        """
+        Write all chunks that have been encoded so far. Re-raises any exception raised while encoding a chunk.
+        """
+        while True:
+            with self._condition:
+                if not self._finished:
+                    return
+                key, chunkData, result, exc_info = self._finished.popleft()
+                self._condition.notify_all()
+
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            self._write(chunkData, result)
+
+    def drain(self):
+        """
+        Wait until every queued chunk has been encoded and written.
+        """
+        while True:
+            self.writeFinished()
+            with self._condition:
+                if not self._queued and self._working is None and not self._finished:
+                    return
+                if not self._finished:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queued:
+                    self._condition.wait()
+                key, chunkData = self._queued.popitem(last=False)
+                self._working = key
+
+            try:
+                result = self._encode(chunkData)
+                exc_info = None
+            except Exception:
+                result = None
+                exc_info = sys.exc_info()
+                log.exception("Error while encoding chunk %s", key)
+
+            with self._condition:
+                self._finished.append((key, chunkData, result, exc_info))
+                self._working = None
+                self._condition.notify_all()
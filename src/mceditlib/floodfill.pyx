@@ -0,0 +1,228 @@
+#cython: boundscheck=False, wraparound=False
+"""
+    floodfill
+
+    Flood fill that works directly on section arrays. The fill visits one section at a time, keeping a visited map
+    for each section it enters. Positions that spill over into a neighboring section are queued as seeds for that
+    section.
+"""
+from __future__ import absolute_import, division, print_function
+import collections
+import logging
+
+import numpy
+cimport numpy
+
+from libc.limits cimport LONG_MAX
+from libc.stdlib cimport malloc, free
+from libc.string cimport memset
+
+log = logging.getLogger(__name__)
+
+cdef int SECTION_VOLUME = 4096
+cdef int MATCH_TABLE_SIZE = 65536
+
+cdef int *FACE_DX = [-1, 1, 0, 0, 0, 0]
+cdef int *FACE_DY = [0, 0, -1, 1, 0, 0]
+cdef int *FACE_DZ = [0, 0, 0, 0, -1, 1]
+
+
+cdef long fillSection(unsigned short[:, :, :] Blocks, unsigned char[:, :, :] Data, unsigned char[:] visited,
+                      int *stack, list seeds, int ox, int oy, int oz, int *boundsMin, int *boundsMax,
+                      unsigned char *matchTable, bint checkData, unsigned char targetData,
+                      unsigned short fillID, unsigned char fillData, long maxCount, list exits) except -1:
+    """
+    Fill the matching blocks connected to the given seeds within one section. (ox, oy, oz) is the section's origin.
+    Neighbors inside the bounds but outside the section are appended to exits as world coordinates. Returns the
+    number of blocks filled.
+    """
+    cdef int height = Blocks.shape[0], length = Blocks.shape[1], width = Blocks.shape[2]
+    cdef int top = 0, index, nindex, x, y, z, nx, ny, nz, face
+    cdef long count = 0
+
+    for index in seeds:
+        if visited[index]:
+            continue
+        y = index >> 8
+        z = (index >> 4) & 0xf
+        x = index & 0xf
+        if y >= height or z >= length or x >= width:
+            continue
+        if not matchTable[Blocks[y, z, x]] or (checkData and Data[y, z, x] != targetData):
+            continue
+        visited[index] = 1
+        stack[top] = index
+        top += 1
+
+    while top > 0 and count < maxCount:
+        top -= 1
+        index = stack[top]
+        y = index >> 8
+        z = (index >> 4) & 0xf
+        x = index & 0xf
+
+        Blocks[y, z, x] = fillID
+        Data[y, z, x] = fillData
+        count += 1
+
+        for face in range(6):
+            nx = x + FACE_DX[face]
+            ny = y + FACE_DY[face]
+            nz = z + FACE_DZ[face]
+            if not (boundsMin[0] <= ox + nx < boundsMax[0]
+                    and boundsMin[1] <= oy + ny < boundsMax[1]
+                    and boundsMin[2] <= oz + nz < boundsMax[2]):
+                continue
+
+            if nx < 0 or ny < 0 or nz < 0 or nx > 15 or ny > 15 or nz > 15:
+                exits.append((ox + nx, oy + ny, oz + nz))
+                continue
+            if ny >= height or nz >= length or nx >= width:
+                continue
+
+            nindex = ny << 8 | nz << 4 | nx
+            if visited[nindex]:
+                continue
+            if not matchTable[Blocks[ny, nz, nx]] or (checkData and Data[ny, nz, nx] != targetData):
+                continue
+            visited[nindex] = 1
+            stack[top] = nindex
+            top += 1
+
+    return count
+
+
+def floodFillIter(dimension, point, blockID, blockData=0, bounds=None, limit=None, checkData=True, matchIDs=()):
+    """
+    Replace the blocks connected to `point` that match the block at `point` with the given block. Iterates over
+    progress tuples of (blocksFilled, limit, status) in the format accepted by showProgress. The final value is the
+    total number of blocks filled.
+
+    Sections must store Blocks as uint16 and Data as uint8 arrays. Sections that are not present are only filled if
+    the block at `point` is air. Lighting is not updated.
+
+    :param dimension: Dimension to fill
+    :type dimension: mceditlib.worldeditor.WorldEditorDimension
+    :param point: Starting position
+    :type point: (int, int, int)
+    :param blockID: ID of the block to fill with
+    :type blockID: int
+    :param blockData: Metadata of the block to fill with
+    :type blockData: int
+    :param bounds: Only fill blocks inside this box. Defaults to the dimension's bounds.
+    :type bounds: mceditlib.geometry.BoundingBox | None
+    :param limit: Stop after filling this many blocks
+    :type limit: int | None
+    :param checkData: If False, blocks match the starting block regardless of their metadata
+    :type checkData: bool
+    :param matchIDs: If the starting block's ID is in this sequence, all of these IDs match it
+    :type matchIDs: sequence of int
+    :rtype: iterator [(int, int, str)]
+    """
+    cdef int *boundsMin
+    cdef int *boundsMax
+    cdef unsigned char *matchTable
+    cdef int *stack
+    cdef long count = 0, maxCount
+
+    if bounds is None:
+        bounds = dimension.bounds
+    else:
+        bounds = bounds.intersect(dimension.bounds)
+
+    x, y, z = point
+    if not (bounds.minx <= x < bounds.maxx and bounds.miny <= y < bounds.maxy and bounds.minz <= z < bounds.maxz):
+        return
+    if not dimension.containsChunk(x >> 4, z >> 4):
+        return
+
+    targetID = dimension.getBlockID(x, y, z)
+    targetData = dimension.getBlockData(x, y, z)
+    if targetID == blockID and (targetData == blockData or not checkData):
+        return
+
+    fillMissingSections = targetID == 0 and (targetData == 0 or not checkData)
+    maxCount = limit if limit is not None else LONG_MAX
+
+    matchTable = <unsigned char *>malloc(MATCH_TABLE_SIZE)
+    stack = <int *>malloc((SECTION_VOLUME + 6) * sizeof(int))
+    if matchTable == NULL or stack == NULL:
+        free(matchTable)
+        free(stack)
+        raise MemoryError
+
+    try:
+        boundsMin = stack + SECTION_VOLUME
+        boundsMax = boundsMin + 3
+        boundsMin[0], boundsMin[1], boundsMin[2] = bounds.minx, bounds.miny, bounds.minz
+        boundsMax[0], boundsMax[1], boundsMax[2] = bounds.maxx, bounds.maxy, bounds.maxz
+
+        memset(matchTable, 0, MATCH_TABLE_SIZE)
+        matchTable[targetID] = 1
+        if targetID in matchIDs:
+            for ID in matchIDs:
+                matchTable[ID] = 1
+
+        # maps (cx, cy, cz) to a list of flat indexes in the section, and to the section's visited map
+        pendingSeeds = {}
+        pendingOrder = collections.deque()
+        visitedMaps = {}
+
+        def addSeed(x, y, z):
+            key = x >> 4, y >> 4, z >> 4
+            seeds = pendingSeeds.get(key)
+            if seeds is None:
+                seeds = pendingSeeds[key] = []
+                pendingOrder.append(key)
+            seeds.append((y & 0xf) << 8 | (z & 0xf) << 4 | (x & 0xf))
+
+        addSeed(x, y, z)
+
+        while pendingOrder and count < maxCount:
+            key = pendingOrder.popleft()
+            seeds = pendingSeeds.pop(key)
+            cx, cy, cz = key
+            if not dimension.containsChunk(cx, cz):
+                continue
+
+            chunk = dimension.getChunk(cx, cz)
+            section = chunk.getSection(cy, create=fillMissingSections)
+            if section is None:
+                continue
+
+            visited = visitedMaps.get(key)
+            if visited is None:
+                visited = visitedMaps[key] = numpy.zeros(SECTION_VOLUME, 'uint8')
+
+            exits = []
+            filled = fillSection(section.Blocks, section.Data, visited, stack, seeds,
+                                 cx << 4, cy << 4, cz << 4, boundsMin, boundsMax,
+                                 matchTable, checkData, targetData, blockID, blockData,
+                                 maxCount - count, exits)
+            if filled:
+                count += filled
+                chunk.dirty = True
+
+            for ex, ey, ez in exits:
+                addSeed(ex, ey, ez)
+
+            yield count, limit or 0, "Filled %d blocks" % count
+
+    finally:
+        free(matchTable)
+        free(stack)
+
+    log.info("Flood fill: filled %d blocks", count)
+    yield count, limit or 0, "Filled %d blocks" % count
+
+
+def floodFill(dimension, point, blockID, blockData=0, bounds=None, limit=None, checkData=True, matchIDs=()):
+    """
+    Like floodFillIter, but runs the fill to completion and returns the number of blocks filled.
+
+    :rtype: int
+    """
+    count = 0
+    for count, _, _ in floodFillIter(dimension, point, blockID, blockData, bounds, limit, checkData, matchIDs):
+        pass
+    return count
@@ -0,0 +1,530 @@
+#cython: boundscheck=False, wraparound=False
+"""
+    lightengine
+
+    Light propagation that works directly on section arrays. Each section is processed in an 18x18x18 buffer that
+    holds the section's light and opacity along with a one block border taken from its six neighbors. Light that
+    spreads into the border is queued as seeds for the neighboring section, which is processed in turn.
+
+    Changed positions are relit in two phases for each light type. The removal phase darkens every position whose
+    light may have come through a changed position, and collects the lit positions around the darkened area. The
+    increase phase then spreads light from those positions and from light sources. The removal phase finishes in
+    every section before the increase phase starts.
+"""
+from __future__ import absolute_import, division, print_function
+import collections
+import logging
+
+import numpy
+
+from libc.stdlib cimport malloc, free
+
+log = logging.getLogger(__name__)
+
+DEF PADDED_VOLUME = 5832  # 18 ** 3
+DEF SECTION_VOLUME = 4096
+DEF BORDER_AREA = 1536  # 6 * 16 * 16
+
+# Face order matches floodfill: -x, +x, -y, +y, -z, +z. Offsets are for the padded YZX buffer.
+cdef int *FACE_OFFSET = [-1, 1, -324, 324, -18, 18]
+DEF FACE_DOWN = 2
+DEF FACE_UP = 3
+
+# Neighbor states
+DEF FACE_SECTION = 0  # Light may spread into the neighbor, which is created if it is missing
+DEF FACE_SOURCE = 1  # The neighbor is unlit sky with constant light; it is never changed
+DEF FACE_CLOSED = 2  # The neighbor is outside the world or its chunk is missing
+
+# Kinds of seeds written to the output arrays, stored in bits 8 and up of each code
+DEF SEED_REMOVE = 1  # Value is the level that went dark, plus 16 if the light was travelling down
+DEF SEED_INCREASE = 2  # Value is the level to set, or 0 to spread the position's current light
+DEF SEED_CHANGED = 0xff  # Removal seed for a changed position
+
+LIGHT_NAMES = ("BlockLight", "SkyLight")
+
+
+def _borderFaces():
+    # For each position in the padded buffer, 0 if it is inside the section, or the neighbor's face number + 1
+    faces = numpy.full((18, 18, 18), 7, 'uint8')
+    faces[1:17, 1:17, 1:17] = 0
+    faces[1:17, 1:17, 0] = 1
+    faces[1:17, 1:17, 17] = 2
+    faces[0, 1:17, 1:17] = 3
+    faces[17, 1:17, 1:17] = 4
+    faces[1:17, 0, 1:17] = 5
+    faces[1:17, 17, 1:17] = 6
+    return faces.ravel()
+
+BORDER_FACES = _borderFaces()
+
+# Padded buffer slices for each face's border, and the neighbor's section slices they are copied from
+BORDER_SLICES = [
+    numpy.s_[1:17, 1:17, 0], numpy.s_[1:17, 1:17, 17],
+    numpy.s_[0, 1:17, 1:17], numpy.s_[17, 1:17, 1:17],
+    numpy.s_[1:17, 0, 1:17], numpy.s_[1:17, 17, 1:17],
+]
+NEIGHBOR_SLICES = [
+    numpy.s_[:, :, 15], numpy.s_[:, :, 0],
+    numpy.s_[15], numpy.s_[0],
+    numpy.s_[:, 15, :], numpy.s_[:, 0, :],
+]
+FACE_DIRECTIONS = [(-1, 0, 0), (1, 0, 0), (0, -1, 0), (0, 1, 0), (0, 0, -1), (0, 0, 1)]
+INTERIOR = numpy.s_[1:17, 1:17, 1:17]
+
+
+cdef inline int spreadLight(int level, bint down, int opacity, bint sky) nogil:
+    # Return the light a position receives from a neighbor with the given level. Full skylight travels down
+    # through transparent blocks without dimming.
+    if sky and down and level == 15 and opacity == 0:
+        return 15
+    if opacity < 1:
+        opacity = 1
+    level -= opacity
+    return level if level > 0 else 0
+
+
+cdef int removalPass(unsigned char[:] light, unsigned char[:] opacity, unsigned char[:] emit,
+                     unsigned char[:] marks, unsigned char[:] border, int *faceState, bint sky,
+                     int[:] seedIndex, int[:] seedCode, int *queue, unsigned char *queueLevel,
+                     int[:] outIndex, int[:] outCode, bint *changed) nogil:
+    """
+    Darken the positions whose light may have come from the given removal seeds. Writes removal seeds for
+    neighboring sections and increase seeds for this and neighboring sections to outIndex and outCode, and returns
+    the number written.
+    """
+    cdef int i, p, n, f, b, code, level, nlevel, value
+    cdef int head = 0, tail = 0, count = 0
+    cdef bint down
+
+    for i in range(seedIndex.shape[0]):
+        p = seedIndex[i]
+        code = seedCode[i]
+        level = light[p]
+        if code == SEED_CHANGED:
+            light[p] = 0
+            changed[0] = True
+            queue[tail] = p
+            queueLevel[tail] = level
+            tail += 1
+            if emit[p]:
+                outIndex[count] = p
+                outCode[count] = SEED_INCREASE << 8 | emit[p]
+                count += 1
+            continue
+
+        if level == 0:
+            continue
+        value = code & 0xf
+        down = code >> 4
+        if level < value or (sky and down and value == 15 and level == 15):
+            light[p] = 0
+            changed[0] = True
+            queue[tail] = p
+            queueLevel[tail] = level
+            tail += 1
+            if emit[p]:
+                outIndex[count] = p
+                outCode[count] = SEED_INCREASE << 8 | emit[p]
+                count += 1
+        elif not marks[p]:
+            marks[p] = 1
+            outIndex[count] = p
+            outCode[count] = SEED_INCREASE << 8
+            count += 1
+
+    while head < tail:
+        p = queue[head]
+        level = queueLevel[head]
+        head += 1
+        for f in range(6):
+            n = p + FACE_OFFSET[f]
+            b = border[n]
+            if b and faceState[b - 1] == FACE_CLOSED:
+                continue
+            nlevel = light[n]
+            if nlevel == 0:
+                continue
+
+            if nlevel < level or (sky and f == FACE_DOWN and level == 15 and nlevel == 15):
+                if b:
+                    if faceState[b - 1] == FACE_SOURCE:
+                        continue
+                    light[n] = 0
+                    outIndex[count] = n
+                    outCode[count] = SEED_REMOVE << 8 | level | (f == FACE_DOWN) << 4
+                    count += 1
+                else:
+                    light[n] = 0
+                    changed[0] = True
+                    queue[tail] = n
+                    queueLevel[tail] = nlevel
+                    tail += 1
+                    if emit[n]:
+                        outIndex[count] = n
+                        outCode[count] = SEED_INCREASE << 8 | emit[n]
+                        count += 1
+            elif b and faceState[b - 1] == FACE_SOURCE:
+                # Constant light from outside the world can only be spread into this section from here
+                value = spreadLight(nlevel, f == FACE_UP, opacity[p], sky)
+                if value:
+                    outIndex[count] = p
+                    outCode[count] = SEED_INCREASE << 8 | value
+                    count += 1
+            elif not marks[n]:
+                # Spread this neighbor's light again during the increase phase
+                marks[n] = 1
+                outIndex[count] = n
+                outCode[count] = SEED_INCREASE << 8
+                count += 1
+
+    return count
+
+
+cdef int increasePass(unsigned char[:] light, unsigned char[:] opacity, unsigned char[:] marks,
+                      unsigned char[:] border, int *faceState, bint sky,
+                      int[:] seedIndex, int[:] seedCode, int *queue,
+                      int[:] outIndex, int[:] outCode, bint *changed) nogil:
+    """
+    Spread light from the given increase seeds. Writes increase seeds for neighboring sections to outIndex and
+    outCode, and returns the number written.
+    """
+    cdef int i, p, n, f, b, level, value
+    cdef int head = 0, tail = 0, count = 0
+
+    for i in range(seedIndex.shape[0]):
+        p = seedIndex[i]
+        value = seedCode[i] & 0xff
+        if value == 0:
+            if light[p] and not marks[p]:
+                marks[p] = 1
+                queue[tail] = p
+                tail += 1
+        elif value > light[p]:
+            light[p] = value
+            changed[0] = True
+            queue[tail] = p
+            tail += 1
+
+    while head < tail:
+        p = queue[head]
+        head += 1
+        level = light[p]
+        if level <= 1:
+            continue
+        for f in range(6):
+            n = p + FACE_OFFSET[f]
+            b = border[n]
+            if b and faceState[b - 1] != FACE_SECTION:
+                continue
+            value = spreadLight(level, f == FACE_DOWN, opacity[n], sky)
+            if value <= light[n]:
+                continue
+            light[n] = value
+            if b:
+                outIndex[count] = n
+                outCode[count] = SEED_INCREASE << 8 | value
+                count += 1
+            else:
+                changed[0] = True
+                queue[tail] = n
+                tail += 1
+
+    return count
+
+
+def setSectionLight(section, name, light):
+    """
+    Replace the named light array of a section. A light array with a single value is stored with the section's
+    `setUniform` method if it has one.
+    """
+    value = light.flat[0]
+    if hasattr(section, 'setUniform') and (light == value).all():
+        section.setUniform(name, value)
+    else:
+        getattr(section, name)[:] = light
+
+
+class LightEngine(object):
+    """
+    Relights one light type of a dimension. Seeds are queued by section with addChangedPositions or
+    addLightSources, then `propagate` runs the removal and increase phases.
+
+    :type dimension: mceditlib.worldeditor.WorldEditorDimension
+    :type name: str
+    """
+    def __init__(self, dimension, name):
+        self.dimension = dimension
+        self.name = name
+        self.sky = name == "SkyLight"
+
+        tables = dimension.blocktypes.tables
+        self.opacity = tables.opacity
+        self.brightness = None if self.sky else tables.brightness
+
+        bounds = dimension.bounds
+        self.minCY = bounds.miny >> 4
+        self.maxCY = (bounds.maxy - 1) >> 4
+
+        # (cx, cy, cz) -> list of (index, code) array pairs, in the order sections were added
+        self.pendingRemoval = collections.OrderedDict()
+        self.pendingIncrease = collections.OrderedDict()
+        self.chunks = collections.OrderedDict()
+        self.sectionsProcessed = 0
+
+    # Number of recently used chunks to keep loaded. Older chunks are released so the chunk cache can unload them
+    # while a large area is relit.
+    chunkLimit = 64
+
+    def getChunk(self, cx, cz):
+        try:
+            chunk = self.chunks.pop((cx, cz))
+        except KeyError:
+            if self.dimension.containsChunk(cx, cz):
+                chunk = self.dimension.getChunk(cx, cz)
+            else:
+                chunk = None
+            if len(self.chunks) >= self.chunkLimit:
+                self.chunks.popitem(last=False)
+        self.chunks[cx, cz] = chunk
+        return chunk
+
+    def addChangedPositions(self, x, y, z):
+        """
+        Queue removal seeds for the given positions. Positions whose blocks changed must be queued this way so
+        light that passed through them is removed.
+        """
+        sx, sy, sz = x >> 4, y >> 4, z >> 4
+        order = numpy.lexsort((sz, sy, sx))
+        sx, sy, sz = sx[order], sy[order], sz[order]
+        index = (y[order] & 0xf) << 8 | (z[order] & 0xf) << 4 | (x[order] & 0xf)
+
+        starts = numpy.flatnonzero(numpy.diff(sx) | numpy.diff(sy) | numpy.diff(sz)) + 1
+        bounds = [0] + starts.tolist() + [len(index)]
+        for start, end in zip(bounds, bounds[1:]):
+            key = int(sx[start]), int(sy[start]), int(sz[start])
+            self.addChangedSection(key, index[start:end])
+
+    def addChangedSection(self, key, index):
+        """
+        Like addChangedPositions, but for the positions at the given flat (YZX) indexes of one section.
+
+        :type key: (int, int, int)
+        :type index: ndarray
+        """
+        index = numpy.asarray(index, 'int32')
+        self._addSeeds(self.pendingRemoval, key, index, numpy.full(index.shape, SEED_CHANGED, 'int32'))
+
+    def addLightSources(self, key, index, levels):
+        """
+        Queue increase seeds for the positions at the given flat (YZX) indexes of one section. Each position is
+        raised to the given level if it is darker, and light is spread from it. A level of 0 spreads the light the
+        position already has.
+
+        :type key: (int, int, int)
+        :type index: ndarray
+        :type levels: ndarray | int
+        """
+        index = numpy.asarray(index, 'int32')
+        code = numpy.empty(index.shape, 'int32')
+        code[:] = levels
+        self._addSeeds(self.pendingIncrease, key, index, code)
+
+    def _addSeeds(self, pending, key, index, code):
+        cx, cy, cz = key
+        if cy < self.minCY or cy > self.maxCY:
+            return
+        seeds = pending.get(key)
+        if seeds is None:
+            seeds = pending[key] = []
+        seeds.append((index, code))
+
+    def propagate(self):
+        """
+        Run the removal phase and then the increase phase until no seeds are left.
+        """
+        for _ in self.propagateIter():
+            pass
+
+    def propagateIter(self):
+        """
+        Like propagate, but yields progress as (sections processed, sections processed or pending, status) tuples
+        after each section.
+        """
+        for pending, status in (self.pendingRemoval, "Removing %s"), (self.pendingIncrease, "Spreading %s"):
+            status %= self.name
+            while pending:
+                key, seeds = pending.popitem(last=False)
+                self._processSection(key, seeds, pending is self.pendingRemoval)
+                self.sectionsProcessed += 1
+                total = self.sectionsProcessed + len(self.pendingRemoval) + len(self.pendingIncrease)
+                yield self.sectionsProcessed, total, status
+
+    def _loadNeighbor(self, cx, cy, cz, face):
+        # Return the state of the neighboring section, and its light and opacity at the shared border
+        from mceditlib.multi_block import readSectionArray
+
+        sky = self.sky
+        if cy > self.maxCY:
+            return (FACE_SOURCE, 15, 0) if sky else (FACE_CLOSED, 0, 15)
+        if cy < self.minCY:
+            return FACE_CLOSED, 0, 15
+        chunk = self.getChunk(cx, cz)
+        if chunk is None:
+            return FACE_CLOSED, 0, 15
+
+        section = chunk.getSection(cy)
+        if section is None:
+            if sky and not any(pos > cy for pos in chunk.sectionPositions()):
+                return FACE_SOURCE, 15, 0
+            return FACE_SECTION, 0, 0
+
+        slices = NEIGHBOR_SLICES[face]
+        try:
+            light = readSectionArray(section, self.name)[slices]
+        except AttributeError:
+            return FACE_CLOSED, 0, 15
+        opacity = self.opacity[readSectionArray(section, "Blocks")[slices]]
+        return FACE_SECTION, light, opacity
+
+    def _processSection(self, key, seeds, removal):
+        cdef int faceState[6]
+        cdef int *queue
+        cdef unsigned char *queueLevel
+        cdef bint changed = False
+        cdef int count
+        from mceditlib.multi_block import readSectionArray
+
+        cx, cy, cz = key
+        chunk = self.getChunk(cx, cz)
+        if chunk is None:
+            return
+        section = chunk.getSection(cy, create=not removal)
+        if section is None:
+            return
+        try:
+            sectionLight = readSectionArray(section, self.name)
+        except AttributeError:
+            return
+
+        light = numpy.zeros((18, 18, 18), 'uint8')
+        opacity = numpy.zeros((18, 18, 18), 'uint8')
+        light[INTERIOR] = sectionLight
+        Blocks = readSectionArray(section, "Blocks")
+        opacity[INTERIOR] = self.opacity[Blocks]
+        emit = numpy.zeros((18, 18, 18), 'uint8')
+        if self.brightness is not None:
+            emit[INTERIOR] = self.brightness[Blocks]
+
+        for face, (dx, dy, dz) in enumerate(FACE_DIRECTIONS):
+            state, neighborLight, neighborOpacity = self._loadNeighbor(cx + dx, cy + dy, cz + dz, face)
+            faceState[face] = state
+            light[BORDER_SLICES[face]] = neighborLight
+            opacity[BORDER_SLICES[face]] = neighborOpacity
+
+        # Convert the seeds' section indexes to padded indexes
+        index = numpy.concatenate([i for i, c in seeds])
+        code = numpy.concatenate([c for i, c in seeds])
+        index = ((index >> 8) + 1) * 324 + ((index >> 4 & 0xf) + 1) * 18 + (index & 0xf) + 1
+        index = index.astype('int32')
+
+        light = light.ravel()
+        opacity = opacity.ravel()
+        marks = numpy.zeros(PADDED_VOLUME, 'uint8')
+
+        if removal:
+            queueSize = len(index) + SECTION_VOLUME
+            outSize = queueSize * 8 + BORDER_AREA
+        else:
+            queueSize = len(index) + SECTION_VOLUME * 15
+            outSize = BORDER_AREA * 15
+        outIndex = numpy.empty(outSize, 'int32')
+        outCode = numpy.empty(outSize, 'int32')
+
+        queue = <int *>malloc(queueSize * sizeof(int))
+        queueLevel = <unsigned char *>malloc(queueSize)
+        if queue == NULL or queueLevel == NULL:
+            free(queue)
+            free(queueLevel)
+            raise MemoryError
+        try:
+            if removal:
+                count = removalPass(light, opacity, emit.ravel(), marks, BORDER_FACES, faceState, self.sky,
+                                    index, code, queue, queueLevel, outIndex, outCode, &changed)
+            else:
+                count = increasePass(light, opacity, marks, BORDER_FACES, faceState, self.sky,
+                                     index, code, queue, outIndex, outCode, &changed)
+        finally:
+            free(queue)
+            free(queueLevel)
+
+        if changed:
+            setSectionLight(section, self.name, light.reshape((18, 18, 18))[INTERIOR])
+            # Mark the chunk now, before the chunk cache can discard the change
+            if hasattr(chunk, 'markSectionsDirty'):
+                chunk.markSectionsDirty([cy])
+            else:
+                chunk.dirty = True
+
+        if count:
+            self._queueOutput(key, outIndex[:count], outCode[:count])
+
+    def _queueOutput(self, key, index, code):
+        # Sort the output seeds into this section and the neighbors whose borders they are on, and convert them
+        # to section indexes
+        cx, cy, cz = key
+        faces = BORDER_FACES[index]
+        py, pz, px = index // 324 - 1, index // 18 % 18 - 1, index % 18 - 1
+        local = ((py & 0xf) << 8 | (pz & 0xf) << 4 | (px & 0xf)).astype('int32')
+        kind = code >> 8
+
+        for face in numpy.unique(faces):
+            inFace = faces == face
+            if face == 0:
+                target = key
+            else:
+                dx, dy, dz = FACE_DIRECTIONS[face - 1]
+                target = cx + dx, cy + dy, cz + dz
+
+            for seedKind, pending in (SEED_REMOVE, self.pendingRemoval), (SEED_INCREASE, self.pendingIncrease):
+                mask = inFace & (kind == seedKind)
+                if mask.any():
+                    self._addSeeds(pending, target, local[mask], code[mask] & 0xff)
+
+
+def updateLights(dimension, x, y, z):
+    """
+    Update BlockLight and SkyLight after the blocks at the given positions have changed. Light is removed from the
+    positions it can no longer reach as well as spread to new positions. Does not update the HeightMap.
+
+    :param dimension:
+    :type dimension: mceditlib.worldeditor.WorldEditorDimension
+    :type x: numpy.ndarray
+    :type y: numpy.ndarray
+    :type z: numpy.ndarray
+    """
+    x, y, z = [numpy.ravel(a).astype('int64') for a in numpy.broadcast_arrays(x, y, z)]
+    if not len(x):
+        return
+
+    for name in LIGHT_NAMES:
+        engine = LightEngine(dimension, name)
+        engine.addChangedPositions(x, y, z)
+        engine.propagate()
+
+
+def updateSectionLights(dimension, sections):
+    """
+    Like updateLights, but for changed positions given as a mapping of section positions (cx, cy, cz) to the flat
+    (YZX) indexes of the changed positions in that section.
+
+    :type dimension: mceditlib.worldeditor.WorldEditorDimension
+    :type sections: dict[(int, int, int), numpy.ndarray]
+    """
+    if not sections:
+        return
+
+    for name in LIGHT_NAMES:
+        engine = LightEngine(dimension, name)
+        for key, index in sections.iteritems():
+            engine.addChangedSection(key, index)
+        engine.propagate()
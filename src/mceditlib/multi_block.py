@@ -28,39 +28,96 @@ def decodeChunkPos(cPos):
 
 
 
+def _runBounds(keys):
+    """
+    Return the start and stop indexes of each run of equal elements in the sorted array `keys`.
+    """
+    bounds = numpy.flatnonzero(keys[1:] != keys[:-1]) + 1
+    starts = numpy.concatenate(([0], bounds))
+    stops = numpy.concatenate((bounds, [len(keys)]))
+    return starts, stops
+
+
 def coords_by_chunk(x, y, z):
     """
     Split the x, y, and z coordinate arrays according to chunk location. Return an iterator over tuples of the chunk's
     cx and cz coordinates and arrays of the x y z coordinates located in that chunk.
 
-    Performance note: Implicitly sorts the elements of an intermediate array. May perform better when input arrays are
-    short.
+    The coordinates are grouped with a single sort, so each chunk's coordinates are a contiguous slice of the sorted
+    arrays. Within each chunk, the coordinates are ordered by section (see coords_by_section).
 
     :param x: Array of x coordinates
     :param y: Array of y coordinates
     :param z: Array of z coordinates
-    :return: iterator over (cx, cz, x, y, z) tuples, where x, y, and z are arrays and cx and cz are integers
+    :return: iterator over (cx, cz, x, y, z, index) tuples, where x, y, and z are arrays and cx and cz are integers.
+        x and z are in the range 0..15. index is an array of the positions of the yielded coordinates in the
+        flattened input arrays.
     """
+    x, y, z = numpy.broadcast_arrays(x, y, z)
+    x = x.ravel()
+    y = y.ravel()
+    z = z.ravel()
+    if not len(x):
+        return
 
-    cPos = chunkPosArray(x, z)
-    x = x & 0xf
-    z = z & 0xf
+    # Sort by a single integer key made from the chunk and section coordinates, relative to their minimums
+    cx = x >> 4
+    cy = y >> 4
+    cz = z >> 4
+    cxMin, cyMin, czMin = cx.min(), cy.min(), cz.min()
+    czSpan = int(cz.max() - czMin) + 1
+    cySpan = int(cy.max() - cyMin) + 1
 
-    x, y, z = numpy.broadcast_arrays(x, y, z)
+    chunkKey = (cx - cxMin).astype('i8')
+    chunkKey *= czSpan
+    chunkKey += cz - czMin
+    key = chunkKey * cySpan
+    key += cy - cyMin
 
-    elements, inverse = numpy.unique(cPos, return_inverse=True)
-    view = decodeChunkPos(elements)
-    cxs, czs = view[..., 0], view[..., 1]
+    order = numpy.argsort(key)
+    chunkKey = chunkKey[order]
+    starts, stops = _runBounds(chunkKey)
 
-    for index, cx in numpy.ndenumerate(cxs):
-        cz = czs[index]
+    firstKeys = chunkKey[starts]
+    cxs = firstKeys // czSpan + cxMin
+    czs = firstKeys % czSpan + czMin
+
+    x = x[order] & 0xf
+    y = y[order]
+    z = z[order] & 0xf
+
+    for cx, cz, start, stop in zip(cxs, czs, starts, stops):
+        yield (int(cx), int(cz), x[start:stop], y[start:stop], z[start:stop], order[start:stop])
+
+
+def coords_by_section(y):
+    """
+    Split the y coordinate array according to section. Return an iterator over tuples of the section's cy coordinate
+    and an index selecting the elements of y located in that section.
+
+    If y is already ordered by section, as it is for the coordinates yielded by coords_by_chunk, each index is a
+    slice. Otherwise, y is sorted and each index is an array.
+
+    :param y: Array of y coordinates
+    :return: iterator over (cy, index) tuples
+    """
+    if not len(y):
+        return
 
-        localMask = inverse == index
-        localX = x[localMask]
-        localY = y[localMask]
-        localZ = z[localMask]
+    cy = y >> 4
+    if (cy[1:] < cy[:-1]).any():
+        order = numpy.argsort(cy, kind='mergesort')
+        cy = cy[order]
+    else:
+        order = None
 
-        yield (cx, cz, localX, localY, localZ, localMask)
+    starts, stops = _runBounds(cy)
+    for start, stop in zip(starts, stops):
+        if order is None:
+            index = slice(start, stop)
+        else:
+            index = order[start:stop]
+        yield int(cy[start]), index
 
 
 def getBlocks(world, x, y, z,
@@ -111,7 +168,7 @@ def getBlocks(world, x, y, z,
 
     result = GetBlocksResult(Blocks, Data, BlockLight, SkyLight, Biomes)
 
-    for cx, cz, x, y, z, mask in coords_by_chunk(x, y, z):
+    for cx, cz, x, y, z, index in coords_by_chunk(x, y, z):
         if not world.containsChunk(cx, cz):
             continue
 
@@ -126,7 +183,7 @@ def getBlocks(world, x, y, z,
 
         for dest, source in zip(result, arrays):
             if dest is not None and source is not None:
-                dest[mask] = source
+                dest.flat[index] = source
 
     return result
 
@@ -165,36 +222,32 @@ def getChunkBlocks(chunk, x, y, z,
     if hasattr(chunk, 'Biomes') and return_Biomes:
         result.Biomes[:] = chunk.Biomes[x, z]
 
-    for cy in chunk.sectionPositions():
+    flatIndex = sectionIndex(x, y, z)
+
+    for cy, index in coords_by_section(y):
         section = chunk.getSection(cy)
         if section is None:
             continue
 
-        sectionMask = (y >> 4) == cy
-        if not sectionMask.any():
-            continue
-
-        sx = x[sectionMask]
-        sy = y[sectionMask]
-        sz = z[sectionMask]
-
-        sx &= 0xf
-        sy &= 0xf
-        sz &= 0xf
-
-        arrays = getSectionBlocks(section, sx, sy, sz,
-                                  return_Blocks,
-                                  return_Data,
-                                  return_BlockLight,
-                                  return_SkyLight)
+        arrays = getSectionBlocksFlat(section, flatIndex[index],
+                                      return_Blocks,
+                                      return_Data,
+                                      return_BlockLight,
+                                      return_SkyLight)
 
         for dest, src in zip(result, arrays):
-            if dest is not None:
-                dest[sectionMask] = src
+            if dest is not None and src is not None:
+                dest[index] = src
 
+    return result
 
 
-    return result
+def sectionIndex(x, y, z):
+    """
+    Return the flat index into a section's (y, z, x) ordered arrays of each of the given positions. Only the low four
+    bits of each coordinate are used.
+    """
+    return ((y & 0xf) << 8) | ((z & 0xf) << 4) | (x & 0xf)
 
 
 def getSectionBlocks(section, x, y, z,
@@ -209,33 +262,62 @@ def getSectionBlocks(section, x, y, z,
 
     x, y, z must be in the range 0..15
     """
+    return getSectionBlocksFlat(section, sectionIndex(x, y, z),
+                                return_Blocks,
+                                return_Data,
+                                return_BlockLight,
+                                return_SkyLight)
+
+
+def getSectionBlocksFlat(section, index,
+                         return_Blocks=True,
+                         return_Data=False,
+                         return_BlockLight=False,
+                         return_SkyLight=False,
+):
+    """
+    Like getSectionBlocks, but the positions are given as flat indexes computed by sectionIndex. Each requested
+    array is read with a single `take`, or with the section's `getArrayFlat` if it has one.
+    """
+    getArrayFlat = getattr(section, 'getArrayFlat', None)
     return_arrays = []
-    if return_Blocks and hasattr(section, 'Blocks'):
-        return_arrays.append(section.Blocks[y, z, x])
-    else:
-        return_arrays.append(None)
-    if return_Data and hasattr(section, 'Data'):
-        return_arrays.append(section.Data[y, z, x])
-    else:
-        return_arrays.append(None)
-    if return_BlockLight and hasattr(section, 'BlockLight'):
-        return_arrays.append(section.BlockLight[y, z, x])
-    else:
-        return_arrays.append(None)
-    if return_SkyLight and hasattr(section, 'SkyLight'):
-        return_arrays.append(section.SkyLight[y, z, x])
-    else:
-        return_arrays.append(None)
+    for wanted, name in ((return_Blocks, 'Blocks'),
+                         (return_Data, 'Data'),
+                         (return_BlockLight, 'BlockLight'),
+                         (return_SkyLight, 'SkyLight')):
+        if wanted and getArrayFlat is not None:
+            return_arrays.append(getArrayFlat(name, index))
+            continue
+        array = getattr(section, name, None) if wanted else None
+        if array is not None:
+            return_arrays.append(array.take(index))
+        else:
+            return_arrays.append(None)
 
     return return_arrays
 
+def readSectionArray(section, name):
+    """
+    Return the named array of a section for reading only. Uses the section's `readArray` method if it has one, which
+    may return a read-only array to avoid unpacking a packed or uniform array.
+    """
+    readArray = getattr(section, 'readArray', None)
+    if readArray is not None:
+        return readArray(name)
+    return getattr(section, name)
+
+
 def maskArray(array, mask):
+    """
+    Select the elements of the flattened array given by mask, which may be a boolean mask, an index array, or a
+    slice. Single-valued arrays are returned unchanged.
+    """
     if array is None:
         return None
     if array.shape == (1,):
         return array
     else:
-        return array[mask]
+        return array.ravel()[mask]
 
 def setBlocks(world, x, y, z, Blocks = None,
               Data=None,
@@ -256,15 +338,14 @@ def setBlocks(world, x, y, z, Blocks = None,
     Biomes = numpy.atleast_1d(Biomes) if Biomes is not None else None
 
 
-    for cx, cz, sx, sy, sz, mask in coords_by_chunk(x, y, z):
+    for cx, cz, sx, sy, sz, index in coords_by_chunk(x, y, z):
         chunk = world.getChunk(cx, cz, create=True)
         setChunkBlocks(chunk, sx, sy, sz,
-                       maskArray(Blocks, mask),
-                       maskArray(Data, mask),
-                       maskArray(BlockLight, mask),
-                       maskArray(SkyLight, mask),
-                       maskArray(Biomes, mask))
-        chunk.dirty = True
+                       maskArray(Blocks, index),
+                       maskArray(Data, index),
+                       maskArray(BlockLight, index),
+                       maskArray(SkyLight, index),
+                       maskArray(Biomes, index))
 
     if updateLights:
         relight.updateLights(world, x, y, z)
@@ -280,33 +361,33 @@ def setChunkBlocks(chunk, x, y, z,
     """
     Change the blocks at the given positions. All parameters must be arrays of the same shape, or single values.
     Chunk must have a `world` attribute and `getSection` function.
+
+    Marks the chunk dirty. If the chunk has a `markSectionsDirty` method and no biomes are changed, only the changed
+    sections are marked.
     """
 
-    for cy in chunk.sectionPositions():
+    flatIndex = sectionIndex(x, y, z)
+    changedSections = []
+
+    for cy, index in coords_by_section(y):
         section = chunk.getSection(cy)
         if section is None:
             continue
 
-        sectionMask = (y >> 4 == cy)
-
-        sx = x[sectionMask]
-        if not len(sx):
-            continue
-
-        sy = y[sectionMask]
-        sz = z[sectionMask]
-        sx &= 0xf
-        sy &= 0xf
-        sz &= 0xf
-
-        setSectionBlocks(section, sx, sy, sz,
-                         maskArray(Blocks, sectionMask),
-                         maskArray(Data, sectionMask),
-                         maskArray(BlockLight, sectionMask),
-                         maskArray(SkyLight, sectionMask))
+        setSectionBlocksFlat(section, flatIndex[index],
+                             maskArray(Blocks, index),
+                             maskArray(Data, index),
+                             maskArray(BlockLight, index),
+                             maskArray(SkyLight, index))
+        changedSections.append(cy)
 
     if Biomes is not None and hasattr(chunk, 'Biomes'):
         chunk.Biomes[x & 0xf, z & 0xf] = Biomes
+        chunk.dirty = True
+    elif hasattr(chunk, 'markSectionsDirty'):
+        chunk.markSectionsDirty(changedSections)
+    else:
+        chunk.dirty = True
 
 
 
@@ -321,12 +402,35 @@ def setSectionBlocks(section, x, y, z,
 
     x, y, z must be in the range 0..15
     """
+    setSectionBlocksFlat(section, sectionIndex(x, y, z), Blocks, Data, BlockLight, SkyLight)
+
+
+def setSectionBlocksFlat(section, index,
+                         Blocks=None,
+                         Data=None,
+                         BlockLight=None,
+                         SkyLight=None,
+):
+    """
+    Like setSectionBlocks, but the positions are given as flat indexes computed by sectionIndex. Each array is
+    written with a single `put`, or with the section's `setArrayFlat` if it has one; single values are repeated
+    for every position.
+    """
+    setArrayFlat = getattr(section, 'setArrayFlat', None)
+    if setArrayFlat is not None:
+        for name, values in (('Blocks', Blocks),
+                             ('Data', Data),
+                             ('BlockLight', BlockLight),
+                             ('SkyLight', SkyLight)):
+            if values is not None:
+                setArrayFlat(name, index, values)
+        return
+
     if Blocks is not None:
-        section.Blocks[y, z, x] = Blocks
+        section.Blocks.put(index, Blocks)
     if Data is not None:
-        section.Data[y, z, x] = Data
+        section.Data.put(index, Data)
     if BlockLight is not None:
-        section.BlockLight[y, z, x] = BlockLight
+        section.BlockLight.put(index, BlockLight)
     if SkyLight is not None:
-        section.SkyLight[y, z, x] = SkyLight
-
+        section.SkyLight.put(index, SkyLight)
@@ -7,7 +7,7 @@ Cython implementation
 Named Binary Tag library. Serializes and deserializes TAG_* objects
 to and from binary data. Load a Minecraft level by calling nbt.load().
 Create your own TAG_* objects and set their values.
-Save a TAG_* object to a file or StringIO object.
+Save a TAG_* object to a file or file-like object.
 
 Read the test functions at the end of the file to get started.
 
@@ -38,24 +38,30 @@ DEF UNICODE_NAMES = True
 
 DEF UNICODE_CACHE = True
 
+#  SAVE_BLOCK_SIZE
+# When saving to a file or compressing, serialized data is passed on in blocks of about this many bytes.
+
+DEF SAVE_BLOCK_SIZE = 65536
+
 import collections
 import gzip
+import sys
 import zlib
 
 from cStringIO import StringIO
-from cpython cimport PyTypeObject, PyUnicode_DecodeUTF8, PyList_Append, PyString_FromStringAndSize
+from cpython cimport PyUnicode_DecodeUTF8, PyList_Append, PyString_FromStringAndSize
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_SIMPLE
+from cpython.exc cimport PyErr_Clear
+from cpython.ref cimport PyObject, Py_XDECREF
+from libc.string cimport memcpy
+
+cdef extern from "Python.h":
+    PyObject * PyString_FromStringAndSize_raw "PyString_FromStringAndSize" (char *v, Py_ssize_t len)
+    int _PyString_Resize(PyObject **string, Py_ssize_t newsize)
+    char * PyString_AS_STRING(PyObject *string)
+    int PyList_SetSlice_raw "PyList_SetSlice" (object list, Py_ssize_t low, Py_ssize_t high, PyObject *itemlist) except -1
 import numpy
 
-cdef extern from "cStringIO.h":
-    struct PycStringIO_CAPI:
-        int cwrite(object o, char * buf, Py_ssize_t len)
-        PyTypeObject * OutputType
-cdef extern from "cobject.h":
-    void * PyCObject_Import(char * module_name, char * cobject_name)
-
-cdef PycStringIO_CAPI *PycStringIO = <PycStringIO_CAPI *> PyCObject_Import("cStringIO", "cStringIO_CAPI")
-cdef PyTypeObject * StringO = PycStringIO.OutputType
-
 # Tag IDs
 
 cdef char _ID_END = 0
@@ -110,12 +116,18 @@ def try_gunzip(data):
 # --- Tag classes ---
 #
 
+# Bumped whenever a tag that is in a compound's name index is renamed. Each compound remembers the value from when
+# it built its index and rebuilds the index if it has changed.
+cdef unsigned long _renameGeneration = 0
+
 cdef class TAG_Value:
     IF UNICODE_NAMES:
         cdef unicode _name
     ELSE:
         cdef bytes _name
     cdef public char tagID
+    # Set once the tag has been added to a compound's name index
+    cdef bint _indexed
 
     def __repr__(self):
         return "<%s name=\"%s\" value=%r>" % (self.__class__.__name__, self.name, self.value)
@@ -128,12 +140,15 @@ cdef class TAG_Value:
             return self._name
 
         def __set__(self, val):
+            global _renameGeneration
             IF UNICODE_NAMES:
                 if isinstance(val, str):
                     val = PyUnicode_DecodeUTF8(val, len(val), "strict")
             ELSE:
                 if isinstance(val, unicode):
                     val = str(val)
+            if self._indexed and val != self._name:
+                _renameGeneration += 1
             self._name = val
 
     def __reduce__(self):
@@ -327,11 +342,17 @@ cdef class TAG_String(TAG_Value):
 
 
 cdef class _ID_List(TAG_Value):
-    cdef public list value
+    cdef list _value
     cdef public char list_type
 
+    # Set when loaded with lazy=True: the list's items are parsed from _lazyData[_lazyStart:_lazyEnd] when first
+    # accessed. Until then, _lazyLength is the number of items.
+    cdef bytes _lazyData
+    cdef Py_ssize_t _lazyStart, _lazyEnd
+    cdef int _lazyLength
+
     def __init__(self, value=None, name="", list_type=_ID_BYTE):
-        self.value = []
+        self._value = []
         self.name = name
         self.list_type = list_type
         self.tagID = _ID_LIST
@@ -339,8 +360,25 @@ cdef class _ID_List(TAG_Value):
             self.list_type = value[0].tagID
             for tag in value:
                 self.check_tag(tag)
-            self.value = list(value)
+            self._value = list(value)
+
+    property value:
+        def __get__(self):
+            self._materialize()
+            return self._value
 
+        def __set__(self, val):
+            self._lazyData = None
+            self._value = val
+
+    cdef int _materialize(self) except -1:
+        if self._lazyData is None:
+            return 0
+        cdef load_ctx ctx = lazy_ctx(self._lazyData, self._lazyStart, self._lazyEnd)
+        self._value = []
+        load_list_items(ctx, self)
+        self._lazyData = None
+        return 0
 
     def __repr__(self):
         return "<%s name='%s' list_type=%r length=%d>" % (self.__class__.__name__, self.name,
@@ -352,7 +390,15 @@ cdef class _ID_List(TAG_Value):
             raise TypeError("Invalid type %s for TAG_List(%s)" % (value.__class__, tag_classes[self.list_type]))
 
     def copy(self):
-        return TAG_List([tag.copy() for tag in self.value], self.name)
+        cdef _ID_List lazyCopy
+        if self._lazyData is not None:
+            lazyCopy = TAG_List(name=self.name, list_type=self.list_type)
+            lazyCopy._lazyData = self._lazyData
+            lazyCopy._lazyStart = self._lazyStart
+            lazyCopy._lazyEnd = self._lazyEnd
+            lazyCopy._lazyLength = self._lazyLength
+            return lazyCopy
+        return TAG_List([tag.copy() for tag in self._value], self.name)
 
     # --- collection methods ---
 
@@ -371,10 +417,12 @@ cdef class _ID_List(TAG_Value):
         return iter(self.value)
 
     def __len__(self):
-        return len(self.value)
+        if self._lazyData is not None:
+            return self._lazyLength
+        return len(self._value)
 
     def insert(self, index, tag):
-        if len(self.value) == 0:
+        if len(self) == 0:
             self.list_type = tag.tagID
         else:
             self.check_tag(tag)
@@ -385,14 +433,18 @@ cdef class _ID_List(TAG_Value):
         del self.value[key]
 
     cdef void save_value(self, buf):
+        if self._lazyData is not None:
+            cwrite(buf, <char *>self._lazyData + self._lazyStart, self._lazyEnd - self._lazyStart)
+            return
+
         cdef char list_type = self.list_type
         cdef TAG_Value tag
 
         save_tag_id(list_type, buf)
-        save_int(<int>len(self.value), buf)
+        save_int(<int>len(self._value), buf)
 
         cdef TAG_Value subtag
-        for subtag in self.value:
+        for subtag in self._value:
             if subtag.tagID != list_type:
                 raise ValueError("Asked to save TAG_List with different types! Found %s and %s" % (subtag.tagID,
                                                                                                    list_type))
@@ -403,8 +455,72 @@ class TAG_List(_ID_List, collections.MutableSequence):
     pass
 
 
+cdef class _TagList(list):
+    """
+    The list of child tags returned by TAG_Compound.value. Appending to it is picked up by the compound's name index
+    as it is. Any other change marks the index as stale so the compound rebuilds it.
+    """
+    cdef bint _indexStale
+
+    def __setitem__(self, index, value):
+        list.__setitem__(self, index, value)
+        self._indexStale = True
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._indexStale = True
+
+    def __setslice__(self, i, j, value):
+        list.__setslice__(self, i, j, value)
+        self._indexStale = True
+
+    def __delslice__(self, i, j):
+        list.__delslice__(self, i, j)
+        self._indexStale = True
+
+    def __imul__(self, n):
+        list.__imul__(self, n)
+        self._indexStale = True
+        return self
+
+    def insert(self, index, value):
+        list.insert(self, index, value)
+        self._indexStale = True
+
+    def pop(self, index=-1):
+        self._indexStale = True
+        return list.pop(self, index)
+
+    def remove(self, value):
+        list.remove(self, value)
+        self._indexStale = True
+
+    def reverse(self):
+        list.reverse(self)
+        self._indexStale = True
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self._indexStale = True
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
 cdef class _ID_Compound(TAG_Value):
-    cdef public object value
+    # Child tags in file order, held in a _TagList. Lookups go through _index, a map from each name to the position of
+    # the first child with that name. _index is updated when children are added or deleted through the compound, and
+    # picks up children appended to `value` the next time it is used. It is rebuilt after a child is renamed or
+    # `value` is changed in any other way.
+    cdef list _value
+    cdef dict _index
+    cdef Py_ssize_t _indexLength
+    cdef unsigned long _indexGeneration
+    cdef bint _hasDuplicates
+
+    # Set when loaded with lazy=True: the children are parsed from _lazyData[_lazyStart:_lazyEnd] when first accessed
+    cdef bytes _lazyData
+    cdef Py_ssize_t _lazyStart, _lazyEnd
 
     def __init__(self, value=None, name=None):
         if name is None:
@@ -416,30 +532,108 @@ cdef class _ID_Compound(TAG_Value):
         self.name = name
         self.tagID = _ID_COMPOUND
 
+    property value:
+        def __get__(self):
+            self._materialize()
+            return self._value
+
+        def __set__(self, val):
+            self._lazyData = None
+            self._value = _TagList(val)
+            self._index = None
+
+    cdef int _materialize(self) except -1:
+        if self._lazyData is None:
+            return 0
+        cdef load_ctx ctx = lazy_ctx(self._lazyData, self._lazyStart, self._lazyEnd)
+        self._value = _TagList()
+        self._index = None
+        load_compound_items(ctx, self)
+        self._lazyData = None
+        return 0
+
     def copy(self):
-        return TAG_Compound([tag.copy() for tag in self.value], self.name)
+        cdef _ID_Compound lazyCopy
+        if self._lazyData is not None:
+            lazyCopy = TAG_Compound(name=self.name)
+            lazyCopy._lazyData = self._lazyData
+            lazyCopy._lazyStart = self._lazyStart
+            lazyCopy._lazyEnd = self._lazyEnd
+            return lazyCopy
+        return TAG_Compound([tag.copy() for tag in self._value], self.name)
+
+    # --- name index ---
+
+    cdef dict _getIndex(self):
+        cdef TAG_Value tag
+        cdef Py_ssize_t i
+        cdef _TagList children
+        self._materialize()
+        children = <_TagList>self._value
+        if (self._index is None or children._indexStale or self._indexGeneration != _renameGeneration
+                or self._indexLength > len(children)):
+            self._index = {}
+            self._indexLength = 0
+            self._indexGeneration = _renameGeneration
+            self._hasDuplicates = False
+            children._indexStale = False
+
+        # Index the children appended to `value` since the index was last used
+        for i in range(self._indexLength, len(children)):
+            tag = children[i]
+            tag._indexed = True
+            if tag._name in self._index:
+                self._hasDuplicates = True
+            else:
+                self._index[tag._name] = i
+        self._indexLength = len(children)
+        return self._index
+
+    cdef Py_ssize_t _find(self, key) except -2:
+        """
+        Return the position of the first child named `key`, or -1 if there is none.
+        """
+        return self._getIndex().get(key, -1)
 
     # --- collection methods ---
 
     def __getitem__(self, key):
-        cdef TAG_Value tag
-        for tag in self.value:
-            if tag._name == key:
-                return tag
-        raise KeyError("Key %s not found." % key)
+        cdef Py_ssize_t i = self._find(key)
+        if i < 0:
+            raise KeyError("Key %s not found." % key)
+        return self._value[i]
 
     def __setitem__(self, key, tag):
         tag.name = key
         cdef TAG_Value v
-        self.value = [v for v in self.value if v._name != key]
-        self.value.append(tag)
+        cdef Py_ssize_t i = self._find(key)
+        if i < 0:
+            self._value.append(tag)
+            (<TAG_Value>tag)._indexed = True
+            self._index[(<TAG_Value>tag)._name] = len(self._value) - 1
+            self._indexLength += 1
+        elif not self._hasDuplicates:
+            (<TAG_Value>tag)._indexed = True
+            self._value[i] = tag
+        else:
+            self.value = [v for v in self._value if v._name != key]
+            self._value.append(tag)
 
     def __delitem__(self, key):
-        oldlen = len(self.value)
         cdef TAG_Value v
-        self.value = [v for v in self.value if v._name != key]
-        if oldlen == len(self.value):
+        cdef Py_ssize_t i = self._find(key)
+        cdef Py_ssize_t j
+        if i < 0:
             raise KeyError("Key %s not found" % key)
+        if self._hasDuplicates:
+            self.value = [v for v in self._value if v._name != key]
+        else:
+            del self._index[(<TAG_Value>self._value[i])._name]
+            PyList_SetSlice_raw(self._value, i, i + 1, NULL)
+            self._indexLength -= 1
+            # Only the children after the deleted one have moved
+            for j in range(i, len(self._value)):
+                self._index[(<TAG_Value>self._value[j])._name] = j
 
     def __iter__(self):
         cdef TAG_Value v
@@ -447,7 +641,7 @@ cdef class _ID_Compound(TAG_Value):
             yield v._name
 
     def __contains__(self, k):
-        return any(tag.name == k for tag in self.value)
+        return self._find(k) >= 0
 
     def __len__(self):
         return len(self.value)
@@ -465,38 +659,64 @@ cdef class _ID_Compound(TAG_Value):
         return [v for v in self.value if v.name == key]
 
     cdef void save_value(self, buf):
+        if self._lazyData is not None:
+            cwrite(buf, <char *>self._lazyData + self._lazyStart, self._lazyEnd - self._lazyStart)
+            return
+
         cdef TAG_Value subtag
-        for subtag in self.value:
+        for subtag in self._value:
             save_tag_id(subtag.tagID, buf)
             save_tag_name(subtag, buf)
             save_tag_value(subtag, buf)
         save_tag_id(_ID_END, buf)
 
-    def save(self, filename_or_buf=None, compressed=True):
+    def save(self, filename_or_buf=None, compressed=True, compresslevel=9, compressor=None):
         """
-        Pass a filename to save the data to a file. Pass a file-like object (with a read() method)
+        Pass a filename to save the data to a file. Pass a file-like object (with a write() method)
         to write the data to that object. Pass nothing to return the data as a string.
+
+        If compressed is True, the data is gzipped at the given compresslevel. Pass a zlib.compressobj as
+        compressor to compress the data with it instead, e.g. to produce zlib-format data for a region file.
+
+        When compressing or writing to a file, the data is passed on in blocks as it is serialized, so the whole
+        uncompressed data is never held in memory.
         """
-        io = StringIO()
-        save_tag_id(self.tagID, io)
-        save_tag_name(self, io)
-        save_tag_value(self, io)
-        data = io.getvalue()
-        if compressed:
-            gzio = StringIO()
-            gz = gzip.GzipFile(fileobj=gzio, mode='wb')
-            gz.write(data)
-            gz.close()
-            data = gzio.getvalue()
-
-        if filename_or_buf is None:
-            return data
+        if compressor is None and compressed:
+            compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip format
 
         if isinstance(filename_or_buf, basestring):
-            f = file(filename_or_buf, "wb")
-            f.write(data)
+            with open(filename_or_buf, "wb") as f:
+                self._saveTo(f.write, compressor)
+        elif filename_or_buf is not None:
+            self._saveTo(filename_or_buf.write, compressor)
+        elif compressor is not None:
+            parts = []
+            self._saveTo(parts.append, compressor)
+            return b"".join(parts)
+        else:
+            return self._saveTo(None, None)
+
+    def _saveTo(self, write, compressor):
+        cdef size_t size = estimate_size(self) + 3 + len(self._name) * 3
+        if compressor is not None:
+            compress = compressor.compress
+            sink = lambda block: write(compress(block))
         else:
-            filename_or_buf.write(data)
+            sink = write
+
+        if sink is not None:
+            size = min(size, SAVE_BLOCK_SIZE)
+
+        cdef save_ctx ctx = save_ctx(size, sink)
+        save_tag_id(self.tagID, ctx)
+        save_tag_name(self, ctx)
+        save_tag_value(self, ctx)
+        if sink is None:
+            return ctx.getvalue()
+
+        ctx.finish()
+        if compressor is not None:
+            write(compressor.flush())
 
 class TAG_Compound(_ID_Compound, collections.MutableMapping):
     pass
@@ -513,15 +733,22 @@ cdef void swab(void * vbuf, int nbytes):
 # --- NBT Loading ---
 #
 
-def load(filename="", buf=None):
+def load(filename="", buf=None, lazy=False):
     """
     Load an NBT tree from a file and return the root TAG_Compound. The root tag is the only tag that can have a name
     itself without being inside a TAG_Compound.
     If filename is given, loads NBT data from that file. If buf is given, loads NBT data from the bytes or filehandle.
+
+    If lazy is True, the TAG_Compound and TAG_List tags inside the root tag are only scanned to find where they end.
+    Their contents are parsed the first time they are accessed, and are saved by copying the original data if they
+    are never accessed.
+
     :param filename: Filename to load data from
     :type filename: basestring
     :param buf: File-like object to load data from
     :type buf: file-like object | bytes
+    :param lazy: Parse compound and list tags on first access
+    :type lazy: bool
     :return: Structured NBT data
     :rtype: TAG_Compound
     """
@@ -532,11 +759,16 @@ def load(filename="", buf=None):
         buf = buf.read()
 
     buf = try_gunzip(buf)
+    if lazy and type(buf) is not bytes:
+        buf = bytes(buf)
 
     cdef load_ctx ctx = load_ctx()
     ctx.offset = 1
     ctx.buffer = buf
     ctx.size = len(buf)
+    if lazy:
+        ctx.data = buf
+        ctx.lazy = True
 
     if len(buf) < 1:
         raise NBTFormatError("NBT Stream too short!")
@@ -559,6 +791,18 @@ cdef class load_ctx:
     cdef size_t offset
     cdef char * buffer
     cdef size_t size
+    cdef bytes data  # Holds the buffer for lazily loaded tags
+    cdef bint lazy
+
+
+cdef load_ctx lazy_ctx(bytes data, Py_ssize_t start, Py_ssize_t end):
+    cdef load_ctx ctx = load_ctx()
+    ctx.data = data
+    ctx.buffer = data
+    ctx.offset = start
+    ctx.size = end
+    ctx.lazy = True
+    return ctx
 
 IF UNICODE_CACHE:
     cdef dict u_cache = dict()
@@ -632,17 +876,20 @@ cdef TAG_Double load_double(load_ctx ctx):
 
 
 cdef load_compound(load_ctx ctx):
-    cdef char tagID
     cdef _ID_Compound root_tag = TAG_Compound()
-    cdef TAG_Value tag
+    load_compound_items(ctx, root_tag)
+    return root_tag
+
+
+cdef int load_compound_items(load_ctx ctx, _ID_Compound root_tag) except -1:
+    cdef char tagID
     while True:
         tagID = read(ctx, 1)[0]
         if tagID == _ID_END:
             break
         else:
-            root_tag.value.append(load_named(ctx, tagID))
-
-    return root_tag
+            root_tag._value.append(load_named(ctx, tagID))
+    return 0
 
 
 cdef load_named(load_ctx ctx, char tagID):
@@ -653,19 +900,131 @@ cdef load_named(load_ctx ctx, char tagID):
 
 
 cdef load_list(load_ctx ctx):
+    cdef _ID_List tag = TAG_List()
+    load_list_items(ctx, tag)
+    return tag
+
+
+cdef int load_list_items(load_ctx ctx, _ID_List tag) except -1:
     cdef char list_type = read(ctx, 1)[0]
     cdef int * ptr = <int *> read(ctx, 4)
     cdef int length = ptr[0]
     swab(&length, 4)
 
-    cdef _ID_List tag = TAG_List(list_type=list_type)
-    cdef list val = tag.value
+    tag.list_type = list_type
+    cdef list val = tag._value
     cdef int i
     for i in range(length):
         PyList_Append(val, load_tag(list_type, ctx))
+    return 0
+
+
+# --- Lazy loading ---
+
+cdef load_lazy_list(load_ctx ctx):
+    cdef _ID_List tag = TAG_List()
+    cdef size_t start = ctx.offset
+    cdef char list_type = read(ctx, 1)[0]
+    cdef int * ptr = <int *> read(ctx, 4)
+    cdef int length = ptr[0]
+    swab(&length, 4)
+    skip_list_items(ctx, list_type, length)
+
+    tag.list_type = list_type
+    tag._lazyData = ctx.data
+    tag._lazyStart = start
+    tag._lazyEnd = ctx.offset
+    tag._lazyLength = length
+    return tag
 
+
+cdef load_lazy_compound(load_ctx ctx):
+    cdef _ID_Compound tag = TAG_Compound()
+    cdef size_t start = ctx.offset
+    skip_value(ctx, _ID_COMPOUND)
+
+    tag._lazyData = ctx.data
+    tag._lazyStart = start
+    tag._lazyEnd = ctx.offset
     return tag
 
+
+cdef int skip_length(load_ctx ctx, size_t itemSize) except -1:
+    cdef int * ptr = <int *> read(ctx, 4)
+    cdef int length = ptr[0]
+    swab(&length, 4)
+    if length < 0:
+        raise NBTFormatError("Negative array length %d" % length)
+    read(ctx, length * itemSize)
+    return 0
+
+
+cdef int skip_string(load_ctx ctx) except -1:
+    cdef unsigned short * ptr = <unsigned short *> read(ctx, 2)
+    cdef unsigned short length = ptr[0]
+    swab(&length, 2)
+    read(ctx, length)
+    return 0
+
+
+cdef int skip_list_items(load_ctx ctx, char list_type, int length) except -1:
+    cdef int i
+    if length < 0:
+        raise NBTFormatError("Negative list length %d" % length)
+    if list_type == _ID_BYTE:
+        read(ctx, length)
+    elif list_type == _ID_SHORT:
+        read(ctx, length * 2)
+    elif list_type == _ID_INT or list_type == _ID_FLOAT:
+        read(ctx, length * 4)
+    elif list_type == _ID_LONG or list_type == _ID_DOUBLE:
+        read(ctx, length * 8)
+    else:
+        for i in range(length):
+            skip_value(ctx, list_type)
+    return 0
+
+
+cdef int skip_value(load_ctx ctx, char tagID) except -1:
+    """
+    Advance past a tag's value without creating any objects.
+    """
+    cdef char subID
+    cdef int * ptr
+    cdef int length
+    if tagID == _ID_BYTE:
+        read(ctx, 1)
+    elif tagID == _ID_SHORT:
+        read(ctx, 2)
+    elif tagID == _ID_INT or tagID == _ID_FLOAT:
+        read(ctx, 4)
+    elif tagID == _ID_LONG or tagID == _ID_DOUBLE:
+        read(ctx, 8)
+    elif tagID == _ID_STRING:
+        skip_string(ctx)
+    elif tagID == _ID_BYTE_ARRAY:
+        skip_length(ctx, 1)
+    elif tagID == _ID_SHORT_ARRAY:
+        skip_length(ctx, 2)
+    elif tagID == _ID_INT_ARRAY:
+        skip_length(ctx, 4)
+    elif tagID == _ID_LIST:
+        subID = read(ctx, 1)[0]
+        ptr = <int *> read(ctx, 4)
+        length = ptr[0]
+        swab(&length, 4)
+        skip_list_items(ctx, subID, length)
+    elif tagID == _ID_COMPOUND:
+        while True:
+            subID = read(ctx, 1)[0]
+            if subID == _ID_END:
+                break
+            skip_string(ctx)
+            skip_value(ctx, subID)
+    else:
+        raise NBTFormatError("Unknown tag ID %d" % tagID)
+    return 0
+
 cdef unicode load_string(load_ctx ctx):
     cdef unsigned short * ptr = <unsigned short *> read(ctx, 2)
     cdef unsigned short length = ptr[0]
@@ -733,6 +1092,118 @@ cdef TAG_Int_Array load_int_array(load_ctx ctx):
     return TAG_Int_Array(numpy.fromstring(arr[:byte_length], dtype=TAG_Int_Array.dtype, count=length))
 
 
+# --- Scanning ---
+
+def scan(buf, path, match=None):
+    """
+    Find compound tags in NBT data without loading the rest of the data. `path` is a sequence of tag names leading
+    from the root tag to a TAG_Compound or to a TAG_List of compounds. Each compound found there whose children
+    have the values given by `match` is loaded and returned. Other tags are skipped over without creating any
+    objects.
+
+    Only numeric and string children can be matched. A compound that lacks a child named in `match` does not match.
+
+    :param buf: NBT data, optionally gzipped
+    :type buf: bytes
+    :param path: Names of the tags to descend into, e.g. ("Level", "TileEntities")
+    :type path: sequence of basestring
+    :param match: Maps child tag names to values, e.g. {"id": "Chest"}
+    :type match: dict | None
+    :return: The matching compounds
+    :rtype: list of TAG_Compound
+    """
+    buf = try_gunzip(buf)
+    if match is None:
+        match = {}
+
+    cdef load_ctx ctx = load_ctx()
+    ctx.offset = 1
+    ctx.buffer = buf
+    ctx.size = len(buf)
+    ctx.data = buf
+
+    if len(buf) < 1 or ctx.buffer[0] != _ID_COMPOUND:
+        raise NBTFormatError("Not an NBT file with a root TAG_Compound")
+    skip_string(ctx)
+
+    cdef char tagID = _ID_COMPOUND
+    cdef char list_type
+    cdef int * ptr
+    cdef int length, i
+    for name in path:
+        if tagID != _ID_COMPOUND:
+            return []
+        tagID = find_child(ctx, name)
+        if tagID == _ID_END:
+            return []
+
+    results = []
+    if tagID == _ID_COMPOUND:
+        scan_compound(ctx, match, results)
+    elif tagID == _ID_LIST:
+        list_type = read(ctx, 1)[0]
+        ptr = <int *> read(ctx, 4)
+        length = ptr[0]
+        swab(&length, 4)
+        if list_type == _ID_COMPOUND:
+            for i in range(length):
+                scan_compound(ctx, match, results)
+
+    return results
+
+
+cdef char find_child(load_ctx ctx, name) except -1:
+    """
+    Advance to the value of the child of the current compound with the given name and return its tag ID. Returns
+    _ID_END if there is no such child.
+    """
+    cdef char tagID
+    while True:
+        tagID = read(ctx, 1)[0]
+        if tagID == _ID_END:
+            return _ID_END
+        if load_name(ctx) == name:
+            return tagID
+        skip_value(ctx, tagID)
+
+
+cdef int scan_compound(load_ctx ctx, dict match, list results) except -1:
+    """
+    Advance past a compound's contents, and load it into results if its children have the values in match.
+    """
+    cdef size_t start = ctx.offset
+    cdef char tagID
+    cdef int matched = 0
+    cdef bint failed = False
+
+    while True:
+        tagID = read(ctx, 1)[0]
+        if tagID == _ID_END:
+            break
+        name = load_name(ctx)
+        if not failed and name in match:
+            if _ID_BYTE <= tagID <= _ID_DOUBLE or tagID == _ID_STRING:
+                if load_tag(tagID, ctx).value == match[name]:
+                    matched += 1
+                    continue
+            else:
+                skip_value(ctx, tagID)
+            failed = True
+        else:
+            skip_value(ctx, tagID)
+
+    if failed or matched < len(match):
+        return 0
+
+    cdef load_ctx tagCtx = load_ctx()
+    tagCtx.data = ctx.data
+    tagCtx.buffer = ctx.buffer
+    tagCtx.offset = start
+    tagCtx.size = ctx.offset
+    results.append(load_compound(tagCtx))
+    return 0
+
+
 # --- Identify tag type and load tag ---
 
 cdef load_tag(char tagID, load_ctx ctx):
@@ -761,9 +1232,13 @@ cdef load_tag(char tagID, load_ctx ctx):
         return TAG_String(load_string(ctx))
 
     if tagID == _ID_LIST:
+        if ctx.lazy:
+            return load_lazy_list(ctx)
         return load_list(ctx)
 
     if tagID == _ID_COMPOUND:
+        if ctx.lazy:
+            return load_lazy_compound(ctx)
         return load_compound(ctx)
 
     if tagID == _ID_INT_ARRAY:
@@ -786,9 +1261,137 @@ def hexdump(src, length=8):
     return result
 
 
+# Output buffer for saving. Data is written directly into a string object, which starts at the size given by
+# estimate_size, grows if the estimate was too small, and is shrunk to fit and returned by getvalue.
+#
+# If a sink is given, the buffer is instead passed to the sink whenever it is full, and the rest is passed by calling
+# finish. Since the save_* functions cannot raise exceptions, an exception raised by the sink is kept and re-raised
+# by finish.
+
+cdef class save_ctx:
+    cdef PyObject * string
+    cdef size_t size
+    cdef size_t capacity
+    cdef bint failed
+    cdef object sink
+    cdef object exc_info
+
+    def __cinit__(self, size_t capacity, sink=None):
+        self.capacity = max(capacity, 64)
+        self.string = PyString_FromStringAndSize_raw(NULL, self.capacity)
+        if self.string == NULL:
+            raise MemoryError
+        self.sink = sink
+
+    def __dealloc__(self):
+        Py_XDECREF(self.string)
+
+    cdef void flush(self):
+        if self.size == 0:
+            return
+        self.send(PyString_FromStringAndSize(PyString_AS_STRING(self.string), self.size))
+        self.size = 0
+
+    cdef void send(self, data):
+        """
+        Pass data (a string or buffer) to the sink. Call flush first to keep the output in order.
+        """
+        if self.failed:
+            return
+        try:
+            self.sink(data)
+        except Exception:
+            self.exc_info = sys.exc_info()
+            self.failed = True
+
+    cdef finish(self):
+        self.flush()
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        if self.failed:
+            raise MemoryError
+
+    cdef char * reserve(self, size_t length):
+        """
+        Make room for length more bytes and return a pointer to them. Returns NULL and sets failed if out of memory.
+        """
+        cdef size_t capacity = self.capacity
+        cdef char * data
+        if self.sink is not None and self.size + length > capacity:
+            self.flush()
+        if self.failed:
+            return NULL
+        if self.size + length > capacity:
+            while self.size + length > capacity:
+                capacity *= 2
+            if _PyString_Resize(&self.string, capacity) == -1:
+                PyErr_Clear()
+                self.failed = True
+                return NULL
+            self.capacity = capacity
+
+        data = PyString_AS_STRING(self.string) + self.size
+        self.size += length
+        return data
+
+    cdef getvalue(self):
+        if self.failed:
+            raise MemoryError
+        if self.size != self.capacity:
+            if _PyString_Resize(&self.string, self.size) == -1:
+                self.failed = True
+                raise MemoryError
+            self.capacity = self.size
+        value = <object> self.string
+        Py_XDECREF(self.string)
+        self.string = NULL
+        self.failed = True  # The string may not be written to after it is returned
+        return value
+
+
+cdef size_t estimate_size(TAG_Value tag):
+    """
+    Return roughly how many bytes saving the value of this tag will take. Tag names and string values are counted
+    by their length in characters.
+    """
+    cdef char tagID = tag.tagID
+    cdef size_t size
+    if tagID == _ID_BYTE:
+        return 1
+    if tagID == _ID_SHORT:
+        return 2
+    if tagID == _ID_INT or tagID == _ID_FLOAT:
+        return 4
+    if tagID == _ID_LONG or tagID == _ID_DOUBLE:
+        return 8
+    if tagID == _ID_STRING:
+        return 2 + len((<TAG_String> tag)._value)
+    if tagID == _ID_BYTE_ARRAY or tagID == _ID_INT_ARRAY or tagID == _ID_SHORT_ARRAY:
+        return 4 + tag.value.nbytes
+
+    if tagID == _ID_LIST:
+        if (<_ID_List> tag)._lazyData is not None:
+            return (<_ID_List> tag)._lazyEnd - (<_ID_List> tag)._lazyStart
+        size = 5
+        for subtag in (<_ID_List> tag)._value:
+            size += estimate_size(subtag)
+        return size
+
+    if tagID == _ID_COMPOUND:
+        if (<_ID_Compound> tag)._lazyData is not None:
+            return (<_ID_Compound> tag)._lazyEnd - (<_ID_Compound> tag)._lazyStart
+        size = 1
+        for subtag in (<_ID_Compound> tag)._value:
+            size += 3 + len((<TAG_Value> subtag)._name) + estimate_size(subtag)
+        return size
+
+    return 0
+
+
 cdef void cwrite(obj, char *buf, size_t len):
-    #print "cwrite %s %s %d" % (map(ord, buf[:min(4, len)]), buf[:min(4, len)].decode('ascii', 'replace'), len)
-    PycStringIO.cwrite(obj, buf, len)
+    cdef char * dest = (<save_ctx> obj).reserve(len)
+    if dest != NULL:
+        memcpy(dest, buf, len)
 
 
 cdef void save_tag_id(char tagID, object buf):
@@ -811,13 +1414,46 @@ cdef void save_string(bytes value, object buf):
     cwrite(buf, s, len(value))
 
 
+cdef bint NATIVE_BIG_ENDIAN = sys.byteorder == "big"
+array_dtypes = {1: numpy.dtype('u1'), 2: numpy.dtype('>u2'), 4: numpy.dtype('>u4')}
+
+
 cdef void save_array(object value, object buf, char size):
-    value = value.tostring()
-    cdef char * s = value
-    cdef int length = <int>len(value) / size
+    # Copies the array's memory directly into the output. Arrays with native little-endian elements are byte-swapped
+    # in place in the output. Other arrays are first converted to a contiguous array with elements of the right size.
+    dtype = value.dtype
+    if dtype.itemsize != size:
+        value = numpy.ascontiguousarray(value, array_dtypes[size])
+        dtype = value.dtype
+    elif not value.flags.c_contiguous:
+        value = numpy.ascontiguousarray(value)
+
+    cdef bint swap = size > 1 and not (dtype.byteorder == '>' or (dtype.byteorder == '=' and NATIVE_BIG_ENDIAN))
+
+    cdef Py_buffer view
+    PyObject_GetBuffer(value, &view, PyBUF_SIMPLE)
+    cdef int length = <int>(view.len / size)
     swab(&length, 4)
     cwrite(buf, <char *> &length, 4)
-    cwrite(buf, s, len(value))
+
+    # When streaming, pass large arrays to the sink directly instead of copying them into the output buffer
+    if (<save_ctx> buf).sink is not None and not swap and view.len >= SAVE_BLOCK_SIZE:
+        PyBuffer_Release(&view)
+        (<save_ctx> buf).flush()
+        (<save_ctx> buf).send(buffer(value))
+        return
+
+    cdef unsigned char * dest = <unsigned char *> (<save_ctx> buf).reserve(view.len)
+    cdef Py_ssize_t i
+    if dest != NULL:
+        memcpy(dest, view.buf, view.len)
+        if swap and size == 2:
+            for i in range(0, view.len, 2):
+                dest[i], dest[i + 1] = dest[i + 1], dest[i]
+        elif swap and size == 4:
+            for i in range(0, view.len, 4):
+                dest[i], dest[i + 1], dest[i + 2], dest[i + 3] = dest[i + 3], dest[i + 2], dest[i + 1], dest[i]
+    PyBuffer_Release(&view)
 
 
 cdef void save_byte(char value, object buf):
@@ -15,6 +15,7 @@ class Operation(object):
         self.chunksDone = 0
 
     chunkIterator = None
+    closed = False
 
     def __iter__(self):
         return self
@@ -30,16 +31,31 @@ class Operation(object):
         try:
             chunk = self.chunkIterator.next()
         except StopIteration:
-            self.done()
+            self.close()
             raise
-        else:
+
+        try:
             self.operateOnChunk(chunk)
-            self.chunksDone += 1
-            return self.chunksDone, self.selection.chunkCount
+        except:
+            self.close()
+            raise
+        self.chunksDone += 1
+        return self.chunksDone, self.selection.chunkCount
+
+    def close(self):
+        """
+        Stop the operation, leaving the remaining chunks unchanged, and call `done` if it was not called already.
+        Called when iteration finishes or fails. Callers that stop iterating early, e.g. when the user cancels,
+        should call it themselves.
+        """
+        if not self.closed:
+            self.closed = True
+            self.done()
 
     def done(self):
         """
-        Called after all chunks have been iterated.
+        Called once when the operation finishes or is closed early, to finish the work done on the chunks
+        operated on so far.
         :return:
         :rtype:
         """
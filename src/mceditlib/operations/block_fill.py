@@ -12,7 +12,9 @@ import numpy
 import mceditlib
 from mceditlib import blocktypes
 from mceditlib.blocktypes import BlockType
+from mceditlib.multi_block import readSectionArray
 from mceditlib.operations import Operation
+from mceditlib.relight import RelightScheduler
 
 log = logging.getLogger(__name__)
 
@@ -36,7 +38,8 @@ class FillBlocksOperation(Operation):
         Additionally, blockType may be given as a list of (oldBlockType, newBlockType) pairs
         to perform multiple replacements.
 
-        If updateLights is True, also checks to see if block changes require lighting updates and performs them.
+        If updateLights is True, also checks to see if block changes require lighting updates. The changed positions
+        are relit together after the last chunk is filled.
 
         :type dimension: WorldEditorDimension
         :type selection: `~.BoundingBox`
@@ -68,14 +71,15 @@ class FillBlocksOperation(Operation):
             self.replaceTable = blockReplaceTable(blockReplacements)
             if updateLights:
                 self.changesLighting = False
+                tables = dimension.blocktypes.tables
                 for old, new in blockReplacements:
-                    newAbsorption = dimension.blocktypes.opacity[old.ID]
-                    oldAbsorption = dimension.blocktypes.opacity[new.ID]
+                    newAbsorption = tables.opacity[old.ID]
+                    oldAbsorption = tables.opacity[new.ID]
                     if oldAbsorption != newAbsorption:
                         self.changesLighting = True
 
-                    newEmission = dimension.blocktypes.brightness[old.ID]
-                    oldEmission = dimension.blocktypes.brightness[new.ID]
+                    newEmission = tables.brightness[old.ID]
+                    oldEmission = tables.brightness[new.ID]
                     if oldEmission != newEmission:
                         self.changesLighting = True
 
@@ -87,15 +91,47 @@ class FillBlocksOperation(Operation):
                 self.createSections = False
 
         self.updateLights = updateLights and self.changesLighting
+        self.relightScheduler = RelightScheduler(dimension) if self.updateLights else None
         self.chunkCount = 0
         self.skipped = 0
         self.sections = 0
+        self.uniformSections = 0
         log.info("Replacing %s (creating %s)".format(
             self.blockReplacements,
             self.createSections))
 
     def done(self):
-        log.info(u"Fill/Replace: Skipped {0}/{1} sections".format(self.skipped, self.sections))
+        if self.relightScheduler is not None:
+            self.relightScheduler.relight()
+        log.info(u"Fill/Replace: Skipped {0}/{1} sections, filled {2} uniformly".format(
+            self.skipped, self.sections, self.uniformSections))
+
+    def fillUniformSection(self, section, wholeSection):
+        """
+        Fast path for sections that store Blocks and Data as single values, and for filling entire sections.
+        Returns None if the section must be filled normally, otherwise returns whether any blocks were changed.
+        """
+        if not hasattr(section, "setUniform"):
+            return None
+
+        if self.replaceTable is not None:
+            blockID = section.uniformValue("Blocks")
+            meta = section.uniformValue("Data")
+            if blockID is None or meta is None:
+                return None
+            newID, newMeta = self.replaceTable[blockID, meta]
+            if newID == blockID and newMeta == meta:
+                return False
+            if not wholeSection:
+                return None
+        else:
+            if not wholeSection:
+                return None
+            newID, newMeta = self.blockType.ID, self.blockType.meta
+
+        section.setUniform("Blocks", newID)
+        section.setUniform("Data", newMeta)
+        return True
 
 
     def operateOnChunk(self, chunk):
@@ -103,6 +139,7 @@ class FillBlocksOperation(Operation):
         self.chunkCount += 1
 
         cx, cz = chunk.cx, chunk.cz
+        changedSections = []
 
         for cy in chunk.bounds.sectionPositions(cx, cz):
             section = chunk.getSection(cy, create=self.createSections)
@@ -110,7 +147,7 @@ class FillBlocksOperation(Operation):
                 continue
             self.sections += 1
             # Clip to section's actual size, for edge sections xxxxxxxxxx
-            slices = [slice(0, s) for s in section.Blocks.shape]
+            slices = [slice(0, s) for s in readSectionArray(section, "Blocks").shape]
 
             sectionMask = self.selection.section_mask(cx, cy, cz)
             if sectionMask is None:
@@ -125,33 +162,46 @@ class FillBlocksOperation(Operation):
                 self.skipped += 1
                 continue
 
-            Blocks = section.Blocks[slices]
-            Data = section.Data[slices]
-
-            if self.replaceTable is not None:
-                newBlocks = self.replaceTable[Blocks[mask], Data[mask]]
+            lightMask = mask
+            changed = self.fillUniformSection(section, blockCount == mask.size)
+            if changed is not None:
+                self.uniformSections += 1
+                if not changed:
+                    continue
+
+            elif self.replaceTable is not None:
+                Blocks = section.Blocks[slices]
+                Data = section.Data[slices]
+                oldBlocks = Blocks[mask]
+                newBlocks = self.replaceTable[oldBlocks, Data[mask]]
                 Blocks[mask] = newBlocks[..., 0]
                 Data[mask] = newBlocks[..., 1]
 
+                # Only positions whose block ID changed need relighting. Opacity and brightness are looked up
+                # by ID alone, so changing only the data value never changes light.
+                lightMask = numpy.zeros_like(mask)
+                lightMask[mask] = oldBlocks != newBlocks[..., 0]
+
             else:
+                Blocks = section.Blocks[slices]
+                Data = section.Data[slices]
                 Blocks[mask] = self.blockType.ID
                 Data[mask] = self.blockType.meta
 
-            if self.changesLighting and self.updateLights:
-                import mceditlib.relight
+            changedSections.append(cy)
 
-                coords = mask.nonzero()
-                y = coords[0] + (cy << 4)
-                z = coords[1] + (cz << 4)
-                x = coords[2] + (cx << 4)
-
-                mceditlib.relight.updateLights(self.dimension, x, y, z)
+            if self.relightScheduler is not None:
+                self.relightScheduler.addSection(cx, cy, cz, lightMask)
 
         def include(ref):
             return ref.Position not in self.selection
 
-        chunk.TileEntities[:] = filter(include, chunk.TileEntities)
-        chunk.dirty = True
+        tileEntities = filter(include, chunk.TileEntities)
+        if len(tileEntities) != len(chunk.TileEntities) or not hasattr(chunk, "markSectionsDirty"):
+            chunk.TileEntities[:] = tileEntities
+            chunk.dirty = True
+        else:
+            chunk.markSectionsDirty(changedSections)
 
 
 
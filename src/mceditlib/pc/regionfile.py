@@ -6,8 +6,10 @@
 """
 from __future__ import absolute_import
 import logging
+import mmap
 import os
 import struct
+import sys
 import zlib
 import time
 
@@ -15,6 +17,7 @@ import numpy
 
 from mceditlib import nbt
 from mceditlib.exceptions import ChunkNotPresent
+from mceditlib.util import notclosing
 
 log = logging.getLogger(__name__)
 
@@ -27,21 +30,161 @@ class RegionFormatError(RuntimeError):
     """
 
 
-def deflate(data):
-    return zlib.compress(data, 2)
+# zlib compression level used for chunks unless another is given. Favors speed over size.
+DEFAULT_COMPRESSION_LEVEL = 2
+
+
+def deflate(data, level=DEFAULT_COMPRESSION_LEVEL):
+    return zlib.compress(data, level)
 
 
 def inflate(data):
     return zlib.decompress(data)
 
+
+def decompress(data, fmt):
+    """
+    Decompress chunk data returned by RegionFile.readChunkCompressed according to its compression format.
+    """
+    if fmt == RegionFile.VERSION_GZIP:
+        return nbt.gunzip(data)
+    if fmt == RegionFile.VERSION_DEFLATE:
+        return inflate(data)
+
+    raise RegionFormatError("Unknown compress format: {0}".format(fmt))
+
+
+def _mortonIndex(cx, cz):
+    """
+    Interleave the bits of the region-local chunk coordinates to find their position along a Z-order curve.
+    """
+    index = 0
+    for bit in range(5):
+        index |= ((cx >> bit) & 1) << (2 * bit)
+        index |= ((cz >> bit) & 1) << (2 * bit + 1)
+    return index
+
+
+class FreeSectors(object):
+    """
+    The free sectors of a region file, kept as runs of consecutive free sectors.
+
+    Runs are looked up by their first and last sectors, so freed sectors merge with the runs next to them, and are
+    grouped by length, so an allocation finds the smallest run that fits without looking at the rest of the file.
+    """
+    # A chunk takes at most 255 sectors, so longer runs are all grouped together.
+    MAX_RUN_GROUP = 256
+
+    def __init__(self, sectorCount):
+        """
+        Track a file of sectorCount sectors, all of them in use.
+        """
+        self.sectorCount = sectorCount
+        self.freeCount = 0
+        self._runsByStart = {}
+        self._runsByEnd = {}
+        self._runsByLength = [set() for _ in range(self.MAX_RUN_GROUP + 1)]
+
+    @classmethod
+    def fromBitmap(cls, free):
+        """
+        :param free: True where the sector is free
+        :type free: numpy.ndarray
+        """
+        freeSectors = cls(len(free))
+        edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([0], free.view(numpy.int8), [0]))))
+        for start, end in zip(edges[0::2], edges[1::2]):
+            freeSectors._addRun(int(start), int(end - start))
+        return freeSectors
+
+    def _addRun(self, start, length):
+        self._runsByStart[start] = length
+        self._runsByEnd[start + length] = start
+        self._runsByLength[min(length, self.MAX_RUN_GROUP)].add(start)
+        self.freeCount += length
+
+    def _removeRun(self, start):
+        length = self._runsByStart.pop(start)
+        del self._runsByEnd[start + length]
+        self._runsByLength[min(length, self.MAX_RUN_GROUP)].remove(start)
+        self.freeCount -= length
+        return length
+
+    def free(self, start, count):
+        """
+        Mark count sectors starting at start as free.
+        """
+        if not count:
+            return
+        if start in self._runsByEnd:
+            prevStart = self._runsByEnd[start]
+            count += self._removeRun(prevStart)
+            start = prevStart
+        if start + count in self._runsByStart:
+            count += self._removeRun(start + count)
+        self._addRun(start, count)
+
+    def allocate(self, count):
+        """
+        Find the smallest run of free sectors that is at least count long, mark count sectors at its start as used,
+        and return the number of the first one. Return None if there is no such run.
+        """
+        for length in range(count, self.MAX_RUN_GROUP + 1):
+            if self._runsByLength[length]:
+                start = iter(self._runsByLength[length]).next()
+                break
+        else:
+            return None
+
+        length = self._removeRun(start)
+        if length > count:
+            self._addRun(start + count, length - count)
+        return start
+
+    def grow(self, count):
+        """
+        Add count sectors, in use, to the end of the file and return the number of the first one.
+        """
+        start = self.sectorCount
+        self.sectorCount += count
+        return start
+
+    def runs(self):
+        """
+        Return the runs of free sectors as a sorted list of (start, length) tuples.
+        """
+        return sorted(self._runsByStart.iteritems())
+
+
 class RegionFile(object):
     SECTOR_BYTES = 4096
     CHUNK_HEADER_SIZE = 5
     VERSION_GZIP = 1
     VERSION_DEFLATE = 2
 
-    def __init__(self, path):
+    def __init__(self, path, mmapped=False, deferHeaderWrites=False):
+        """
+        Open or create the region file at the given path.
+
+        If mmapped is True, the file is kept open and memory-mapped for as long as the RegionFile is in use. Chunk
+        reads then return zero-copy buffers into the mapped file instead of opening the file again for each access.
+        Call close() to release the mapping and the filehandle.
+
+        If deferHeaderWrites is True, changes to the offset and timestamp tables are kept in memory and only written
+        when flush() or close() is called. Sectors freed in the meantime are not reused until the header is written,
+        so the header on disk always points to intact chunk data.
+
+        :type path: str or unicode
+        :type mmapped: bool
+        :type deferHeaderWrites: bool
+        """
         self.path = path
+        self.mmapped = mmapped
+        self.deferHeaderWrites = deferHeaderWrites
+        self._headerDirty = False
+        self._pendingFreeSectors = []
+        self._file = None
+        self._mmap = None
         newFile = False
         if not os.path.exists(path):
             file(path, "w").close()
@@ -74,25 +217,31 @@ class RegionFile(object):
                 self.offsets = numpy.fromstring(offsetsData, dtype='>u4')
                 self.modTimes = numpy.fromstring(modTimesData, dtype='>u4')
 
-            self.freeSectors = [True] * (filesize / self.SECTOR_BYTES)
-            self.freeSectors[0:2] = False, False
+            # Runs of free sectors. A new file has only the two header sectors, which are never free.
+            sectorCount = filesize // self.SECTOR_BYTES
+            self.freeSectors = FreeSectors(sectorCount)
 
             if not newFile:
                 needsRepair = False
 
                 # Populate freeSectors table
-                for offset in self.offsets:
-                    sector = offset >> 8
-                    count = offset & 0xff
-
-                    for i in xrange(sector, sector + count):
-                        if i >= len(self.freeSectors):
-                            log.warn("Region file offset table points to sector %d (past the end of the file)", i)
-                            needsRepair = True
-                            break
-                        if self.freeSectors[i] is False:
-                            needsRepair = True
-                        self.freeSectors[i] = False
+                starts = (self.offsets >> 8).astype('i8')
+                ends = starts + (self.offsets & 0xff)
+                pastEnd = ends > sectorCount
+                if pastEnd.any():
+                    log.warn("Region file offset table points to sectors %s (past the end of the file)",
+                             starts[pastEnd])
+                    needsRepair = True
+                    numpy.clip(ends, 0, sectorCount, ends)
+                    numpy.clip(starts, 0, sectorCount, starts)
+
+                # Count the chunks using each sector by accumulating +1 at each chunk's start and -1 at its end.
+                coverage = numpy.cumsum(numpy.bincount(starts, minlength=sectorCount + 1)
+                                        - numpy.bincount(ends, minlength=sectorCount + 1))[:sectorCount]
+                coverage[0:2] += 1  # header sectors
+                if (coverage > 1).any():
+                    needsRepair = True
+                self.freeSectors = FreeSectors.fromBitmap(coverage == 0)
 
                 if needsRepair:
                     self.repair()
@@ -102,16 +251,106 @@ class RegionFile(object):
             else:
                 log.debug("Created new region file %s", os.path.basename(path))
 
+        if mmapped:
+            self._file = file(self.path, "rb+")
+            self._remap()
+
     def __repr__(self):
         return "%s(\"%s\")" % (self.__class__.__name__, self.path)
 
+    # --- File access ---
+
+    def _openFile(self):
+        """
+        Return a context manager giving a read/write filehandle for this region file. In mmapped mode, this is the
+        persistent filehandle and it is not closed on exit.
+        """
+        if self._file is not None:
+            return notclosing(self._file)
+        return file(self.path, "rb+")
+
+    def _remap(self):
+        """
+        (Re)create the memory map over the whole file. Must be called after the file changes size.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.flush()
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+
+    def _readBytes(self, position, length):
+        if self._mmap is not None:
+            return buffer(self._mmap, position, length)
+        with file(self.path, "rb") as f:
+            f.seek(position)
+            return f.read(length)
+
+    def _writeBytes(self, position, data):
+        if self._mmap is not None:
+            self._mmap.seek(position)
+            self._mmap.write(data)
+            return
+        with file(self.path, "rb+") as f:
+            f.seek(position)
+            f.write(data)
+
+    def _growFile(self, filesize):
+        if self._mmap is not None:
+            # The mapping must be released before the file can be resized on some platforms.
+            self._mmap.close()
+            self._mmap = None
+
+        with self._openFile() as f:
+            f.truncate(filesize)
+
+        if self._file is not None:
+            self._remap()
+
+    def _syncData(self):
+        if self._mmap is not None:
+            self._mmap.flush()
+        else:
+            with file(self.path, "rb+") as f:
+                os.fsync(f.fileno())
+
+    def flush(self):
+        """
+        Write the offset and timestamp tables if they were changed while header writes were deferred. Chunk data is
+        synced to disk before the header that points to it, and the header is synced before any sectors it no
+        longer uses are made available for reuse.
+        """
+        if not self._headerDirty:
+            return
+
+        self._syncData()
+        self._writeBytes(0, self.offsets.tostring() + self.modTimes.tostring())
+        self._syncData()
+        self._headerDirty = False
+
+        for sectorStart, sectorCount in self._pendingFreeSectors:
+            self.freeSectors.free(sectorStart, sectorCount)
+        self._pendingFreeSectors = []
+
+    def close(self):
+        """
+        Write any deferred header changes, then release the memory map and filehandle held in mmapped mode. Buffers
+        previously returned by readChunkCompressed are no longer valid after calling close().
+        """
+        self.flush()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
     @property
     def usedSectors(self):
-        return len(self.freeSectors) - sum(self.freeSectors)
+        return self.freeSectors.sectorCount - self.freeSectors.freeCount
 
     @property
     def sectorCount(self):
-        return len(self.freeSectors)
+        return self.freeSectors.sectorCount
 
     @property
     def chunkCount(self):
@@ -133,8 +372,8 @@ class RegionFile(object):
         """
 
         lostAndFound = {}
-        _freeSectors = [True] * len(self.freeSectors)
-        _freeSectors[0] = _freeSectors[1] = False
+        _freeSectors = numpy.ones(self.sectorCount, dtype=bool)
+        _freeSectors[0:2] = False
         deleted = 0
         recovered = 0
         log.info("Beginning repairs on {file} ({chunks} chunks)".format(file=os.path.basename(self.path), chunks=sum(self.offsets > 0)))
@@ -146,7 +385,7 @@ class RegionFile(object):
                 sectorCount = offset & 0xff
                 try:
 
-                    if sectorStart + sectorCount > len(self.freeSectors):
+                    if sectorStart + sectorCount > self.sectorCount:
                         raise RegionFormatError("Offset {start}:{end} ({offset}) at index {index} pointed outside of "
                                                 "the file".format(start=sectorStart, end=sectorStart + sectorCount, index=index, offset=offset))
 
@@ -155,12 +394,8 @@ class RegionFile(object):
                     lev = chunkTag["Level"]
                     xPos = lev["xPos"].value & 0x1f
                     zPos = lev["zPos"].value & 0x1f
-                    overlaps = False
-
-                    for i in xrange(sectorStart, sectorStart + sectorCount):
-                        if _freeSectors[i] is False:
-                            overlaps = True
-                        _freeSectors[i] = False
+                    overlaps = not _freeSectors[sectorStart:sectorStart + sectorCount].all()
+                    _freeSectors[sectorStart:sectorStart + sectorCount] = False
 
                     if xPos != cx or zPos != cz or overlaps:
                         lostAndFound[xPos, zPos] = data
@@ -187,6 +422,8 @@ class RegionFile(object):
     def readChunkCompressed(self, cx, cz):
         """
         Read a chunk and return its compression type and the compressed data as a (data, fmt) tuple
+
+        In mmapped mode, data is a buffer into the mapped file, valid until the file is next grown or closed.
         """
         cx &= 0x1f
         cz &= 0x1f
@@ -199,12 +436,11 @@ class RegionFile(object):
         if numSectors == 0:
             raise ChunkNotPresent((cx, cz))
 
-        if sectorStart + numSectors > len(self.freeSectors):
+        if sectorStart + numSectors > self.sectorCount:
             raise ChunkNotPresent((cx, cz))
 
-        with file(self.path, "rb") as f:
-            f.seek(sectorStart * self.SECTOR_BYTES)
-            data = f.read(numSectors * self.SECTOR_BYTES)
+        position = sectorStart * self.SECTOR_BYTES
+        data = self._readBytes(position, numSectors * self.SECTOR_BYTES)
         if len(data) < 5:
             raise RegionFormatError("Chunk %s data is only %d bytes long (expected 5)" % ((cx, cz), len(data)))
 
@@ -212,7 +448,11 @@ class RegionFile(object):
 
         length = struct.unpack_from(">I", data)[0]
         fmt = struct.unpack_from("B", data, 4)[0]
-        data = data[5:length + 5]
+        # length includes the format byte
+        if self._mmap is not None:
+            data = buffer(self._mmap, position + 5, min(length - 1, len(data) - 5))
+        else:
+            data = data[5:length + 4]
         return data, fmt
 
     def readChunkBytes(self, cx, cz):
@@ -228,15 +468,10 @@ class RegionFile(object):
         data, fmt = self.readChunkCompressed(cx, cz)
         if data is None:
             return None
-        if fmt == self.VERSION_GZIP:
-            return nbt.gunzip(data)
-        if fmt == self.VERSION_DEFLATE:
-            return inflate(data)
-
-        raise RegionFormatError("Unknown compress format: {0}".format(fmt))
+        return decompress(data, fmt)
 
-    def writeChunkBytes(self, cx, cz, uncompressedData):
-        data = deflate(uncompressedData)
+    def writeChunkBytes(self, cx, cz, uncompressedData, compressionLevel=DEFAULT_COMPRESSION_LEVEL):
+        data = deflate(uncompressedData, compressionLevel)
         self.writeChunkCompressed(cx, cz, data, self.VERSION_DEFLATE)
 
     def writeChunkCompressed(self, cx, cz, data, format):
@@ -258,36 +493,16 @@ class RegionFile(object):
             # we need to allocate new sectors
 
             # mark the sectors previously used for this chunk as free
-            for i in xrange(sectorNumber, sectorNumber + sectorsAllocated):
-                self.freeSectors[i] = True
-
-            runLength = 0
-            runStart = 0
-            try:
-                runStart = self.freeSectors.index(True)
-
-                for i in range(runStart, len(self.freeSectors)):
-                    if runLength:
-                        if self.freeSectors[i]:
-                            runLength += 1
-                        else:
-                            runLength = 0
-                    elif self.freeSectors[i]:
-                        runStart = i
-                        runLength = 1
+            self._releaseSectors(sectorNumber, sectorsAllocated)
 
-                    if runLength >= sectorsNeeded:
-                        break
-            except ValueError:
-                pass
+            runStart = self.freeSectors.allocate(sectorsNeeded)
 
             # we found a free space large enough
-            if runLength >= sectorsNeeded:
+            if runStart is not None:
                 log.debug("REGION SAVE {0},{1}, reusing {2}b".format(cx, cz, len(data)))
                 sectorNumber = runStart
                 self._setOffset(cx, cz, sectorNumber << 8 | sectorsNeeded)
                 self.writeSector(sectorNumber, data, format)
-                self.freeSectors[sectorNumber:sectorNumber + sectorsNeeded] = [False] * sectorsNeeded
 
             else:
                 # no free space large enough found -- we need to grow the
@@ -295,33 +510,86 @@ class RegionFile(object):
 
                 log.debug("REGION SAVE {0},{1}, growing by {2}b".format(cx, cz, len(data)))
 
-                with file(self.path, "rb+") as f:
-                    f.seek(0, 2)
-                    filesize = f.tell()
-
-                    sectorNumber = len(self.freeSectors)
+                sectorNumber = self.sectorCount
+                filesize = sectorNumber * self.SECTOR_BYTES
+                assert filesize == os.path.getsize(self.path)
 
-                    assert sectorNumber * self.SECTOR_BYTES == filesize
+                self._growFile(filesize + sectorsNeeded * self.SECTOR_BYTES)
 
-                    filesize += sectorsNeeded * self.SECTOR_BYTES
-                    f.truncate(filesize)
-
-                self.freeSectors += [False] * sectorsNeeded
+                self.freeSectors.grow(sectorsNeeded)
 
                 self._setOffset(cx, cz, sectorNumber << 8 | sectorsNeeded)
                 self.writeSector(sectorNumber, data, format)
 
         self.setTimestamp(cx, cz)
 
+    def compact(self, morton=True):
+        """
+        Rewrite all chunks contiguously without recompressing them and truncate the file to the space they use.
+        Chunks are ordered along a Morton (Z-order) curve, or in row-major order if morton is False, so neighboring
+        chunks end up close together in the file.
+
+        The compacted file is written next to the original and then moved over it. Buffers previously returned by
+        readChunkCompressed are no longer valid afterward.
+
+        :return: Number of bytes the file shrank by
+        :rtype: int
+        """
+        if morton:
+            key = lambda (cx, cz): _mortonIndex(cx, cz)
+        else:
+            key = lambda (cx, cz): cx + cz * 32
+        chunkPositions = sorted(self.chunkPositions(), key=key)
+
+        oldSize = self.sectorCount * self.SECTOR_BYTES
+        offsets = numpy.zeros_like(self.offsets)
+        sectorNumber = 2
+        tempPath = self.path + ".compact"
+        with file(tempPath, "wb") as f:
+            for cx, cz in chunkPositions:
+                data, fmt = self.readChunkCompressed(cx, cz)
+                sectorsNeeded = (len(data) + self.CHUNK_HEADER_SIZE) // self.SECTOR_BYTES + 1
+
+                f.seek(sectorNumber * self.SECTOR_BYTES)
+                f.write(struct.pack(">IB", len(data) + 1, fmt))
+                f.write(data)
+                offsets[cx + cz * 32] = sectorNumber << 8 | sectorsNeeded
+                sectorNumber += sectorsNeeded
+
+            f.truncate(sectorNumber * self.SECTOR_BYTES)
+            f.seek(0)
+            f.write(offsets.tostring())
+            f.write(self.modTimes.tostring())
+            f.flush()
+            os.fsync(f.fileno())
+
+        # The new file already has the current header, so there is nothing left to flush.
+        self._headerDirty = False
+        self._pendingFreeSectors = []
+        mmapped = self._file is not None
+        self.close()
+
+        if sys.platform == "win32":
+            os.remove(self.path)  # os.rename can't replace files on Windows
+        os.rename(tempPath, self.path)
+
+        self.offsets = offsets
+        self.freeSectors = FreeSectors(sectorNumber)
+        if mmapped:
+            self._file = file(self.path, "rb+")
+            self._remap()
+
+        newSize = sectorNumber * self.SECTOR_BYTES
+        log.info("Compacted region file %s from %d to %d bytes", os.path.basename(self.path), oldSize, newSize)
+        return oldSize - newSize
+
     def writeSector(self, sectorNumber, data, format):
-        with file(self.path, "rb+") as f:
-            log.debug("REGION: Writing sector {0}".format(sectorNumber))
+        log.debug("REGION: Writing sector {0}".format(sectorNumber))
 
-            f.seek(sectorNumber * self.SECTOR_BYTES)
-            f.write(struct.pack(">I", len(data) + 1))  # // chunk length
-            f.write(struct.pack("B", format))  # // chunk version number
-            f.write(data)  # // chunk data
-            # f.flush()
+        header = struct.pack(">IB", len(data) + 1, format)  # // chunk length, chunk version number
+        position = sectorNumber * self.SECTOR_BYTES
+        self._writeBytes(position, header)
+        self._writeBytes(position + len(header), data)  # // chunk data
 
     def containsChunk(self, cx, cz):
         return self._getOffset(cx, cz) != 0
@@ -335,19 +603,27 @@ class RegionFile(object):
         cx &= 0x1f
         cz &= 0x1f
         self.offsets[cx + cz * 32] = offset
-        with file(self.path, "rb+") as f:
-            f.seek(0)
-            f.write(self.offsets.tostring())
+        if self.deferHeaderWrites:
+            self._headerDirty = True
+        else:
+            self._writeBytes(0, self.offsets.tostring())
 
     def deleteChunk(self, cx, cz):
         offset = self._getOffset(cx, cz)
         sectorNumber = offset >> 8
         sectorsAllocated = offset & 0xff
-        for i in range(sectorNumber, sectorNumber + sectorsAllocated):
-            self.freeSectors[i] = True
+        self._releaseSectors(sectorNumber, sectorsAllocated)
 
         self._setOffset(cx, cz, 0)
 
+    def _releaseSectors(self, sectorStart, sectorCount):
+        if self.deferHeaderWrites:
+            # The header on disk may still point to these sectors.
+            self._pendingFreeSectors.append((sectorStart, sectorCount))
+            return
+
+        self.freeSectors.free(sectorStart, sectorCount)
+
     def getTimestamp(self, cx, cz):
         cx &= 0x1f
         cz &= 0x1f
@@ -360,8 +636,9 @@ class RegionFile(object):
         cx &= 0x1f
         cz &= 0x1f
         self.modTimes[cx + cz * 32] = timestamp
-        with file(self.path, "rb+") as f:
-            f.seek(self.SECTOR_BYTES)
-            f.write(self.modTimes.tostring())
+        if self.deferHeaderWrites:
+            self._headerDirty = True
+        else:
+            self._writeBytes(self.SECTOR_BYTES, self.modTimes.tostring())
 
 
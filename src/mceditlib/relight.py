@@ -1,8 +1,9 @@
 
-import logging
-import pprint
 import itertools
+import logging
+import multiprocessing
 import numpy
+from mceditlib import lightengine
 from mceditlib.heightmaps import extractHeights
 
 log = logging.getLogger(__name__)
@@ -17,6 +18,7 @@ def unique_chunks(x, z):
 
 def updateHeightmap(dimension, x, y, z):
     """
+    Update the HeightMap columns that contain the given positions.
 
     :param dimension:
     :type dimension: mceditlib.worldeditor.WorldEditorDimension
@@ -26,120 +28,82 @@ def updateHeightmap(dimension, x, y, z):
     :return:
     :rtype:
     """
-    blocktypes = dimension.blocktypes
-    blocktypeOpacity = numpy.array(blocktypes.opacity)
-    numpy.clip(blocktypeOpacity, 1, 15, blocktypeOpacity)
-    blocktypeOpacity.dtype = 'int8'
+    x, z = [numpy.ravel(a).astype('int64') for a in numpy.broadcast_arrays(x, z)]
+    columns = {}
+    for cx, cz in unique_chunks(x, z):
+        inChunk = ((x >> 4) == cx) & ((z >> 4) == cz)
+        mask = columns[cx, cz] = numpy.zeros((16, 16), bool)
+        mask[z[inChunk] & 0xf, x[inChunk] & 0xf] = True
 
-    chunkPos = unique_chunks(x, z)
-    for i, (cx, cz) in enumerate(chunkPos):
-        chunk = dimension.getChunk(cx, cz)
-        HeightMap = chunk.HeightMap
-        if HeightMap is None:
-            return  # Level does not have heightmaps.
+    updateHeightmapColumns(dimension, columns)
 
-        newHeightMap = numpy.zeros_like(HeightMap)
-        for cy in reversed(chunk.sectionPositions()):
-            section = chunk.getSection(cy)
-            opacity = blocktypes.opacity[section.Blocks]
-            heights = extractHeights(opacity)
-            heights[heights > 0] += cy << 4
-
-            numpy.maximum(newHeightMap, heights, newHeightMap)
-        #
-        changedHM = newHeightMap != HeightMap
-        chunk.HeightMap[:] = newHeightMap
-
-        #
-        # for ix, iz in changedHM:
-        #     new = newHeightMap[iz, ix]
-        #     old = HeightMap[iz, ix]
-        #     if new < old:
-        #         for iy in range(old):
-        #
-        updatePos = []
-        z, x = changedHM.nonzero()
-        for cy in reversed(chunk.sectionPositions()):
-            newHeight = newHeightMap[z, x]
-            belowSection = newHeight < cy << 4
-            section = chunk.getSection(cy)
-            section.SkyLight[:, z[belowSection], x[belowSection]] = 15
-            aboveSection = newHeight >= (cy+1) << 4
-            section.SkyLight[:, z[aboveSection], x[aboveSection]] = 0
-            inSection = ~belowSection & ~aboveSection
-            y = newHeight[inSection]
-            if not y.size:
-                continue
 
-            sectionTop = y - (cy << 4)
-            # repeat each pair of coordinates in z,x a number of times equal to sectionTop[z, x]
-            # construct a y coordinate array equal to concatenated ranges of 0..sectionTop[z,x]
-            # such that its length is equal to the first two arrays'
-            iz = z[inSection]
-            ix = x[inSection]
-            section.SkyLight[:, iz, ix] = 15
-            rz = numpy.repeat(iz, sectionTop)
-            rx = numpy.repeat(ix, sectionTop)
-            ry = numpy.concatenate([numpy.arange(s) for s in sectionTop])
-            section.SkyLight[ry, rz, rx] = 0
-
-            updatePos.append((y, iz, ix))
-        #
-        #
-        # for x, z in itertools.product(xrange(16), xrange(16)):
-        #     if changedHM[z, x] == False:
-        #         continue
-        #     for cy in reversed(chunk.sectionPositions()):
-        #         section = chunk.getSection(cy)
-        #         newHeight = newHeightMap[z, x]
-        #         if newHeight < cy << 4:
-        #             section.SkyLight[:, z, x] = 15
-        #             continue
-        #         if newHeight >= (cy+1) << 4:
-        #             section.SkyLight[:, z, x] = 0
-        #             continue
-        #
-        #         section.SkyLight[newHeight & 0xf:16, z, x] = 15
-        #         updatePos.append((newHeight-1, z + cz << 4, x + cx << 4))
-        #
-        if not len(updatePos):
-            return
+def updateHeightmaps(dimension, chunkPositions):
+    """
+    Recompute the HeightMap of each of the given chunks.
 
-        ys, zs, xs = zip(*updatePos)
-        uy = numpy.concatenate(ys)
-        uz = numpy.concatenate(zs)
-        uz += cz << 4
-        ux = numpy.concatenate(xs)
-        ux += cx << 4
+    :type dimension: mceditlib.worldeditor.WorldEditorDimension
+    :type chunkPositions: iterable of (int, int)
+    """
+    updateHeightmapColumns(dimension, {pos: numpy.ones((16, 16), bool) for pos in chunkPositions})
+
+
+def updateHeightmapColumns(dimension, columns):
+    """
+    Recompute the selected columns of each chunk's HeightMap. The opacity of a chunk's selected columns is stacked
+    from all of its sections, and the top opaque block of every column is found at once, so the work done is
+    proportional to the number of columns selected.
 
-        result = dimension.getBlocks(ux, uy, uz)
-        opacity = blocktypeOpacity[result.Blocks]
-        newLight = -opacity + 15
-        newLight.dtype = 'int8'
-        numpy.clip(newLight, 0, 15, newLight)
+    :type dimension: mceditlib.worldeditor.WorldEditorDimension
+    :param columns: Mapping of chunk positions (cx, cz) to ZX ordered boolean masks of the columns to recompute
+    :type columns: dict[(int, int), numpy.ndarray]
+    """
+    from mceditlib.multi_block import readSectionArray
+
+    opacity = dimension.blocktypes.tables.opacity
+    bounds = dimension.bounds
+    minCY = bounds.miny >> 4
+    maxCY = (bounds.maxy - 1) >> 4
 
-        while True:
-            dimension.setBlocks(ux, uy, uz, SkyLight=newLight)
-            stillBright = newLight > 0
-            if not len(stillBright):
-                break
-            ux = ux[stillBright]
-            uy = uy[stillBright]
-            uz = uz[stillBright]
-            newLight = newLight[stillBright]
-            uy -= 1
+    for (cx, cz), mask in columns.iteritems():
+        if not dimension.containsChunk(cx, cz):
+            continue
+        chunk = dimension.getChunk(cx, cz)
+        HeightMap = chunk.HeightMap
+        if HeightMap is None:
+            return  # Level does not have heightmaps.
 
-            result = dimension.getBlocks(ux, uy, uz)
-            opacity = blocktypeOpacity[result.Blocks]
-            newLight = newLight - opacity
-            newLight.dtype = 'int8'
-            numpy.clip(newLight, 0, 15, newLight)
+        # Only stack up to the highest section, since missing sections are transparent
+        sectionPositions = [cy for cy in chunk.sectionPositions() if minCY <= cy <= maxCY]
+        height = (max(sectionPositions) - minCY + 1) << 4 if sectionPositions else 16
+        whole = mask.all()
+        if whole:
+            columnOpacity = numpy.zeros((height, 16, 16), bool)
+        else:
+            columnOpacity = numpy.zeros((height, 1, numpy.count_nonzero(mask)), bool)
 
+        for cy in sectionPositions:
+            section = chunk.getSection(cy)
+            if section is not None:
+                y = (cy - minCY) << 4
+                Blocks = readSectionArray(section, "Blocks")
+                if whole:
+                    columnOpacity[y:y + 16] = opacity[Blocks]
+                else:
+                    columnOpacity[y:y + 16, 0] = opacity[Blocks[:, mask]]
 
+        heights = extractHeights(columnOpacity)
+        heights[heights > 0] += minCY << 4
+        if whole:
+            HeightMap[:] = heights
+        else:
+            HeightMap[mask] = heights[0]
 
 
 def updateLights(dimension, x, y, z):
     """
+    Update the HeightMap, BlockLight and SkyLight after the blocks at the given positions have changed. Light is
+    propagated by `lightengine`, which also removes light that can no longer reach a position.
 
     :param dimension:
     :type dimension: mceditlib.worldeditor.WorldEditorDimension
@@ -150,75 +114,296 @@ def updateLights(dimension, x, y, z):
     :rtype:
     """
     updateHeightmap(dimension, x, y, z)
-    brightness = numpy.array(dimension.blocktypes.brightness)
-    brightness.dtype = 'int8'
-
-    opacity = numpy.array(dimension.blocktypes.opacity)
-    numpy.clip(opacity, 1, 15, opacity)
-    opacity.dtype = 'int8'
-    assert opacity[0] == 1
-    result = dimension.getBlocks(x, y, z, return_BlockLight=True)
-    brightness = numpy.maximum(brightness[result.Blocks], result.BlockLight)
-
-    dimension.setBlocks(x, y, z, BlockLight=brightness, updateLights=False)
-    # x+
-
-    def go(dx, dy, dz, x, y, z, brightness):
-        nx = x + dx if dx else x
-        ny = y + dy if dy else y
-        nz = z + dz if dz else z
-        # log.info("xyz %s", (nx, ny, nz))
-
-        nextResult = dimension.getBlocks(nx, ny, nz, return_BlockLight=True)
-        nextOpacity = opacity[nextResult.Blocks]
-        # log.info("nextOpacity %s", nextOpacity)
-        nextBrightness = brightness - nextOpacity
-        numpy.clip(nextBrightness, 0, 15, nextBrightness)
-        # log.info("nextBrightness %s > %s", nextBrightness, nextResult.BlockLight)
-        nextChanged = nextBrightness > nextResult.BlockLight
-        #nextChanged &= (nextBrightness != 0)
-        # log.info("nextChanged %s", nextChanged)
-        nextBrightness = nextBrightness[nextChanged]
-        if 0 == nextBrightness.size:
+    lightengine.updateLights(dimension, x, y, z)
+
+
+class RelightScheduler(object):
+    def __init__(self, dimension):
+        """
+        Collects the positions whose blocks were changed by an operation so they can all be relit at once by
+        calling `relight`. Each section's changed positions are kept as a mask, so a position changed more than once
+        is only relit once, and light is spread across section borders once instead of once per change.
+
+        :type dimension: mceditlib.worldeditor.WorldEditorDimension
+        """
+        self.dimension = dimension
+        self.sectionMasks = {}  # (cx, cy, cz) -> YZX boolean mask of changed positions
+
+    def __len__(self):
+        return len(self.sectionMasks)
+
+    def _sectionMask(self, cx, cy, cz):
+        mask = self.sectionMasks.get((cx, cy, cz))
+        if mask is None:
+            mask = self.sectionMasks[cx, cy, cz] = numpy.zeros((16, 16, 16), bool)
+        return mask
+
+    def addPositions(self, x, y, z):
+        """
+        Record the given positions as changed.
+
+        :type x: numpy.ndarray
+        :type y: numpy.ndarray
+        :type z: numpy.ndarray
+        """
+        from mceditlib import multi_block
+
+        for cx, cz, sx, sy, sz, index in multi_block.coords_by_chunk(x, y, z):
+            for cy, sectionIndex in multi_block.coords_by_section(sy):
+                mask = self._sectionMask(cx, cy, cz)
+                mask[sy[sectionIndex] & 0xf, sz[sectionIndex], sx[sectionIndex]] = True
+
+    def addSection(self, cx, cy, cz, mask):
+        """
+        Record the positions selected by mask in the given section as changed. mask is ordered YZX and may be
+        smaller than a section for sections at the edge of a level.
+
+        :type mask: numpy.ndarray
+        """
+        h, l, w = mask.shape
+        sectionMask = self._sectionMask(cx, cy, cz)
+        sectionMask[:h, :l, :w] |= mask
+
+    def addBox(self, box):
+        """
+        Record every position in box as changed.
+
+        :type box: mceditlib.geometry.SelectionBox
+        """
+        for cx, cz in box.chunkPositions():
+            for cy in box.sectionPositions(cx, cz):
+                mask = box.section_mask(cx, cy, cz)
+                if mask is not None:
+                    self.addSection(cx, cy, cz, mask)
+
+    def relight(self):
+        """
+        Update the HeightMap, BlockLight and SkyLight for every recorded position, then forget them.
+        """
+        if not self.sectionMasks:
             return
-        # log.info("nextBrightness[nextChanged] %s", nextBrightness)
-        cx = nx[nextChanged]
-        cy = ny[nextChanged]
-        cz = nz[nextChanged]
-        # log.info("xyz[nextChanged] %s", (cx, cy, cz))
-
-        dimension.setBlocks(cx, cy, cz,
-                            BlockLight=nextBrightness,
-                            updateLights=False)
-        # r = dimension.getBlocks(cx, cy, cz,
-        #                     return_BlockLight=True,
-        #                     )
-        # assert r.BlockLight == nextBrightness, "Expected %s to be %s" % (r.BlockLight, nextBrightness)
-
-        #recurse(cx, cy, cz, nextBrightness)
-        return cx, cy, cz
-
-    def goNeighbors(x, y, z, brightness):
-        result = []
-        result.append(go(1, 0, 0, x, y, z, brightness))
-        result.append(go(-1, 0, 0, x, y, z, brightness))
-        result.append(go(0, 1, 0, x, y, z, brightness))
-        result.append(go(0, -1, 0, x, y, z, brightness))
-        result.append(go(0, 0, 1, x, y, z, brightness))
-        result.append(go(0, 0, -1, x, y, z, brightness))
-        result = [r for r in result if r is not None]
-        if not len(result):
-            return [], [], [], []
-        x, y, z = zip(*result)
-        #log.info("SHAPE %s", [a.shape for a in x])
-        x = numpy.concatenate(x)
-        y = numpy.concatenate(y)
-        z = numpy.concatenate(z)
-
-        result = dimension.getBlocks(x, y, z, return_BlockLight=True)
-        return x, y, z, result.BlockLight
-
-    while len(x):
- #       coords = zip(x, y, z, brightness)
- #       log.info("Lighting step:\n%s", pprint.pformat(coords))
-        x, y, z, brightness = goNeighbors(x, y, z, brightness)
+
+        sections = {key: numpy.flatnonzero(mask) for key, mask in self.sectionMasks.iteritems()}
+        columns = {}
+        for (cx, cy, cz), mask in self.sectionMasks.iteritems():
+            columns[cx, cz] = columns.get((cx, cz), False) | mask.any(0)
+        self.sectionMasks = {}
+        updateHeightmapColumns(self.dimension, columns)
+        lightengine.updateSectionLights(self.dimension, sections)
+
+
+def columnSkyLight(opacity):
+    """
+    Compute the SkyLight of a chunk from the sky straight down, ignoring light that spreads sideways. Also returns
+    the heights of the columns, and the positions whose light spreads further sideways within the chunk than the
+    columns account for.
+
+    Light is full above the highest block with any opacity in each column, then loses that block's opacity, and
+    loses at least one level at each block below it.
+
+    :param opacity: Opacity of every block in the chunk, ordered YZX. Its height must be a multiple of 16.
+    :type opacity: numpy.ndarray
+    :return: (heights, light, seeds), where heights is ordered ZX like HeightMap, light is ordered like
+        opacity, and seeds are flat indexes into light.
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    heights = extractHeights(opacity)
+    steps = numpy.maximum(opacity, 1).astype('int32')
+    steps[numpy.arange(len(opacity))[:, None, None] >= heights] = 0
+    light = 15 - steps[::-1].cumsum(0)[::-1]
+    light = numpy.clip(light, 0, 15).astype('uint8')
+
+    # A position seeds sideways spreading if it lights a horizontal neighbor more than the neighbor's column does
+    spread = light.astype('int32')
+    steps = numpy.maximum(opacity, 1)
+    seeds = numpy.zeros(light.shape, bool)
+    for source, dest in ((numpy.s_[:, :, :-1], numpy.s_[:, :, 1:]), (numpy.s_[:, :, 1:], numpy.s_[:, :, :-1]),
+                         (numpy.s_[:, :-1, :], numpy.s_[:, 1:, :]), (numpy.s_[:, 1:, :], numpy.s_[:, :-1, :])):
+        seeds[source] |= spread[source] - steps[dest] > spread[dest]
+
+    return heights, light, numpy.flatnonzero(seeds)
+
+
+def _edge(array, dx, dz):
+    # The 16 values of a ZX ordered array along the chunk edge facing (dx, dz)
+    if dx:
+        return array[:, 0 if dx < 0 else 15]
+    return array[0 if dz < 0 else 15, :]
+
+
+def _edgeIndexes(dx, dz, heights, height):
+    # Flat indexes into a chunk's YZX light of the positions on the edge facing (dx, dz) below the given heights
+    y, i = numpy.nonzero(numpy.arange(height)[:, None] < heights[None, :])
+    if dx:
+        x, z = (0 if dx < 0 else 15), i
+    else:
+        x, z = i, (0 if dz < 0 else 15)
+    return y << 8 | z << 4 | x
+
+
+def _addChunkSeeds(engine, cx, cz, minCY, index, sectionPositions=None):
+    # Queue seeds that spread the current light at the given flat indexes into a whole chunk's YZX light, skipping
+    # seeds in sections not in sectionPositions if it is given
+    if not len(index):
+        return
+    index = numpy.sort(index)
+    sections = index >> 12
+    starts = numpy.flatnonzero(numpy.diff(sections)) + 1
+    bounds = [0] + starts.tolist() + [len(index)]
+    for start, end in zip(bounds, bounds[1:]):
+        cy = minCY + int(sections[start])
+        if sectionPositions is None or cy in sectionPositions:
+            engine.addLightSources((cx, cy, cz), index[start:end] & 0xfff, 0)
+
+
+def _skySeedSections(chunk, minCY, maxCY):
+    # Sections whose skylight may spread into a neighbor: existing sections, and the missing sections above them
+    # that read as full skylight. Other missing sections are dark.
+    sectionPositions = set(chunk.sectionPositions())
+    top = max(sectionPositions) if sectionPositions else minCY - 1
+    return sectionPositions.union(range(top + 1, maxCY + 1))
+
+
+def _chunkOpacity(chunk, opacityTable, minCY, maxCY):
+    from mceditlib.multi_block import readSectionArray
+
+    opacity = numpy.zeros(((maxCY - minCY + 1) << 4, 16, 16), 'uint8')
+    for cy in chunk.sectionPositions():
+        if minCY <= cy <= maxCY:
+            section = chunk.getSection(cy)
+            if section is not None:
+                y = (cy - minCY) << 4
+                opacity[y:y + 16] = opacityTable[readSectionArray(section, "Blocks")]
+    return opacity
+
+
+def _writeChunkLight(chunk, light, brightness, blockEngine, minCY, maxCY):
+    # Store a chunk's column skylight, clear its BlockLight, and queue its light sources. Sections are created only
+    # where the skylight cannot be read from a missing section: sections above the highest section read as full
+    # skylight, and other missing sections as darkness.
+    from mceditlib.multi_block import readSectionArray
+
+    sectionPositions = set(chunk.sectionPositions())
+    above = True
+    for cy in range(maxCY, minCY - 1, -1):
+        y = (cy - minCY) << 4
+        sectionLight = light[y:y + 16]
+        section = chunk.getSection(cy)
+        if section is None:
+            if above and (sectionLight == 15).all():
+                continue
+            if not above and not sectionLight.any():
+                continue
+            section = chunk.getSection(cy, create=True)
+        above = False
+
+        lightengine.setSectionLight(section, "SkyLight", sectionLight)
+        lightengine.setSectionLight(section, "BlockLight", numpy.zeros((16, 16, 16), 'uint8'))
+        if cy in sectionPositions:
+            emit = brightness[readSectionArray(section, "Blocks")].ravel()
+            index = numpy.flatnonzero(emit)
+            if len(index):
+                blockEngine.addLightSources((chunk.cx, cy, chunk.cz), index, emit[index])
+
+
+def generateLightsIter(dimension, chunkPositions=None, workers=None):
+    """
+    Recompute the HeightMap, SkyLight and BlockLight of the given chunks from scratch, for worlds that were
+    imported or generated without light. Yields progress as (current, maximum, status) tuples.
+
+    Column skylight is computed for each chunk on a pool of worker processes, then light is spread sideways,
+    across chunk borders, and from light sources. Chunks next to the given chunks are brightened by light that
+    spreads out of them, but are not otherwise relit.
+
+    :type dimension: mceditlib.worldeditor.WorldEditorDimension
+    :param chunkPositions: Chunks to relight, or None to relight every chunk
+    :type chunkPositions: iterable of (int, int) | None
+    :param workers: Number of worker processes, or None to use one for each CPU. 1 computes the column
+        skylight on this process.
+    :type workers: int | None
+    """
+    if chunkPositions is None:
+        chunkPositions = dimension.chunkPositions()
+    chunkPositions = [(cx, cz) for cx, cz in chunkPositions if dimension.containsChunk(cx, cz)]
+    relit = set(chunkPositions)
+    total = len(chunkPositions)
+
+    tables = dimension.blocktypes.tables
+    opacityTable = tables.opacity
+    brightness = tables.brightness
+    bounds = dimension.bounds
+    minCY = bounds.miny >> 4
+    maxCY = (bounds.maxy - 1) >> 4
+    height = (maxCY - minCY + 1) << 4
+
+    skyEngine = lightengine.LightEngine(dimension, "SkyLight")
+    blockEngine = lightengine.LightEngine(dimension, "BlockLight")
+    heightsByChunk = {}
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    batchSize = max(workers, 1) * 8
+    pool = None
+    if workers > 1 and total > batchSize:
+        pool = multiprocessing.Pool(workers)
+
+    try:
+        done = 0
+        for start in range(0, total, batchSize):
+            chunks = [dimension.getChunk(cx, cz) for cx, cz in chunkPositions[start:start + batchSize]]
+            stacks = [_chunkOpacity(chunk, opacityTable, minCY, maxCY) for chunk in chunks]
+            if pool is not None:
+                results = pool.map(columnSkyLight, stacks)
+            else:
+                results = itertools.imap(columnSkyLight, stacks)
+
+            for chunk, (heights, light, seeds) in itertools.izip(chunks, results):
+                cx, cz = chunk.cx, chunk.cz
+                if chunk.HeightMap is not None:
+                    chunk.HeightMap[:] = heights + bounds.miny
+                heightsByChunk[cx, cz] = heights
+
+                _writeChunkLight(chunk, light, brightness, blockEngine, minCY, maxCY)
+                _addChunkSeeds(skyEngine, cx, cz, minCY, seeds)
+                chunk.dirty = True
+
+                done += 1
+                yield done, total, "Computing skylight"
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # Spread light across chunk borders wherever the other side is darker than full skylight
+    fullHeights = numpy.full(16, height, 'int32')
+    for done, (cx, cz) in enumerate(chunkPositions):
+        heights = heightsByChunk[cx, cz]
+        skySections = _skySeedSections(dimension.getChunk(cx, cz), minCY, maxCY)
+        for dx, dz in (-1, 0), (1, 0), (0, -1), (0, 1):
+            ncx, ncz = cx + dx, cz + dz
+            if (ncx, ncz) in relit:
+                neighborHeights = heightsByChunk[ncx, ncz]
+            elif dimension.containsChunk(ncx, ncz):
+                neighbor = dimension.getChunk(ncx, ncz)
+                if neighbor.HeightMap is None:
+                    neighborHeights = numpy.full((16, 16), height, 'int32')
+                else:
+                    neighborHeights = numpy.asarray(neighbor.HeightMap, 'int32') - bounds.miny
+
+                # The neighbor is not relit, so let its light back in from its side
+                index = _edgeIndexes(-dx, -dz, _edge(heights, dx, dz), height)
+                _addChunkSeeds(skyEngine, ncx, ncz, minCY, index, _skySeedSections(neighbor, minCY, maxCY))
+                index = _edgeIndexes(-dx, -dz, fullHeights, height)
+                _addChunkSeeds(blockEngine, ncx, ncz, minCY, index, set(neighbor.sectionPositions()))
+            else:
+                continue
+
+            index = _edgeIndexes(dx, dz, _edge(neighborHeights, -dx, -dz), height)
+            _addChunkSeeds(skyEngine, cx, cz, minCY, index, skySections)
+
+        if done % 64 == 0:
+            yield done, total, "Stitching chunk borders"
+
+    for engine in skyEngine, blockEngine:
+        for progress in engine.propagateIter():
+            yield progress
@@ -93,6 +93,10 @@ class RevisionHistory(object):
 
     To write all changes from partial folders into the initial world folder, call writeAllChanges.
 
+    To find chunks without searching every revision, the RevisionHistory keeps an index of the chunks written or
+    deleted in the revisions leading to the head node. Chunks that are not in the index are read from the initial
+    world folder.
+
     When the RevisionHistory is deleted, all partial folders are removed from disk.
     """
 
@@ -128,6 +132,10 @@ class RevisionHistory(object):
         self.IDcounter = 0
         self.nodes = [self.rootNode]
 
+        # dimName -> {(cx, cz) -> newest node before the root node in the head node's chain that contains the chunk,
+        # or None if that node deleted the chunk}
+        self.chunkIndex = collections.defaultdict(dict)
+
     def __repr__(self):
         return "RevisionHistory(%s)" % repr(self.rootFolder)
 
@@ -216,8 +224,45 @@ class RevisionHistory(object):
                 shutil.rmtree(node.worldFolder.filename, ignore_errors=True)
                 node.invalid = True
 
+        if deadNodes:
+            self.rebuildChunkIndex()
+
         return newNode
 
+    def rebuildChunkIndex(self):
+        """
+        Rebuild the chunk index from the revisions leading to the head node. Called when revisions are removed from
+        the head node's chain or when the root node moves.
+        """
+        chain = []
+        node = self.getHead()
+        while node is not None and node is not self.rootNode:
+            chain.append(node)
+            node = node.parentNode
+
+        self.chunkIndex.clear()
+        for node in reversed(chain):
+            for dimName in node.worldFolder.listDimensions():
+                dimIndex = self.chunkIndex[dimName]
+                for cx, cz in node.worldFolder.chunkPositions(dimName):
+                    dimIndex[cx, cz] = node
+            for cx, cz, dimName in node.deadChunks:
+                self.chunkIndex[dimName][cx, cz] = None
+
+    def _indexChunk(self, node, cx, cz, dimName, present):
+        # Called when a chunk is written or deleted in a node. Only changes to the head node affect the index.
+        if node is self.getHead() and node is not self.rootNode:
+            self.chunkIndex[dimName][cx, cz] = node if present else None
+
+    def findChunkNode(self, cx, cz, dimName):
+        """
+        Return the node holding the head node's version of the given chunk, or None if the chunk is not present.
+        """
+        node = self.chunkIndex[dimName].get((cx, cz), self.rootNode)
+        if node is self.rootNode and not self.rootFolder.containsChunk(cx, cz, dimName):
+            return None
+        return node
+
     def closeRevision(self):
         self.getHead().readonly = True
 
@@ -267,11 +312,12 @@ class RevisionHistory(object):
 
         return changes
 
-    def writeAllChanges(self, requestedRevision=None):
+    def writeAllChanges(self, requestedRevision=None, compressionLevel=None):
         """
         Write all changes to the root world folder, preserving undo history. The previous head node is no longer
         valid after calling writeAllChanges. Specify a revision to only save changes up to and including that
-        revision.
+        revision. Chunks are copied to the root world folder in their compressed form, unless a zlib compression
+        level is given to recompress them at.
         :return:
         :rtype:
         """
@@ -293,7 +339,7 @@ class RevisionHistory(object):
                 orphanChainNode = orphanChainNode.parentNode
 
             for orphanChainNode in reversed(orphanNodes):
-                copyToFolder(self.rootFolder, orphanChainNode)
+                copyToFolder(self.rootFolder, orphanChainNode, compressionLevel=compressionLevel)
 
             self.nodes[self.orphanChainIndex] = self.rootNode
             self.orphanChainIndex = None
@@ -320,7 +366,7 @@ class RevisionHistory(object):
             reverseNode.differences = self.rootNode.differences
             self.rootNode.differences = currentNode.getChanges()
 
-            copyToFolder(self.rootFolder, currentNode, reverseNode)
+            copyToFolder(self.rootFolder, currentNode, reverseNode, compressionLevel)
             # xxx look ahead one or more nodes to skip some copies
 
             reverseNode.setRevisionInfo(self.rootNode.getRevisionInfo())
@@ -339,12 +385,19 @@ class RevisionHistory(object):
             currentNode.invalid = True
             shutil.rmtree(currentNode.worldFolder.filename, ignore_errors=True)
 
+        self.rebuildChunkIndex()
 
-def copyToFolder(destFolder, sourceNode, presaveNode=None):
+
+def copyToFolder(destFolder, sourceNode, presaveNode=None, compressionLevel=None):
+    """
+    Write the changes in sourceNode to destFolder. If presaveNode is given, the chunks and files that are replaced
+    or deleted are saved to it first. Chunks are copied without decompressing them, except that chunks written to
+    destFolder are recompressed if compressionLevel is given.
+    """
     if presaveNode:
         presaveFolder = presaveNode.worldFolder
     else:
-        presaveNode = None
+        presaveFolder = None
 
     sourceFolder = sourceNode.worldFolder
 
@@ -352,7 +405,7 @@ def copyToFolder(destFolder, sourceNode, presaveNode=None):
     for cx, cz, dimName in sourceNode.deadChunks:
         if destFolder.containsChunk(cx, cz, dimName):
             if presaveFolder and not presaveFolder.containsChunk(cx, cz, dimName):
-                presaveFolder.writeChunkBytes(cx, cz, dimName, destFolder.readChunkBytes(cx, cz, dimName))
+                presaveFolder.copyChunkFrom(destFolder, cx, cz, dimName)
             destFolder.deleteChunk(cx, cz, dimName)
 
     # Write new and modified chunks
@@ -360,10 +413,14 @@ def copyToFolder(destFolder, sourceNode, presaveNode=None):
         for cx, cz in sourceFolder.chunkPositions(dimName):
             if presaveFolder and not presaveFolder.containsChunk(cx, cz, dimName):
                 if destFolder.containsChunk(cx, cz, dimName):
-                    presaveFolder.writeChunkBytes(cx, cz, dimName, destFolder.readChunkBytes(cx, cz, dimName))
+                    presaveFolder.copyChunkFrom(destFolder, cx, cz, dimName)
                 else:  # new chunk
                     presaveNode.deleteChunk(cx, cz, dimName)
-            destFolder.writeChunkBytes(cx, cz, dimName, sourceFolder.readChunkBytes(cx, cz, dimName))
+            if compressionLevel is None:
+                destFolder.copyChunkFrom(sourceFolder, cx, cz, dimName)
+            else:
+                destFolder.writeChunkBytes(cx, cz, dimName, sourceFolder.readChunkBytes(cx, cz, dimName),
+                                           compressionLevel)
 
     # Remove deleted files
     for path in sourceNode.deadFiles:
@@ -381,6 +438,10 @@ def copyToFolder(destFolder, sourceNode, presaveNode=None):
                 presaveNode.deleteFile(path)
         destFolder.writeFile(path, sourceFolder.readFile(path))
 
+    destFolder.syncToDisk()
+    if presaveFolder:
+        presaveFolder.syncToDisk()
+
 class RevisionHistoryNode(object):
     def __init__(self, history, worldFolder, parentNode):
         """
@@ -397,12 +458,12 @@ class RevisionHistoryNode(object):
         self.history = history
         self.worldFolder = worldFolder
         self.parentNode = parentNode
-        self.deadChunks = set()
         self.deadFiles = set()
         self.isPresave = False
         self.readonly = False
         self.differences = None
         self.invalid = False
+        self.deadChunks = set(self.loadDeletedChunks())
 
     def __repr__(self):
         return "RevisionHistoryNode(readonly=%s, isPresave=%s, worldFolder=%s)" % (self.readonly, self.isPresave, repr(
@@ -422,6 +483,14 @@ class RevisionHistoryNode(object):
 
         return changes
 
+    def syncToDisk(self):
+        """
+        Write any data still held in memory by this revision's world folder.
+        """
+        if self.invalid:
+            raise RuntimeError("Accessing invalid node: %r" % self)
+        self.worldFolder.syncToDisk()
+
     # --- Chunks ---
 
     def listDimensions(self):
@@ -442,6 +511,28 @@ class RevisionHistoryNode(object):
 
         return iter(dims)
 
+    def _findChunkNode(self, cx, cz, dimName):
+        """
+        Return the node holding this revision's version of the given chunk, or None if the chunk is not present.
+        The head node uses the history's chunk index; other nodes search their previous revisions.
+        """
+        if self.invalid:
+            raise RuntimeError("Accessing invalid node: %r" % self)
+        if self is self.history.getHead():
+            return self.history.findChunkNode(cx, cz, dimName)
+
+        node = self
+        while node:
+            if (cx, cz, dimName) in node.deadChunks:
+                return None
+            if node.worldFolder.containsChunk(cx, cz, dimName):
+                return node
+            if node is self.history.rootNode:
+                break
+
+            node = node.parentNode
+        return None
+
     def containsChunk(self, cx, cz, dimName):
         """
         Return whether the given chunk is present in the given dimension
@@ -452,27 +543,32 @@ class RevisionHistoryNode(object):
         :return:
         :rtype: bool
         """
+        return self._findChunkNode(cx, cz, dimName) is not None
+
+    def chunkPositions(self, dimName):
         if self.invalid:
             raise RuntimeError("Accessing invalid node: %r" % self)
+        if self is self.history.getHead():
+            pos = set(self.history.rootFolder.chunkPositions(dimName))
+            for cPos, node in self.history.chunkIndex[dimName].iteritems():
+                if node is None:
+                    pos.discard(cPos)
+                else:
+                    pos.add(cPos)
+            return pos
+
+        chain = []
         node = self
         while node:
-            if (cx, cz, dimName) in node.deadChunks:
-                return False
-            if node.worldFolder.containsChunk(cx, cz, dimName):
-                return True
-
+            chain.append(node)
+            if node is self.history.rootNode:
+                break
             node = node.parentNode
-        return False
 
-    def chunkPositions(self, dimName):
-        if self.invalid:
-            raise RuntimeError("Accessing invalid node: %r" % self)
-        node = self
         pos = set()
-        while node:
+        for node in reversed(chain):
             pos.update(node.worldFolder.chunkPositions(dimName))
-
-            node = node.parentNode
+            pos.difference_update((cx, cz) for cx, cz, d in node.deadChunks if d == dimName)
 
         return pos
 
@@ -502,45 +598,57 @@ class RevisionHistoryNode(object):
             raise IOError("Storage node is read-only!")
         if self.worldFolder.containsChunk(cx, cz, dimName):
             self.worldFolder.deleteChunk(cx, cz, dimName)
-        else:
-            with file(self._deadChunksFile(), "w") as f:
-                f.write("%d, %d, %s\n" % (cx, cz, dimName))
-                f.close()
+        if self is not self.history.rootNode:
+            # Hide the chunk in previous revisions
             self.deadChunks.add((cx, cz, dimName))
+            self._saveDeadChunks()
+        self.history._indexChunk(self, cx, cz, dimName, False)
+
+    def _saveDeadChunks(self):
+        with file(self._deadChunksFile(), "w") as f:
+            for cx, cz, dimName in sorted(self.deadChunks):
+                f.write("%d, %d, %s\n" % (cx, cz, dimName))
+
+    def _undeleteChunk(self, cx, cz, dimName):
+        # Stop hiding a chunk that was written again after it was deleted
+        if (cx, cz, dimName) in self.deadChunks:
+            self.deadChunks.discard((cx, cz, dimName))
+            self._saveDeadChunks()
 
     def loadDeletedChunks(self):
         """
         A list of chunks deleted in this revision that MAY be present in previous revisions
         :return:
-        :rtype:
+        :rtype: list of (int, int, str)
         """
         if self.invalid:
             raise RuntimeError("Accessing invalid node: %r" % self)
+        if not os.path.exists(self._deadChunksFile()):
+            return []
         with file(self._deadChunksFile()) as f:
             lines = f.read().split('\n')
 
-        def _coords():
-            for line in lines:
-                cx, cz = line.split(", ")
-                yield int(cx), int(cz)
-
-        return _coords()
+        coords = []
+        for line in lines:
+            if line:
+                cx, cz, dimName = line.split(", ", 2)
+                coords.append((int(cx), int(cz), dimName))
+        return coords
 
     def readChunkBytes(self, cx, cz, dimName):
-        if self.invalid:
-            raise RuntimeError("Accessing invalid node: %r" % self)
-        node = self
-        while node:
-            # Ask RevisionHistory for most recent node containing this chunk?
-            if node.worldFolder.containsChunk(cx, cz, dimName):
-                data = node.worldFolder.readChunkBytes(cx, cz, dimName)
-                return data
-            if node is self.history.rootNode:
-                break
-
-            node = node.parentNode
+        node = self._findChunkNode(cx, cz, dimName)
+        if node is None:
+            raise ChunkNotPresent((cx, cz))
+        return node.worldFolder.readChunkBytes(cx, cz, dimName)
 
-        raise ChunkNotPresent((cx, cz))
+    def readChunkCompressed(self, cx, cz, dimName):
+        """
+        Like readChunkBytes, but return the chunk's compressed data and compression format as a (data, fmt) tuple.
+        """
+        node = self._findChunkNode(cx, cz, dimName)
+        if node is None:
+            raise ChunkNotPresent((cx, cz))
+        return node.worldFolder.readChunkCompressed(cx, cz, dimName)
 
     def writeChunkBytes(self, cx, cz, dimName, data):
         if self.invalid:
@@ -548,6 +656,20 @@ class RevisionHistoryNode(object):
         if self.readonly:
             raise IOError("Storage node is read-only!")
         self.worldFolder.writeChunkBytes(cx, cz, dimName, data)
+        self._undeleteChunk(cx, cz, dimName)
+        self.history._indexChunk(self, cx, cz, dimName, True)
+
+    def writeChunkCompressed(self, cx, cz, dimName, data, fmt):
+        """
+        Like writeChunkBytes, but data is already compressed in the given compression format.
+        """
+        if self.invalid:
+            raise RuntimeError("Accessing invalid node: %r" % self)
+        if self.readonly:
+            raise IOError("Storage node is read-only!")
+        self.worldFolder.writeChunkCompressed(cx, cz, dimName, data, fmt)
+        self._undeleteChunk(cx, cz, dimName)
+        self.history._indexChunk(self, cx, cz, dimName, True)
 
     # --- Regular files ---
 
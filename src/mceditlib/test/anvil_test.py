@@ -1,6 +1,7 @@
 import itertools
 import os
 import shutil
+import zlib
 
 import numpy
 import py.test
@@ -96,3 +97,313 @@ def testBigEndianIntHeightMap():
 
     eq = (changedChunk["Level"]["HeightMap"].value == oldhm)
     assert eq.all()
+
+def testMmappedRegionFile():
+    filename = TempFile("test_files/AnvilWorld/region/r.0.0.mca")
+    region = RegionFile(filename)
+    mapped = RegionFile(filename, mmapped=True)
+    chunkPositions = list(region.chunkPositions())
+    for cx, cz in chunkPositions:
+        assert region.readChunkBytes(cx, cz) == mapped.readChunkBytes(cx, cz)
+
+    # Grow the file past its mapped size and read the new data back through the remapped file
+    cx, cz = chunkPositions[0]
+    data = os.urandom(region.SECTOR_BYTES * 3)
+    sectorCount = mapped.sectorCount
+    mapped.writeChunkBytes(cx, cz, data)
+    assert mapped.sectorCount > sectorCount
+    assert mapped.readChunkBytes(cx, cz) == data
+    mapped.close()
+
+    assert RegionFile(filename).readChunkBytes(cx, cz) == data
+
+def testDeferredRegionHeaders():
+    filename = TempFile("test_files/AnvilWorld/region/r.0.0.mca")
+    region = RegionFile(filename, deferHeaderWrites=True)
+    cx, cz = iter(region.chunkPositions()).next()
+    oldData = region.readChunkBytes(cx, cz)
+    data = os.urandom(region.SECTOR_BYTES * 3)
+    region.writeChunkBytes(cx, cz, data)
+    assert region.readChunkBytes(cx, cz) == data
+
+    # Header on disk still points to the old chunk until flushed
+    assert RegionFile(filename).readChunkBytes(cx, cz) == oldData
+
+    region.flush()
+    assert RegionFile(filename).readChunkBytes(cx, cz) == data
+
+def testRegionSectorAllocation():
+    filename = os.path.join(mktemp("RegionAlloc"), "r.0.0.mca")
+    os.makedirs(os.path.dirname(filename))
+    region = RegionFile(filename)
+    sector = region.SECTOR_BYTES
+
+    # Chunks 0..3 occupy 3, 1, 2, and 1 sectors
+    for cx, sectors in enumerate([3, 1, 2, 1]):
+        region.writeChunkCompressed(cx, 0, "\0" * (sector * sectors - 10), region.VERSION_DEFLATE)
+    assert region.usedSectors == 2 + 7
+
+    region.deleteChunk(0, 0)
+    region.deleteChunk(2, 0)
+
+    # A two-sector chunk goes into the two-sector hole, not the first hole that fits
+    region.writeChunkCompressed(4, 0, "\0" * (sector * 2 - 10), region.VERSION_DEFLATE)
+    assert region._getOffset(4, 0) == region._getOffset(3, 0) - (2 << 8) + 1
+    assert region.usedSectors == 2 + 4
+
+    # Freed sectors merge with the free run next to them
+    assert region.freeSectors.runs() == [(2, 3)]
+    region.deleteChunk(1, 0)
+    assert region.freeSectors.runs() == [(2, 4)]
+
+    reopened = RegionFile(filename)
+    assert reopened.freeSectors.runs() == region.freeSectors.runs()
+
+def testCompactRegion():
+    filename = TempFile("test_files/AnvilWorld/region/r.0.0.mca")
+    region = RegionFile(filename)
+    chunkPositions = list(region.chunkPositions())
+    for cx, cz in chunkPositions[::2]:
+        region.deleteChunk(cx, cz)
+    chunkPositions = chunkPositions[1::2]
+    chunkData = {cPos: region.readChunkCompressed(*cPos) for cPos in chunkPositions}
+
+    saved = region.compact()
+    assert saved > 0
+    assert os.path.getsize(filename) == region.usedSectors * region.SECTOR_BYTES
+    assert not region.freeSectors.runs()
+
+    for reopened in region, RegionFile(filename):
+        assert sorted(reopened.chunkPositions()) == sorted(chunkPositions)
+        for cPos in chunkPositions:
+            assert reopened.readChunkCompressed(*cPos) == chunkData[cPos]
+
+def testPrefetchChunks(anvilLevel):
+    dim = anvilLevel.getDimension()
+    anvilLevel.loadedChunkLimit = 10
+    chunkPositions = list(dim.chunkPositions()) + [(1000, 1000)]
+    expected = [(chunk.chunkPosition, len(chunk.Entities), chunk.getSection(0).Blocks.sum())
+                for chunk in dim.getChunks(chunkPositions)]
+
+    otherLevel = TempLevel("AnvilWorld")
+    otherLevel.loadedChunkLimit = 10
+    found = [(chunk.chunkPosition, len(chunk.Entities), chunk.getSection(0).Blocks.sum())
+             for chunk in otherLevel.getDimension().getChunks(chunkPositions, workers=3)]
+    assert found == expected
+    assert not otherLevel._prefetchedChunkData
+
+
+def testDeferredEntities(anvilLevel):
+    dim = anvilLevel.getDimension()
+    chunk = dim.getChunk(-6, 0)
+    assert chunk.chunkData._Entities is None
+
+    # Entities that were never accessed are saved unchanged
+    chunk.dirty = True
+    anvilLevel.saveChanges()
+    anvilLevel.close()
+
+    level = WorldEditor(anvilLevel.filename)
+    chunk = level.getDimension().getChunk(-6, 0)
+    assert len(chunk.Entities) == 5
+    assert chunk.chunkData._Entities is not None
+    assert "Entities" not in chunk.chunkData.rootTag["Level"]
+
+
+def testFindTileEntities(anvilLevel):
+    dim = anvilLevel.getDimension()
+    expected = set()
+    for chunk in dim.getChunks():
+        for ref in chunk.TileEntities:
+            if ref.id == "Chest":
+                expected.add(ref.Position)
+
+    # Scan chunks that are not in memory
+    level = WorldEditor(anvilLevel.filename, readonly=True)
+    found = [ref.Position for ref in level.getDimension().findTileEntities(id="Chest")]
+    assert len(found) == len(expected) > 0
+    assert set(found) == expected
+    assert len(level._loadedChunkData) == 0
+
+    assert list(level.getDimension().findTileEntities(id="NoSuchTileEntity")) == []
+    assert list(level.getDimension().findTileEntities(NoSuchKey=1)) == []
+
+
+def testFindEntitiesInMemory(anvilLevel):
+    dim = anvilLevel.getDimension()
+    chunk = dim.getChunk(-6, 0)
+    for ref in chunk.Entities:
+        ref.id = "Renamed"
+    found = list(dim.findEntities(id="Renamed"))
+    assert len(found) == 5
+    assert found[0] is chunk.Entities[0]
+
+
+def testCompressionLevels(anvilLevel):
+    adapter = anvilLevel.adapter
+    adapter.revisionCompressionLevel = 0
+    adapter.saveCompressionLevel = 9
+
+    # Chunks are written to the undo revision at the revision level, then recompressed at the save level
+    anvilLevel.beginUndo()
+    chunk = anvilLevel.getDimension().getChunk(0, 0)
+    chunk.dirty = True
+    anvilLevel.syncToDisk()
+    data, fmt = adapter.selectedRevision.readChunkCompressed(0, 0, "")
+    uncompressed = zlib.decompress(data)
+    assert len(data) > len(uncompressed)
+
+    anvilLevel.saveChanges()
+    data, fmt = adapter.revisionHistory.rootFolder.readChunkCompressed(0, 0, "")
+    assert data == zlib.compress(uncompressed, 9)
+
+    # Without an undo revision, chunks are written straight to the world folder at the save level
+    anvilLevel.close()
+    level = WorldEditor(anvilLevel.filename)
+    level.adapter.saveCompressionLevel = 0
+    chunk = level.getDimension().getChunk(0, 0)
+    chunk.dirty = True
+    level.syncToDisk()
+    data, fmt = level.adapter.revisionHistory.rootFolder.readChunkCompressed(0, 0, "")
+    assert zlib.decompress(data) == uncompressed
+    assert len(data) > len(uncompressed)
+
+
+def testPackedSections(anvilLevel, monkeypatch):
+    dim = anvilLevel.getDimension()
+    monkeypatch.setattr(AnvilWorldAdapter, "packedSections", True)
+    packedLevel = TempLevel("AnvilWorld")
+    packedDim = packedLevel.getDimension()
+
+    bounds = dim.bounds
+    r = numpy.random.RandomState(0)
+    x, y, z = [r.randint(lo, hi, 20000) for lo, hi in zip(bounds.origin, bounds.maximum)]
+
+    def compare():
+        result = dim.getBlocks(x, y, z, return_Data=True, return_BlockLight=True, return_SkyLight=True)
+        packedResult = packedDim.getBlocks(x, y, z, return_Data=True, return_BlockLight=True, return_SkyLight=True)
+        for a, b in zip(result, packedResult):
+            if a is not None:
+                assert (a == b).all()
+
+        for cx, cz in itertools.islice(dim.chunkPositions(), 20):
+            tag = dim.getChunk(cx, cz).chunkData.buildNBTTag()
+            packedTag = packedDim.getChunk(cx, cz).chunkData.buildNBTTag()
+            assert tag.save(compressed=False) == packedTag.save(compressed=False)
+
+    compare()
+
+    section = packedDim.getChunk(0, 0).getSection(4)
+    assert "Data" not in section.__dict__
+    assert section.nbytes < 4096 * 4
+
+    values = r.randint(0, 16, 20000).astype('uint8')
+    for d in dim, packedDim:
+        d.setBlocks(x, y, z, Blocks=values, Data=values, BlockLight=values, SkyLight=7, updateLights=False)
+    compare()
+    assert "Data" not in section.__dict__
+
+    # Block IDs above 255 unpack the Blocks array; accessing an array by name unpacks it
+    for d in dim, packedDim:
+        d.setBlocks(x[::2], y[::2], z[::2], Blocks=300, Data=values[::2], updateLights=False)
+        d.getChunk(0, 0).getSection(4).Data[0, 0, 0] = 9
+    compare()
+    assert "Data" in section.__dict__
+
+
+def testUniformSections(anvilLevel):
+    dim = anvilLevel.getDimension()
+    chunk = dim.getChunk(0, 0)
+    section = chunk.getSection(15, create=True)
+    assert section.uniformValue("Blocks") == 0
+    assert section.nbytes < 100
+    assert not any(name in section.__dict__ for name in ("Blocks", "Data", "BlockLight", "SkyLight"))
+
+    box = BoundingBox((0, 240, 0), (32, 16, 32))
+    stone = anvilLevel.blocktypes["stone"]
+    dim.fillBlocks(box, stone, updateLights=False)
+    assert section.uniformValue("Blocks") == stone.ID
+    assert (dim.getBlocks(*numpy.transpose(list(box.positions))).Blocks == stone.ID).all()
+
+    dirt = anvilLevel.blocktypes["dirt"]
+    dim.fillBlocks(box, dirt, blocksToReplace=[stone], updateLights=False)
+    assert section.uniformValue("Blocks") == dirt.ID
+
+    # A partial replacement fills the section normally
+    dim.fillBlocks(BoundingBox((0, 240, 0), (4, 4, 4)), stone, blocksToReplace=[dirt], updateLights=False)
+    assert section.uniformValue("Blocks") is None
+    assert dim.getBlockID(3, 243, 3) == stone.ID
+    assert dim.getBlockID(4, 243, 3) == dirt.ID
+
+    dim.setBlocks([20], [250], [20], Blocks=[stone.ID], updateLights=False)
+    assert dim.getChunk(1, 1).getSection(15).uniformValue("Blocks") is None
+
+    anvilLevel.saveChanges()
+    anvilLevel.close()
+    level = WorldEditor(anvilLevel.filename)
+    dim = level.getDimension()
+    assert dim.getBlockID(3, 243, 3) == stone.ID
+    assert dim.getBlockID(4, 243, 3) == dirt.ID
+    assert dim.getBlockID(20, 250, 20) == stone.ID
+    assert dim.getBlockID(21, 250, 20) == dirt.ID
+
+
+def testDirtySections(anvilLevel):
+    dim = anvilLevel.getDimension()
+    chunk = dim.getChunk(0, 0)
+    sections = [chunk.getSection(cy) for cy in chunk.sectionPositions()]
+    tags = [section.buildNBTTag() for section in sections]
+    assert not any(section.dirty for section in sections)
+
+    dim.getRecentDirtyChunks()
+    stone = anvilLevel.blocktypes["stone"]
+    dim.setBlocks([3], [67], [3], Blocks=[stone.ID], updateLights=False)
+    assert dim.getRecentDirtyChunks() == {(0, 0)}
+    assert dim.getRecentDirtySections() == {(0, 4, 0)}
+    assert chunk.dirty
+
+    # Chunks marked wholly dirty do not report their sections separately
+    dim.setBlocks([3], [68], [3], Blocks=[stone.ID], updateLights=False)
+    chunk.dirty = True
+    assert dim.getRecentDirtyChunks() == {(0, 0)}
+    assert dim.getRecentDirtySections() == set()
+
+    # Clean sections save their loaded tags unchanged
+    section = chunk.getSection(4)
+    assert [s for s in sections if s.dirty] == [section]
+    for s, tag in zip(sections, tags):
+        if s is not section:
+            assert s.buildNBTTag() is tag
+    section.buildNBTTag()
+    assert not section.dirty
+
+    # Arrays accessed by name may be changed at any time
+    section.Data[0, 0, 0] = 5
+    section.buildNBTTag()
+    assert section.dirty
+
+    dim.fillBlocks(BoundingBox((3, 69, 3), (1, 1, 1)), stone, updateLights=False)
+    assert dim.getRecentDirtyChunks() == {(0, 0)}
+    assert dim.getRecentDirtySections() == {(0, 4, 0)}
+
+    # Reading single blocks leaves a clean section clean, and setting them marks only that section dirty
+    other = chunk.getSection(3)
+    assert not other.dirty
+    assert dim.getBlockID(3, 48, 3) == other.readArray("Blocks")[0, 3, 3]
+    dim.getBlockData(3, 48, 3)
+    assert not other.dirty
+    dim.getRecentDirtyChunks()
+    dim.setBlockID(3, 49, 3, stone.ID)
+    dim.setBlockData(3, 49, 3, 2)
+    assert dim.getRecentDirtySections() == {(0, 3, 0)}
+    assert dim.getBlockID(3, 49, 3) == stone.ID
+    assert dim.getBlockData(3, 49, 3) == 2
+
+    anvilLevel.saveChanges()
+    anvilLevel.close()
+    level = WorldEditor(anvilLevel.filename)
+    dim = level.getDimension()
+    assert dim.getBlockID(3, 67, 3) == stone.ID
+    assert dim.getBlockData(0, 64, 0) == 5
+    assert dim.getBlockID(3, 49, 3) == stone.ID
+    assert dim.getBlockData(3, 49, 3) == 2
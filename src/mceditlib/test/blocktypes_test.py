@@ -0,0 +1,28 @@
+from mceditlib import blocktypes
+from mceditlib.blocktypes import BlockTypeSet, pc_blocktypes
+
+
+def test_tables():
+    tables = pc_blocktypes.tables
+    assert pc_blocktypes.tables is tables
+
+    stone = pc_blocktypes["minecraft:stone"]
+    glowstone = pc_blocktypes["minecraft:glowstone"]
+    assert tables.opacity[stone.ID] == 15
+    assert tables.brightness[glowstone.ID] == 15
+    assert tables.flags[stone.ID, stone.meta] & blocktypes.BLOCK_OPAQUE_CUBE
+    assert tables.flags[0, 0] & blocktypes.BLOCK_TRANSPARENT
+    assert tables.flags[glowstone.ID, glowstone.meta] & blocktypes.BLOCK_EMITS_LIGHT
+    assert tables.renderType.shape == (65536,)
+
+
+def test_tablesRebuiltWhenBlocksAdded():
+    blocktypeSet = BlockTypeSet()
+    blocktypeSet.IDsByState["minecraft:lamp"] = (200, 0)
+    tables = blocktypeSet.tables
+    assert blocktypeSet.tables is tables
+
+    blocktypeSet.addJsonBlock({"internalName": "minecraft:lamp", "brightness": 20, "opacity": 0})
+    assert blocktypeSet.tables is not tables
+    assert blocktypeSet.tables.brightness[200] == 15
+    assert blocktypeSet.tables.flags[200, 0] & blocktypes.BLOCK_EMITS_LIGHT
@@ -0,0 +1,102 @@
+import py.test
+from templevel import TempLevel
+
+__author__ = 'Rio'
+
+
+@py.test.fixture
+def anvilLevel():
+    return TempLevel("AnvilWorld")
+
+
+def testChunkCacheLRU(anvilLevel):
+    anvilLevel.loadedChunkLimit = 3
+    dim = anvilLevel.getDimension()
+    positions = sorted(dim.chunkPositions())[:4]
+
+    for cPos in positions[:3]:
+        dim.getChunk(*cPos)
+    # Touch the oldest chunk so the second one becomes least recently used
+    anvilLevel._getChunkData(positions[0][0], positions[0][1], "")
+    dim.getChunk(*positions[3])
+
+    cached = set((cx, cz) for cx, cz, dimName in anvilLevel._loadedChunkData)
+    assert cached == {positions[0], positions[2], positions[3]}
+
+    stats = anvilLevel.chunkCacheStats()
+    assert stats["chunks"] == 3
+    assert stats["hits"] == 1
+    assert stats["misses"] == 4
+    assert stats["evictions"] == 1
+
+
+def testChunkCacheMemoryLimit(anvilLevel):
+    dim = anvilLevel.getDimension()
+    positions = sorted(dim.chunkPositions())[:10]
+    chunk = dim.getChunk(*positions[0])
+    chunkSize = anvilLevel.chunkCacheStats()["memoryUsed"]
+    assert chunkSize > 0
+    del chunk
+
+    anvilLevel.loadedChunkMemoryLimit = chunkSize * 2
+    for cPos in positions:
+        chunk = dim.getChunk(*cPos)
+        chunk.dirty = True
+        del chunk
+
+    stats = anvilLevel.chunkCacheStats()
+    assert stats["memoryUsed"] <= anvilLevel.loadedChunkMemoryLimit or stats["chunks"] == 1
+    assert stats["evictions"] >= 5
+
+    # Evicted dirty chunks were written out and can be loaded again
+    for cPos in positions:
+        assert dim.getChunk(*cPos).chunkPosition == cPos
+
+
+def testChunkWriteQueue(anvilLevel):
+    anvilLevel.loadedChunkLimit = 2
+    dim = anvilLevel.getDimension()
+    positions = sorted(dim.chunkPositions())[:8]
+
+    for i, cPos in enumerate(positions):
+        chunk = dim.getChunk(*cPos)
+        chunk.getSection(0, create=True).Blocks[0, 0, 0] = i + 1
+        chunk.dirty = True
+        del chunk
+
+    # Chunks still in the write queue are taken back without reading them from disk
+    assert dim.getChunk(*positions[-3]).getSection(0).Blocks[0, 0, 0] == len(positions) - 2
+
+    anvilLevel.syncToDisk()
+    assert len(anvilLevel._writeQueue) == 0
+
+    anvilLevel._loadedChunkData.clear()
+    for i, cPos in enumerate(positions):
+        assert dim.getChunk(*cPos).getSection(0).Blocks[0, 0, 0] == i + 1
+
+
+def testPrefetchQueuedChunk(anvilLevel):
+    anvilLevel.loadedChunkLimit = 2
+    dim = anvilLevel.getDimension()
+    positions = sorted(dim.chunkPositions())[:12]
+
+    chunk = dim.getChunk(*positions[0])
+    chunk.getSection(0, create=True).Blocks[0, 0, 0] = 77
+    chunk.dirty = True
+    del chunk
+    for cPos in positions[1:3]:
+        dim.getChunk(*cPos)
+    assert positions[0] + ("",) in anvilLevel._writeQueue
+
+    # Write the queued chunk out once it is being prefetched, before it is used
+    key = positions[0] + ("",)
+    values = {}
+    for chunk in dim.getChunks(positions[3:] + positions[:1], workers=2):
+        values[chunk.chunkPosition] = chunk.getSection(0).Blocks[0, 0, 0]
+        if key in anvilLevel._prefetchedChunkData:
+            anvilLevel._writeQueue.drain()
+    assert values[positions[0]] == 77
+
+    anvilLevel.syncToDisk()
+    anvilLevel._loadedChunkData.clear()
+    assert dim.getChunk(*positions[0]).getSection(0).Blocks[0, 0, 0] == 77
@@ -137,5 +137,18 @@ def testExportImport(world):
     dim.copyBlocks(schemDim, schemDim.bounds, (0, 0, 0))
 
 
+def testGetSetBlocksUnordered(world):
+    dim = world.getDimension()
+    box = BoundingBox(dim.bounds.origin, (40, 40, 40))
+    x, y, z = [a.ravel() for a in numpy.mgrid[box.minx:box.maxx, box.miny:box.maxy, box.minz:box.maxz]]
+    order = numpy.random.RandomState(0).permutation(len(x))
+    x, y, z = x[order], y[order], z[order]
+    blocks = (numpy.arange(len(x)) % 4 + 1).astype('uint16')
+
+    dim.setBlocks(x, y, z, Blocks=blocks, updateLights=False)
+    result = dim.getBlocks(x, y, z)
+    assert (result.Blocks == blocks).all()
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,39 @@
+import numpy
+import py.test
+from templevel import TempLevel
+from mceditlib.geometry import BoundingBox
+from mceditlib import floodfill
+
+__author__ = 'Rio'
+
+
+@py.test.fixture
+def anvilLevel():
+    return TempLevel("AnvilWorld")
+
+
+def testFloodFillBounded(anvilLevel):
+    dim = anvilLevel.getDimension()
+    stone = anvilLevel.blocktypes["stone"]
+    glass = anvilLevel.blocktypes["glass"]
+
+    # Crosses chunk and section boundaries
+    box = BoundingBox((-8, 8, -8), (24, 20, 24))
+    dim.fillBlocks(box, stone, updateLights=False)
+    count = floodfill.floodFill(dim, (0, 16, 0), glass.ID, glass.meta, bounds=box)
+    assert count == box.volume
+
+    x, y, z = [a.ravel() for a in numpy.mgrid[box.minx:box.maxx, box.miny:box.maxy, box.minz:box.maxz]]
+    assert (dim.getBlocks(x, y, z).Blocks == glass.ID).all()
+    assert dim.getBlockID(box.maxx, 16, 0) != glass.ID
+
+
+def testFloodFillLimit(anvilLevel):
+    dim = anvilLevel.getDimension()
+    stone = anvilLevel.blocktypes["stone"]
+    glass = anvilLevel.blocktypes["glass"]
+
+    box = BoundingBox((0, 8, 0), (16, 16, 16))
+    dim.fillBlocks(box, stone, updateLights=False)
+    progress = list(floodfill.floodFillIter(dim, (0, 8, 0), glass.ID, glass.meta, bounds=box, limit=100))
+    assert progress[-1][0] == 100
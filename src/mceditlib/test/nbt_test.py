@@ -1,6 +1,7 @@
 from os.path import join
 import time
 import zipfile
+import zlib
 import numpy
 from mceditlib import nbt
 from templevel import TempLevel
@@ -117,6 +118,46 @@ class TestNBT():
         level["Entities"][0] = nbt.TAG_Compound([nbt.TAG_String("Creeper", "id"),
                                                  nbt.TAG_List([nbt.TAG_Double(d) for d in (1, 1, 1)], "Pos")])
 
+    def testRename(self):
+        tag = nbt.TAG_Compound([nbt.TAG_Int(1, "x"), nbt.TAG_Int(2, "y")])
+        assert "x" in tag
+
+        # Renaming a child in place, as the NBT tree editor does
+        tag["x"].name = "z"
+        assert "z" in tag
+        assert tag["z"].value == 1
+        assert "x" not in tag
+
+        # Replacing a child through the list
+        tag.value[1] = nbt.TAG_Int(3, "w")
+        assert tag["w"].value == 3
+        assert "y" not in tag
+
+        # Changing the list after a lookup has used it
+        children = tag.value
+        assert "v" not in tag
+        children.append(nbt.TAG_Int(4, "v"))
+        assert tag["v"].value == 4
+        children.insert(0, nbt.TAG_Int(5, "u"))
+        assert tag["v"] is children[3]
+        del children[:2]
+        assert "u" not in tag
+        assert "z" not in tag
+        assert tag["v"] is children[1]
+
+    def testDelete(self):
+        tag = nbt.TAG_Compound([nbt.TAG_Int(i, "k%d" % i) for i in range(5)])
+        assert "k4" in tag
+        del tag["k1"]
+        assert "k1" not in tag
+        assert tag.keys() == ["k0", "k2", "k3", "k4"]
+        for k in tag.keys():
+            assert tag[k] is tag.value[tag.keys().index(k)]
+
+        tag["k1"] = nbt.TAG_Int(1)
+        assert tag.keys()[-1] == "k1"
+        assert tag["k1"].value == 1
+
     def testMultipleCompound(self):
         """ According to rumor, some TAG_Compounds store several tags with the same name. Once I find a chunk file
         with such a compound, I need to test TAG_Compound.get_all()"""
@@ -163,6 +204,62 @@ class TestNBT():
         else:
             assert False
 
+    def testLazyLoad(self):
+        level = TempLevel("AnvilWorld")
+        adapter = level.adapter
+        for cx, cz in list(adapter.chunkPositions(""))[:10]:
+            data = adapter.selectedRevision.readChunkBytes(cx, cz, "")
+            tag = nbt.load(buf=data)
+            lazyTag = nbt.load(buf=data, lazy=True)
+
+            # Untouched lazy tags are saved unchanged
+            assert lazyTag.save(compressed=False) == tag.save(compressed=False)
+            assert lazyTag.copy().save(compressed=False) == tag.save(compressed=False)
+
+            levelTag = lazyTag["Level"]
+            assert len(levelTag["Sections"]) == len(tag["Level"]["Sections"])
+            assert levelTag["Sections"] == tag["Level"]["Sections"]
+
+            levelTag["xPos"].value += 1
+            tag["Level"]["xPos"].value += 1
+            assert lazyTag.save(compressed=False) == tag.save(compressed=False)
+
+    def testSaveArrays(self):
+        # Arrays that are not big-endian, contiguous, or of the tag's element size are converted when saved
+        ints = numpy.arange(-2, 1000, dtype='i4')
+        shorts = numpy.arange(2000, dtype='u2').reshape(20, 100)[:, ::3]
+        blocks = numpy.arange(300, dtype='u2')
+
+        tag = nbt.TAG_Compound()
+        tag["Ints"] = nbt.TAG_Int_Array(ints)
+        tag["Shorts"] = nbt.TAG_Short_Array(shorts)
+        tag["Blocks"] = nbt.TAG_Byte_Array(blocks)
+        tag["Empty"] = nbt.TAG_Int_Array()
+
+        loaded = nbt.load(buf=tag.save())
+        assert (loaded["Ints"].value.astype('i4') == ints).all()
+        assert (loaded["Shorts"].value == shorts.ravel()).all()
+        assert (loaded["Blocks"].value == blocks.astype('u1')).all()
+        assert len(loaded["Empty"].value) == 0
+        assert loaded.save(compressed=False) == tag.save(compressed=False)
+
+    def testSaveStreaming(self, tmpdir):
+        tag = nbt.TAG_Compound()
+        tag["Blocks"] = nbt.TAG_Byte_Array(numpy.arange(200000, dtype='u1'))
+        tag["List"] = nbt.TAG_List([nbt.TAG_String("x" * 1000) for _ in range(100)])
+        data = tag.save(compressed=False)
+
+        assert nbt.gunzip(tag.save()) == data
+        assert zlib.decompress(tag.save(compressor=zlib.compressobj(2))) == data
+
+        filename = join(str(tmpdir), "streamed.nbt")
+        tag.save(filename)
+        assert nbt.load(filename).save(compressed=False) == data
+
+        with open(filename, "wb") as f:
+            tag.save(f, compressed=False)
+        assert open(filename, "rb").read() == data
+
     def testSpeed(self):
         d = join("test_files", "TileTicks_chunks.zip")
         zf = zipfile.ZipFile(d)
@@ -1,5 +1,6 @@
 from mceditlib.worldeditor import WorldEditor
 from templevel import TempLevel
+from mceditlib.geometry import BoundingBox
 import logging
 import numpy
 
@@ -48,3 +49,151 @@ def test_relight():
     check()
 
 
+
+
+def checkLights(dim, box):
+    """
+    Assert that the light at each position in box is the light it receives from its neighbors or emits.
+    """
+    blocktypes = dim.blocktypes
+    outer = box.expand(1)
+    x, y, z = numpy.mgrid[outer.minx:outer.maxx, outer.miny:outer.maxy, outer.minz:outer.maxz]
+    result = dim.getBlocks(x.ravel(), y.ravel(), z.ravel(), return_BlockLight=True, return_SkyLight=True)
+    inner = numpy.s_[1:-1, 1:-1, 1:-1]
+    opacity = numpy.clip(blocktypes.opacity[result.Blocks], 0, 15).reshape(x.shape)[inner].astype(int)
+    step = numpy.maximum(opacity, 1)
+
+    for name in "BlockLight", "SkyLight":
+        light = getattr(result, name).reshape(x.shape).astype(int)
+        if name == "BlockLight":
+            expected = numpy.clip(blocktypes.brightness[result.Blocks], 0, 15).reshape(x.shape)[inner].astype(int)
+        else:
+            expected = numpy.zeros_like(opacity)
+
+        for neighbor in (numpy.s_[:-2, 1:-1, 1:-1], numpy.s_[2:, 1:-1, 1:-1], numpy.s_[1:-1, :-2, 1:-1],
+                         numpy.s_[1:-1, 1:-1, :-2], numpy.s_[1:-1, 1:-1, 2:]):
+            expected = numpy.maximum(expected, light[neighbor] - step)
+
+        above = light[1:-1, 2:, 1:-1]
+        if name == "SkyLight":
+            fromAbove = numpy.where((above == 15) & (opacity == 0), 15, above - step)
+        else:
+            fromAbove = above - step
+        expected = numpy.maximum(expected, fromAbove)
+
+        assert (numpy.maximum(expected, 0) == light[inner]).all(), name
+
+
+def test_lightRemoval():
+    anvilLevel = TempLevel("AnvilWorld")
+    dim = anvilLevel.getDimension()
+    blocktypes = anvilLevel.blocktypes
+    stone = blocktypes["minecraft:stone"]
+    glowstone = blocktypes["minecraft:glowstone"]
+
+    # Hollow box of stone crossing chunk and section boundaries, above the terrain
+    box = BoundingBox(dim.bounds.origin + (56, 150, 56), (16, 16, 16))
+    checkBox = box.expand(2)
+    dim.fillBlocks(checkBox.expand(2), blocktypes["minecraft:air"])
+    dim.fillBlocks(box, stone)
+    dim.fillBlocks(box.expand(-4), blocktypes["minecraft:air"])
+    checkLights(dim, checkBox)
+
+    x, y, z = box.origin + (8, 8, 8)
+    def light(x, y, z, name="BlockLight"):
+        return getattr(dim.getBlocks([x], [y], [z], return_BlockLight=True, return_SkyLight=True), name)[0]
+
+    assert light(x, y, z, "SkyLight") == 0
+    dim.setBlocks([x], [y], [z], Blocks=[glowstone.ID])
+    assert [light(x + i, y, z) for i in range(5)] == [15, 14, 13, 12, 0]
+    checkLights(dim, checkBox)
+
+    dim.setBlocks([x], [y], [z], Blocks=[stone.ID])
+    assert [light(x + i, y, z) for i in range(5)] == [0, 0, 0, 0, 0]
+    checkLights(dim, checkBox)
+
+    # Open a shaft to the sky, then close it
+    shaftY = numpy.arange(y + 1, box.maxy)
+    dim.setBlocks(numpy.full(shaftY.shape, x, int), shaftY, numpy.full(shaftY.shape, z, int), Blocks=0)
+    assert light(x, y + 1, z, "SkyLight") == 15
+    checkLights(dim, checkBox)
+
+    dim.setBlocks([x], [box.maxy - 1], [z], Blocks=[stone.ID])
+    assert light(x, y + 1, z, "SkyLight") == 0
+    checkLights(dim, checkBox)
+
+
+def test_relightRegion():
+    anvilLevel = TempLevel("AnvilWorld")
+    dim = anvilLevel.getDimension()
+    blocktypes = anvilLevel.blocktypes
+
+    box = BoundingBox(dim.bounds.origin + (56, 150, 56), (16, 16, 16))
+    checkBox = box.expand(8)
+    dim.fillBlocks(checkBox.expand(2), blocktypes["minecraft:air"])
+
+    # Replacing glowstone with stone removes its light
+    dim.fillBlocks(box, blocktypes["minecraft:glowstone"])
+    checkLights(dim, checkBox)
+    dim.fillBlocks(box, blocktypes["minecraft:stone"], [blocktypes["minecraft:glowstone"]])
+    checkLights(dim, checkBox)
+
+    # Edits without light updates are relit afterward
+    dim.fillBlocks(box.expand(-2), blocktypes["minecraft:air"], updateLights=False)
+    dim.setBlocks([box.minx + 5], [box.miny + 5], [box.minz + 5], Blocks=[blocktypes["minecraft:glowstone"].ID],
+                  updateLights=False)
+    dim.relightRegion(box)
+    checkLights(dim, checkBox)
+
+
+def test_generateLights():
+    anvilLevel = TempLevel("AnvilWorld")
+    dim = anvilLevel.getDimension()
+    glowstone = anvilLevel.blocktypes["minecraft:glowstone"]
+
+    bounds = dim.bounds
+    x, y, z = bounds.origin + (64, 40, 64)
+    dim.setBlocks([x, x + 1], [y, y], [z, z], Blocks=[glowstone.ID, 0], updateLights=False)
+
+    progress = list(dim.generateLightsIter(workers=2))
+    assert progress[-1][0] == progress[-1][1]
+
+    light = dim.getBlocks([x, x + 1], [y, y], [z, z], return_BlockLight=True)
+    assert list(light.BlockLight) == [15, 14]
+    checkLights(dim, BoundingBox(bounds.origin + (32, 1, 32), (bounds.width - 64, 44, bounds.length - 64)))
+
+
+def test_updateHeightmap():
+    anvilLevel = TempLevel("AnvilWorld")
+    dim = anvilLevel.getDimension()
+    stone = anvilLevel.blocktypes["minecraft:stone"]
+
+    x, y, z = dim.bounds.origin + (40, 150, 40)
+    dim.fillBlocks(BoundingBox((x, y, z), (1, 1, 1)), anvilLevel.blocktypes["minecraft:air"])
+    chunk = dim.getChunk(x >> 4, z >> 4)
+    before = numpy.array(chunk.HeightMap)
+
+    dim.setBlocks([x], [y], [z], Blocks=[stone.ID])
+    assert chunk.HeightMap[z & 0xf, x & 0xf] == y + 1
+    changed = before != chunk.HeightMap
+    assert changed.sum() == 1
+
+    dim.setBlocks([x], [y], [z], Blocks=[0])
+    assert (chunk.HeightMap == before).all()
+
+
+def test_cancelledFillIsRelit():
+    anvilLevel = TempLevel("AnvilWorld")
+    dim = anvilLevel.getDimension()
+    blocktypes = anvilLevel.blocktypes
+
+    box = BoundingBox(dim.bounds.origin + (56, 150, 56), (32, 8, 32))
+    checkBox = box.expand(8)
+    dim.fillBlocks(checkBox.expand(2), blocktypes["minecraft:air"])
+
+    # Fill one chunk, then stop
+    operation = dim.fillBlocksIter(box, blocktypes["minecraft:glowstone"])
+    operation.next()
+    operation.close()
+    assert operation.relightScheduler is not None and not len(operation.relightScheduler)
+    checkLights(dim, checkBox)
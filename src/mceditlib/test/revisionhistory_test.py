@@ -1,7 +1,7 @@
 """
     revisionhistory_test
 """
-from mceditlib.revisionhistory import RevisionHistory
+from mceditlib.revisionhistory import RevisionHistory, RevisionHistoryNode
 from mceditlib.test.templevel import TempFile
 
 import logging
@@ -122,3 +122,87 @@ def testRevision(history):
     history.close()
 
 
+
+
+def testWriteCompressed(history):
+    rev = history.createRevision()
+    cx, cz = iter(rev.chunkPositions("")).next()
+    oldData = history.rootFolder.readChunkCompressed(cx, cz, "")
+    tag = readChunkTag(rev, cx, cz)
+    tag["Level"]["test"] = nbt.TAG_String("test string")
+    writeChunkTag(rev, cx, cz, tag)
+    rev.deleteChunk(cx + 1, cz, "")
+    deletedData = history.rootFolder.readChunkCompressed(cx + 1, cz, "")
+    newData = rev.readChunkCompressed(cx, cz, "")
+
+    # Chunks are copied to the world folder and the reverse revision without recompressing them
+    history.writeAllChanges()
+    assert history.rootFolder.readChunkCompressed(cx, cz, "") == newData
+    assert not history.rootFolder.containsChunk(cx + 1, cz, "")
+
+    reverseNode = history.getRevision(0)
+    assert reverseNode.worldFolder.readChunkCompressed(cx, cz, "") == oldData
+    assert reverseNode.worldFolder.readChunkCompressed(cx + 1, cz, "") == deletedData
+
+    history.close()
+
+
+def testChunkIndex(history):
+    rev1 = history.createRevision()
+    cx, cz = iter(rev1.chunkPositions("")).next()
+    tag = readChunkTag(rev1, cx, cz)
+    tag["Level"]["test"] = nbt.TAG_String("rev1")
+    writeChunkTag(rev1, cx, cz, tag)
+
+    rev2 = history.createRevision()
+    rev2.deleteChunk(cx, cz, "")
+    assert not rev2.containsChunk(cx, cz, "")
+    assert (cx, cz) not in rev2.chunkPositions("")
+    assert history.chunkIndex[""][cx, cz] is None
+
+    # Older revisions still see their own version of the chunk
+    assert rev1.containsChunk(cx, cz, "")
+    assert readChunkTag(rev1, cx, cz)["Level"]["test"].value == "rev1"
+
+    rev3 = history.createRevision()
+    writeChunkTag(rev3, cx, cz, tag)
+    assert history.chunkIndex[""][cx, cz] is rev3
+    assert rev3.containsChunk(cx, cz, "")
+
+    # Starting a revision from rev1 drops rev2 and rev3 from the index
+    rev4 = history.createRevision(1)
+    assert history.chunkIndex[""][cx, cz] is rev1
+    assert readChunkTag(rev4, cx, cz)["Level"]["test"].value == "rev1"
+
+    history.writeAllChanges()
+    assert not history.chunkIndex[""]
+    assert readChunkTag(history.getHead(), cx, cz)["Level"]["test"].value == "rev1"
+
+    history.close()
+
+def testRewriteDeletedChunk(history):
+    rev1 = history.createRevision()
+    positions = iter(rev1.chunkPositions(""))
+    cx, cz = positions.next()
+    ox, oz = positions.next()
+    tag = readChunkTag(rev1, cx, cz)
+
+    rev1.deleteChunk(cx, cz, "")
+    rev1.deleteChunk(ox, oz, "")
+    assert set(rev1.loadDeletedChunks()) == {(cx, cz, ""), (ox, oz, "")}
+
+    writeChunkTag(rev1, cx, cz, tag)
+    assert rev1.loadDeletedChunks() == [(ox, oz, "")]
+
+    # A node reopened over the same folder still sees the chunk
+    reopened = RevisionHistoryNode(history, rev1.worldFolder, rev1.parentNode)
+    assert reopened.deadChunks == {(ox, oz, "")}
+    assert reopened.containsChunk(cx, cz, "")
+    assert not reopened.containsChunk(ox, oz, "")
+
+    history.rebuildChunkIndex()
+    assert history.chunkIndex[""][cx, cz] is rev1
+    assert history.chunkIndex[""][ox, oz] is None
+    assert rev1.containsChunk(cx, cz, "")
+
+    history.close()
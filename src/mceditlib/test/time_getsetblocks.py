@@ -1,14 +1,24 @@
 import numpy
 from templevel import TempLevel
 from mceditlib.geometry import BoundingBox
+from mceditlib import multi_block
 
 level = TempLevel("AnvilWorld")
-box = BoundingBox(level.bounds.origin, (64, 32, 64))
+dim = level.getDimension()
+box = BoundingBox(dim.bounds.origin, (64, 32, 64))
+
+# 1M coordinates in random order, spread over 64 chunks and 4 sections
+bigBox = BoundingBox(dim.bounds.origin, (128, 64, 128))
+bigCoords = numpy.random.RandomState(0).permutation(bigBox.volume)
+bigX = bigBox.minx + bigCoords % bigBox.width
+bigY = bigBox.miny + (bigCoords // bigBox.width) % bigBox.height
+bigZ = bigBox.minz + bigCoords // (bigBox.width * bigBox.height)
+
 
 def timeGetBlocksOld():
     for x, y, z in box.positions:
-        level.getBlockID(x, y, z)
-        level.getBlockData(x, y, z)
+        dim.getBlockID(x, y, z)
+        dim.getBlockData(x, y, z)
 
 
 
@@ -23,20 +33,20 @@ def timeGetBlocksFast():
     x, y, z = [numpy.ravel(a) for a in x, y, z]
 
     print "Coords", [x, y, z], "maxz", z.max()
-    print "Length", level.getBlocks(x, y, z, return_Data=True).Blocks.shape
+    print "Length", dim.getBlocks(x, y, z, return_Data=True).Blocks.shape
 
 def timeGetBlocks():
 
     x, y, z = numpy.transpose(list(box.positions))
 
     print "Coords", [x, y, z], "maxz", z.max()
-    print "Length", level.getBlocks(x, y, z, return_Data=True).Blocks.shape
+    print "Length", dim.getBlocks(x, y, z, return_Data=True).Blocks.shape
 
 
 def timeSetBlocksOld():
     for x, y, z in box.positions:
-        level.setBlockID(x, y, z, 1)
-        level.setBlockData(x, y, z, 1)
+        dim.setBlockID(x, y, z, 1)
+        dim.setBlockData(x, y, z, 1)
 
 
 
@@ -50,14 +60,50 @@ def timeSetBlocksFast():
     x, y, z = [numpy.ravel(a) for a in x, y, z]
 
     print "Coords", [x, y, z], "maxz", z.max()
-    level.setBlocks(x, y, z, Blocks=1, Data=1)
+    dim.setBlocks(x, y, z, Blocks=1, Data=1)
 
 
 def timeSetBlocks():
     x, y, z = numpy.transpose(list(box.positions))
 
     print "Coords", [x, y, z], "maxz", z.max()
-    level.setBlocks(x, y, z, Blocks=1, Data=1)
+    dim.setBlocks(x, y, z, Blocks=1, Data=1)
+
+
+def coords_by_chunk_unique(x, y, z):
+    """
+    The previous implementation of coords_by_chunk, which builds a mask over the whole input for each chunk.
+    """
+    cPos = multi_block.chunkPosArray(x, z)
+    x = x & 0xf
+    z = z & 0xf
+
+    elements, inverse = numpy.unique(cPos, return_inverse=True)
+    view = multi_block.decodeChunkPos(elements)
+    cxs, czs = view[..., 0], view[..., 1]
+
+    for index, cx in numpy.ndenumerate(cxs):
+        localMask = inverse == index
+        yield (cx, czs[index], x[localMask], y[localMask], z[localMask], localMask)
+
+
+def timeCoordsByChunkMillionUnique():
+    for _ in coords_by_chunk_unique(bigX, bigY, bigZ):
+        pass
+
+
+def timeCoordsByChunkMillion():
+    for _ in multi_block.coords_by_chunk(bigX, bigY, bigZ):
+        pass
+
+
+def timeGetBlocksMillion():
+    result = dim.getBlocks(bigX, bigY, bigZ, return_Data=True, return_BlockLight=True, return_SkyLight=True)
+    print "Length", result.Blocks.shape
+
+
+def timeSetBlocksMillion():
+    dim.setBlocks(bigX, bigY, bigZ, Blocks=1, Data=1, updateLights=False)
 
 
 if __name__ == "__main__":
@@ -68,3 +114,7 @@ if __name__ == "__main__":
     print "SetNew: %.03f" % (timeit.timeit(timeSetBlocks, number=1))
     print "GetOld: %.03f" % (timeit.timeit(timeGetBlocksOld, number=1))
     print "SetOld: %.03f" % (timeit.timeit(timeSetBlocksOld, number=1))
+    print "CoordsByChunk 1M (unique): %.03f" % (timeit.timeit(timeCoordsByChunkMillionUnique, number=1))
+    print "CoordsByChunk 1M (sorted): %.03f" % (timeit.timeit(timeCoordsByChunkMillion, number=1))
+    print "GetBlocks 1M: %.03f" % (timeit.timeit(timeGetBlocksMillion, number=1))
+    print "SetBlocks 1M: %.03f" % (timeit.timeit(timeSetBlocksMillion, number=1))
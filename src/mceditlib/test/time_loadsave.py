@@ -15,6 +15,12 @@ def loadall():
         ents += len(chunk.Entities) + len(chunk.TileEntities)
     print("[Tile]Entities: ", ents)
 
+def loadall_parallel(workers=4):
+    ents = 0
+    for chunk in dim.getChunks(dim.chunkPositions(), workers=workers):
+        ents += len(chunk.Entities) + len(chunk.TileEntities)
+    print("[Tile]Entities: ", ents)
+
 def saveall():
     for cPos in dim.chunkPositions():
         dim.getChunk(*cPos).dirty = True
@@ -24,4 +30,11 @@ editor = templevel.TempLevel("AnvilWorld_1.8")
 dim = editor.getDimension()
 
 print("Loaded %d chunks in %.02fms" % (dim.chunkCount(), timeit.timeit(loadall, number=1) * 1000))
+for workers in (1, 2, 4):
+    editor.close()
+    editor = templevel.TempLevel("AnvilWorld_1.8")
+    dim = editor.getDimension()
+    print("Loaded %d chunks with %d workers in %.02fms" % (dim.chunkCount(), workers,
+                                                          timeit.timeit(lambda: loadall_parallel(workers),
+                                                                        number=1) * 1000))
 print("Saved %d chunks in %.02fms" % (dim.chunkCount(), timeit.timeit(saveall, number=1) * 1000))
@@ -33,4 +33,29 @@ print "Save: %0.1f ms" % (timeit(save_file, number=1)*1000)
 print "Length: ", len(resaved_test_file)
 
 assert test_data == resaved_test_file
+
+# Key lookup and update on a compound with many keys, such as an entity or tile entity tag
+wide_keys = ["Key%d" % i for i in range(200)]
+wide_tag = nbt.TAG_Compound()
+for key in wide_keys:
+    wide_tag[key] = nbt.TAG_Int(0)
+
+def lookup_keys():
+    for key in wide_keys:
+        wide_tag[key]
+        key in wide_tag
+
+def update_keys():
+    for key in wide_keys:
+        wide_tag[key] = nbt.TAG_Int(1)
+
+def delete_and_add_keys():
+    for key in wide_keys[::10]:
+        del wide_tag[key]
+        wide_tag[key] = nbt.TAG_Int(2)
+
+print "Compound lookup (200 keys x 100): %0.1f ms" % (timeit(lookup_keys, number=100)*1000)
+print "Compound update (200 keys x 100): %0.1f ms" % (timeit(update_keys, number=100)*1000)
+print "Compound delete+add (20 keys x 100): %0.1f ms" % (timeit(delete_and_add_keys, number=100)*1000)
+assert wide_tag.keys()[:9] == wide_keys[1:10]
 __author__ = 'Rio'
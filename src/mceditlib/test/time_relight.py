@@ -1,37 +1,88 @@
-from mceditlib.worldeditor import WorldEditor
+"""
+    time_relight
+
+    Times mceditlib.relight.updateLights and WorldEditorDimension.generateLights on a natural world and reports
+    milliseconds per chunk touched, compared to a target for each case.
+"""
+from __future__ import absolute_import, division, print_function
 from timeit import timeit
 
-import templevel
+import numpy
+
+from mceditlib import relight
+from mceditlib.geometry import BoundingBox
+from mceditlib.test import templevel
 
 #import logging
 #logging.basicConfig(level=logging.INFO)
 
-def natural_relight():
-    world = templevel.TempLevel("AnvilWorld")
-    dim = world.getDimension()
-    t = timeit(lambda: dim.generateLights(dim.chunkPositions()), number=1)
-    print "Relight natural terrain: %d chunks in %.02f seconds (%.02fms per chunk)" % (dim.chunkCount, t,
-                                                                                       t / world.chunkCount * 1000)
+# Targets in milliseconds per chunk
+TARGETS = {
+    "place": 15.0,
+    "remove": 15.0,
+    "carve": 25.0,
+    "generate": 10.0,
+}
 
+world = templevel.TempLevel("AnvilWorld")
+dim = world.getDimension()
+blocktypes = world.blocktypes
 
-def manmade_relight():
-    t = templevel.TempLevel("TimeRelight", createFunc=lambda f:WorldEditor(f, create=True))
+# 8x8 chunks in the middle of the world, from the surface up
+box = BoundingBox(dim.bounds.origin + (64, 0, 64), (128, 0, 128))
+box = BoundingBox(box.origin + (0, 48, 0), (box.width, 64, box.length))
 
-    world = t
-    station = WorldEditor("test_files/station.schematic")
+# A light source every 8 blocks along x and z
+lampX, lampZ = numpy.mgrid[box.minx:box.maxx:8, box.minz:box.maxz:8]
+lampX = lampX.ravel()
+lampZ = lampZ.ravel()
+lampY = numpy.full(lampX.shape, 66, 'int64')
 
-    times = 2
+# 3-block wide, 4-block tall tunnels along x every 16 blocks along z, underground
+tunnelX, tunnelY, tunnelZ = [a.ravel() for a in numpy.mgrid[box.minx:box.maxx, 50:54, box.minz:box.maxz]]
+inTunnel = (tunnelZ - box.minz) % 16 < 3
+tunnelX, tunnelY, tunnelZ = tunnelX[inTunnel], tunnelY[inTunnel], tunnelZ[inTunnel]
 
-    for x in range(times):
-        for z in range(times):
-            world.copyBlocksFrom(station, station.bounds, (x * station.Width, 63, z * station.Length), create=True)
+# Load the chunks and their neighbors before timing
+for cx in range((box.minx >> 4) - 1, (box.maxx >> 4) + 1):
+    for cz in range((box.minz >> 4) - 1, (box.maxz >> 4) + 1):
+        if dim.containsChunk(cx, cz):
+            dim.getChunk(cx, cz)
 
-    t = timeit(lambda: world.generateLights(world.chunkPositions), number=1)
-    print "Relight manmade building: %d chunks in %.02f seconds (%.02fms per chunk)" % (world.chunkCount, t, t / world.chunkCount * 1000)
 
-if __name__ == '__main__':
-    natural_relight()
-    manmade_relight()
+def chunkCount(x, z):
+    return len(relight.unique_chunks(x, z))
+
+
+def timePlaceLights():
+    dim.setBlocks(lampX, lampY, lampZ, Blocks=blocktypes["minecraft:glowstone"].ID, updateLights=False)
+    relight.updateLights(dim, lampX, lampY, lampZ)
+
+
+def timeRemoveLights():
+    dim.setBlocks(lampX, lampY, lampZ, Blocks=blocktypes["minecraft:stone"].ID, updateLights=False)
+    relight.updateLights(dim, lampX, lampY, lampZ)
 
 
+def timeCarveTunnels():
+    dim.setBlocks(tunnelX, tunnelY, tunnelZ, Blocks=0, updateLights=False)
+    relight.updateLights(dim, tunnelX, tunnelY, tunnelZ)
 
+
+def timeGenerateLights():
+    dim.generateLights()
+
+
+def report(name, func, chunks):
+    t = timeit(func, number=1)
+    perChunk = t / chunks * 1000
+    target = TARGETS[name]
+    print("%s: %d chunks in %.03f seconds (%.02fms per chunk, target %.02fms) %s" % (
+        name, chunks, t, perChunk, target, "OK" if perChunk <= target else "SLOW"))
+
+
+if __name__ == '__main__':
+    report("place", timePlaceLights, chunkCount(lampX, lampZ))
+    report("remove", timeRemoveLights, chunkCount(lampX, lampZ))
+    report("carve", timeCarveTunnels, chunkCount(tunnelX, tunnelZ))
+    report("generate", timeGenerateLights, dim.chunkCount())
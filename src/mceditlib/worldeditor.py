@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 import collections
 import logging
+from multiprocessing.pool import ThreadPool
 import time
 import weakref
 import itertools
@@ -8,13 +9,15 @@ import itertools
 import numpy
 
 from mceditlib.block_copy import copyBlocksIter
+from mceditlib.chunkcache import ChunkDataCache, ChunkWriteQueue
 from mceditlib.operations.block_fill import FillBlocksOperation
 from mceditlib.blocktypes import pc_blocktypes
 from mceditlib.geometry import BoundingBox
 from mceditlib import nbt
 from mceditlib.findadapter import findAdapter
 from mceditlib.levelbase import matchEntityTags
-from mceditlib.multi_block import getBlocks, setBlocks
+from mceditlib.multi_block import getBlocks, setBlocks, sectionIndex, getSectionBlocksFlat, setSectionBlocksFlat
+from mceditlib.relight import RelightScheduler, generateLightsIter
 from mceditlib.schematic import SchematicFileAdapter
 from mceditlib.util import displayName, chunk_pos, exhaust, matchEntityTags
 
@@ -84,6 +87,16 @@ class WorldEditorChunk(object):
         self.chunkData.dirty = val
         self.worldEditor.chunkBecameDirty(self)
 
+    def markSectionsDirty(self, sectionPositions):
+        """
+        Mark the chunk dirty after changing only the blocks or lights of the given sections. Unlike setting
+        `dirty`, this lets the renderer update only those sections.
+
+        :type sectionPositions: iterable of int
+        """
+        self.chunkData.dirty = True
+        self.worldEditor.sectionsBecameDirty(self, sectionPositions)
+
     # --- Chunk attributes ---
 
     def sectionPositions(self):
@@ -154,15 +167,30 @@ class WorldEditor(object):
         # maps (cx, cz, dimName) tuples to WorldEditorChunk
         self._loadedChunks = weakref.WeakValueDictionary()
 
-        # maps (cx, cz, dimName) tuples to WorldEditorChunkData
-        self._loadedChunkData = {}
+        # maps (cx, cz, dimName) tuples to WorldEditorChunkData, in least-recently-used order
+        self._loadedChunkData = ChunkDataCache()
+        if getattr(self.adapter, "packedSections", False):
+            self.loadedChunkLimit = self.packedLoadedChunkLimit
+
+        # maps (cx, cz, dimName) tuples to AsyncResults for chunks being decoded by prefetchChunks
+        self._prefetchedChunkData = {}
+
+        # dirty chunks evicted from _loadedChunkData, waiting to be compressed and written to the adapter
+        if hasattr(self.adapter, "encodeChunk"):
+            self._writeQueue = ChunkWriteQueue(self.adapter.encodeChunk, self._writeEncodedChunk,
+                                               self.chunkWriteQueueLimit)
+        else:
+            self._writeQueue = None
 
         self._allChunks = None
 
         self.recentDirtyChunks = collections.defaultdict(set)
         self.recentDirtyFiles = set()
 
+        # (cx, cy, cz) tuples of sections changed without marking their whole chunk dirty, and the (cx, cz) positions
+        # of chunks that were marked wholly dirty, whose sections are not reported separately
         self.recentDirtySections = collections.defaultdict(set)
+        self.recentWholeDirtyChunks = collections.defaultdict(set)
 
         self.dimensions = {}
 
@@ -188,6 +216,7 @@ class WorldEditor(object):
         :return:
         :rtype:
         """
+        self._drainWriteQueue()
         self.adapter.createRevision()
         self.currentRevision += 1
         log.info("Opened revision %d", self.currentRevision)
@@ -237,9 +266,11 @@ class WorldEditor(object):
         log.debug("Changes: %s", changes)
         for dimName, chunkPositions in changes.chunks.iteritems():
             self.recentDirtyChunks[dimName].update(chunkPositions)
+            self.recentWholeDirtyChunks[dimName].update(chunkPositions)
             for cx, cz in chunkPositions:
                 self._loadedChunkData.pop((cx, cz, dimName), None)
                 self._loadedChunks.pop((cx, cz, dimName), None)
+                self._prefetchedChunkData.pop((cx, cz, dimName), None)
 
         self.recentDirtyFiles.update(changes.files)
         # xxx unload players, metadata!!
@@ -259,6 +290,8 @@ class WorldEditor(object):
                 dirtyPlayers += 1
                 player.save()
 
+        self._drainWriteQueue()
+
         dirtyChunkCount = 0
         for chunk in self._loadedChunkData.itervalues():
             if chunk.dirty:
@@ -278,17 +311,45 @@ class WorldEditor(object):
 
     def close(self):
         """
-        Unload all chunks and close all open filehandles.
+        Unload all chunks and close all open filehandles. Evicted chunks waiting in the write queue are written first.
         """
+        self._drainWriteQueue()
         self.adapter.close()
 
         self._allChunks = None
         self._loadedChunks.clear()
         self._loadedChunkData.clear()
+        self._prefetchedChunkData.clear()
 
     # --- Resource limits ---
 
+    # The chunk cache is trimmed when it holds more than this many chunks, or when their section arrays use more
+    # than this many bytes.
     loadedChunkLimit = 400
+    loadedChunkMemoryLimit = 128 * 1024 * 1024
+
+    # Chunk limit used instead if the adapter keeps sections packed, which use a half to a third as much memory.
+    packedLoadedChunkLimit = 1000
+
+    # Dirty chunks evicted from the chunk cache are compressed on a background thread. Evicting a chunk blocks while
+    # this many chunks are waiting to be written.
+    chunkWriteQueueLimit = 32
+
+    def chunkCacheStats(self):
+        """
+        Return statistics about the chunk cache as a dict with the keys "chunks", "memoryUsed", "hits", "misses",
+        and "evictions".
+
+        :rtype: dict
+        """
+        cache = self._loadedChunkData
+        return {
+            "chunks": len(cache),
+            "memoryUsed": cache.memoryUsed,
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "evictions": cache.evictions,
+        }
 
     # --- Instance variables  ---
 
@@ -345,25 +406,46 @@ class WorldEditor(object):
             log.debug("_getChunkData: Chunk %s is in _loadedChunkData", (cx, cz))
             return chunkData
 
-        chunkData = self.adapter.readChunk(cx, cz, dimName)
+        pending = self._prefetchedChunkData.pop((cx, cz, dimName), None)
+        if self._writeQueue is not None:
+            chunkData = self._writeQueue.take((cx, cz, dimName))
+        if chunkData is not None:
+            log.debug("_getChunkData: Chunk %s is in the write queue", (cx, cz))
+        elif pending is not None:
+            chunkData = pending.get()
+        else:
+            chunkData = self.adapter.readChunk(cx, cz, dimName)
         self._storeLoadedChunkData(chunkData)
 
         return chunkData
 
     def _storeLoadedChunkData(self, chunkData):
-        if len(self._loadedChunkData) > self.loadedChunkLimit:
-            # Try to find a chunk to unload. The chunk must not be in _loadedChunks, which contains only chunks that
-            # are in use by another object. If the chunk is dirty, save it to the temporary folder.
-
-            for (ocx, ocz, dimName), oldChunkData in self._loadedChunkData.items():
-                if (ocx, ocz, dimName) not in self._loadedChunks:  # and (ocx, ocz) not in self._recentLoadedChunks:
-                    if oldChunkData.dirty and not self.readonly:
-                        self.adapter.writeChunk(oldChunkData)
-
-                    del self._loadedChunkData[ocx, ocz, dimName]
-                    break
-
-        self._loadedChunkData[chunkData.cx, chunkData.cz, chunkData.dimName] = chunkData
+        key = chunkData.cx, chunkData.cz, chunkData.dimName
+        self._loadedChunkData.store(key, chunkData)
+
+        # Unload the least recently used chunks. A chunk must not be in _loadedChunks, which contains only chunks that
+        # are in use by another object. If the chunk is dirty, save it to the temporary folder, using the write queue
+        # if the adapter supports it.
+        def canEvict(oldKey):
+            return oldKey != key and oldKey not in self._loadedChunks
+
+        for oldKey, oldChunkData in self._loadedChunkData.evict(self.loadedChunkLimit, self.loadedChunkMemoryLimit,
+                                                                canEvict):
+            if oldChunkData.dirty and not self.readonly:
+                if self._writeQueue is not None:
+                    self._writeQueue.put(oldKey, oldChunkData)
+                else:
+                    self.adapter.writeChunk(oldChunkData)
+
+    def _writeEncodedChunk(self, chunkData, encoded):
+        data, fmt = encoded
+        self.adapter.writeChunkCompressed(chunkData.cx, chunkData.cz, chunkData.dimName, data, fmt)
+        # A chunk decoded before this write holds the old data
+        self._prefetchedChunkData.pop((chunkData.cx, chunkData.cz, chunkData.dimName), None)
+
+    def _drainWriteQueue(self):
+        if self._writeQueue is not None:
+            self._writeQueue.drain()
 
     def getChunk(self, cx, cz, dimName, create=False):
         """
@@ -390,6 +472,60 @@ class WorldEditor(object):
         self._loadedChunks[cx, cz, dimName] = chunk
         return chunk
 
+    def prefetchChunks(self, chunkPositions, dimName, workers):
+        """
+        Iterate over the chunks at the given positions, in order, while decompressing and parsing the chunks ahead
+        of the current one on a pool of worker threads. Chunk data is read from disk on the calling thread;
+        only the decoding is done by the workers. Positions not present in the world are skipped.
+
+        Only zlib releases the GIL while it inflates. Parsing the NBT and building the AnvilChunkData hold it, and
+        take most of the time, so the workers do not run in parallel. time_loadsave loads 726 chunks in about 0.4s
+        without workers, and in 0.4 to 0.6s with 1, 2 or 4 workers.
+
+        Falls back to loading chunks one at a time if the adapter does not support readChunkCompressed.
+
+        :type chunkPositions: iterator [(int, int)]
+        :type dimName: str
+        :param workers: Number of worker threads
+        :type workers: int
+        :rtype: iterator [WorldEditorChunk]
+        """
+        if not hasattr(self.adapter, "readChunkCompressed"):
+            for cx, cz in chunkPositions:
+                if self.containsChunk(cx, cz, dimName):
+                    yield self.getChunk(cx, cz, dimName)
+            return
+
+        pool = ThreadPool(workers)
+        aheadLimit = workers * 4
+        ahead = collections.deque()
+        submitted = set()
+        try:
+            for cx, cz in chunkPositions:
+                if not self.containsChunk(cx, cz, dimName):
+                    continue
+                key = cx, cz, dimName
+                # Chunks waiting in the write queue are newer than the data on disk
+                queued = self._writeQueue is not None and key in self._writeQueue
+                if not queued and key not in self._loadedChunkData and key not in self._prefetchedChunkData:
+                    data, fmt = self.adapter.readChunkCompressed(cx, cz, dimName)
+                    self._prefetchedChunkData[key] = pool.apply_async(self.adapter.decodeChunk,
+                                                                      (cx, cz, dimName, data, fmt))
+                    submitted.add(key)
+
+                ahead.append((cx, cz))
+                if len(ahead) > aheadLimit:
+                    yield self.getChunk(*ahead.popleft(), dimName=dimName)
+
+            while ahead:
+                yield self.getChunk(*ahead.popleft(), dimName=dimName)
+        finally:
+            # Discard chunks that were decoded but never used
+            for key in submitted:
+                self._prefetchedChunkData.pop(key, None)
+            pool.close()
+            pool.join()
+
     # --- Chunk dirty bit ---
 
     def listDirtyChunks(self):
@@ -399,10 +535,29 @@ class WorldEditor(object):
 
     def chunkBecameDirty(self, chunk):
         self.recentDirtyChunks[chunk.dimName].add((chunk.cx, chunk.cz))
+        self.recentWholeDirtyChunks[chunk.dimName].add((chunk.cx, chunk.cz))
 
     def getRecentDirtyChunks(self, dimName):
         return self.recentDirtyChunks.pop(dimName, set())
 
+    def sectionsBecameDirty(self, chunk, sectionPositions):
+        cx, cz = chunk.cx, chunk.cz
+        self.recentDirtyChunks[chunk.dimName].add((cx, cz))
+        self.recentDirtySections[chunk.dimName].update((cx, cy, cz) for cy in sectionPositions)
+
+    def getRecentDirtySections(self, dimName):
+        """
+        Return the positions (cx, cy, cz) of sections passed to WorldEditorChunk.markSectionsDirty since the last
+        call. Their chunks are also returned by getRecentDirtyChunks. Sections of chunks that were also marked
+        dirty as a whole are left out, so a chunk with no sections returned here must be updated entirely.
+
+        :type dimName: str
+        :rtype: set of (int, int, int)
+        """
+        sections = self.recentDirtySections.pop(dimName, set())
+        wholeChunks = self.recentWholeDirtyChunks.pop(dimName, set())
+        return {(cx, cy, cz) for cx, cy, cz in sections if (cx, cz) not in wholeChunks}
+
     # --- HeightMaps ---
 
     def heightMapAt(self, x, z, dimName):
@@ -424,9 +579,48 @@ class WorldEditor(object):
             return (cx, cz) in self._allChunks[dimName]
         if (cx, cz, dimName) in self._loadedChunkData:
             return True
+        if self._writeQueue is not None and (cx, cz, dimName) in self._writeQueue:
+            return True
 
         return self.adapter.containsChunk(cx, cz, dimName)
 
+    def findEntities(self, dimName, selection, kw, tileEntities=False):
+        """
+        Iterate over the entities (or tile entities) in the given dimension whose tags have the values in kw. Chunks
+        that are in memory are searched through their chunk objects, so unsaved changes are seen. Other chunks are
+        scanned by the adapter without loading them, if it supports this.
+
+        :type dimName: str
+        :type selection: mceditlib.selection.SelectionBox | None
+        :type kw: dict
+        :type tileEntities: bool
+        :rtype: iterator
+        """
+        if selection is None:
+            chunkPositions = self.chunkPositions(dimName)
+        else:
+            chunkPositions = selection.chunkPositions()
+
+        canScan = hasattr(self.adapter, "scanChunkEntities")
+
+        for cx, cz in chunkPositions:
+            if not self.containsChunk(cx, cz, dimName):
+                continue
+
+            key = cx, cz, dimName
+            inMemory = (key in self._loadedChunks or key in self._loadedChunkData
+                        or (self._writeQueue is not None and key in self._writeQueue))
+            if canScan and not inMemory:
+                refs = self.adapter.scanChunkEntities(cx, cz, dimName, kw, tileEntities)
+            else:
+                chunk = self.getChunk(cx, cz, dimName)
+                refs = chunk.TileEntities if tileEntities else chunk.Entities
+                refs = [ref for ref in refs if _matchEntityTagsIfPresent(ref, kw)]
+
+            for ref in refs:
+                if selection is None or ref.Position in selection:
+                    yield ref
+
     def containsPoint(self, x, y, z, dimName):
         if y < 0 or y > 127:
             return False
@@ -442,6 +636,8 @@ class WorldEditor(object):
         self._storeLoadedChunkData(chunk)
 
     def deleteChunk(self, cx, cz, dimName):
+        if self._writeQueue is not None:
+            self._writeQueue.take((cx, cz, dimName))
         self.adapter.deleteChunk(cx, cz, dimName)
         if self._allChunks is not None:
             self._allChunks[dimName].discard((cx, cz))
@@ -494,6 +690,13 @@ class WorldEditor(object):
             self.dimensions[dimName] = dim
         return dim
 
+def _matchEntityTagsIfPresent(ref, kw):
+    try:
+        return matchEntityTags(ref, kw)
+    except KeyError:
+        return False
+
+
 class WorldEditorDimension(object):
     def __init__(self, worldEditor, dimName):
         self.worldEditor = worldEditor
@@ -567,13 +770,23 @@ class WorldEditorDimension(object):
         """
         return self.worldEditor.getChunk(cx, cz, self.dimName, create)
 
-    def getChunks(self, chunkPositions=None):
+    def getChunks(self, chunkPositions=None, workers=None):
         """
+        Iterate over the chunks at the given positions, skipping positions where no chunk is present. If workers
+        is given, chunks ahead of the current one are decompressed and parsed on that many worker threads. Parsing
+        holds the GIL, so this is not faster than loading the chunks in turn; see WorldEditor.prefetchChunks.
+
         :type chunkPositions(): iterator
+        :type workers: int | None
         :rtype: iterator
         """
         if chunkPositions is None:
             chunkPositions = self.chunkPositions()
+        if workers:
+            for chunk in self.worldEditor.prefetchChunks(chunkPositions, self.dimName, workers):
+                yield chunk
+            return
+
         for cx, cz in chunkPositions:
             if self.containsChunk(cx, cz):
                 yield self.getChunk(cx, cz)
@@ -587,6 +800,9 @@ class WorldEditorDimension(object):
     def getRecentDirtyChunks(self):
         return self.worldEditor.getRecentDirtyChunks(self.dimName)
 
+    def getRecentDirtySections(self):
+        return self.worldEditor.getRecentDirtySections(self.dimName)
+
     # --- Entities and TileEntities ---
 
     def getEntities(self, selection, **kw):
@@ -603,6 +819,29 @@ class WorldEditorDimension(object):
                     if matchEntityTags(ref, kw):
                         yield ref
 
+    def findEntities(self, selection=None, **kw):
+        """
+        Like getEntities, but searches the whole dimension if no selection is given, and does not load chunks that
+        are not already in memory if the adapter can scan them instead. Entities that do not have a tag named in kw
+        do not match.
+
+        Refs from chunks that were scanned are copies, so changes to them are not saved. Use getEntities to find
+        entities to edit.
+
+        :type selection: mceditlib.selection.SelectionBox | None
+        :rtype: iterator [PCEntityRef]
+        """
+        return self.worldEditor.findEntities(self.dimName, selection, kw, tileEntities=False)
+
+    def findTileEntities(self, selection=None, **kw):
+        """
+        Like findEntities, but finds tile entities.
+
+        :type selection: mceditlib.selection.SelectionBox | None
+        :rtype: iterator [PCTileEntityRef]
+        """
+        return self.worldEditor.findEntities(self.dimName, selection, kw, tileEntities=True)
+
     def addEntity(self, ref):
         x, y, z = ref.Position
         cx, cz = chunk_pos(x, z)
@@ -661,6 +900,32 @@ class WorldEditorDimension(object):
     def fillBlocks(self, box, block, blocksToReplace=(), updateLights=True):
         return exhaust(self.fillBlocksIter(box, block, blocksToReplace, updateLights))
 
+    # --- Lighting ---
+
+    def relightRegion(self, box):
+        """
+        Update the HeightMap, BlockLight and SkyLight for every block in the given box, as if every block in it had
+        changed. Use this after editing with updateLights=False.
+
+        :type box: mceditlib.geometry.SelectionBox
+        """
+        scheduler = RelightScheduler(self)
+        scheduler.addBox(box)
+        scheduler.relight()
+
+    def generateLightsIter(self, chunkPositions=None, workers=None):
+        return generateLightsIter(self, chunkPositions, workers)
+
+    def generateLights(self, chunkPositions=None, workers=None):
+        """
+        Recompute the HeightMap, BlockLight and SkyLight of the given chunks from scratch, or of every chunk if
+        chunkPositions is None. Column skylight is computed on `workers` processes, or one for each CPU if None.
+
+        :type chunkPositions: iterable of (int, int) | None
+        :type workers: int | None
+        """
+        return exhaust(self.generateLightsIter(chunkPositions, workers))
+
     # --- Blocks by single coordinate ---
 
     def getBlock(self, x, y, z):
@@ -668,59 +933,43 @@ class WorldEditorDimension(object):
         meta = self.getBlockData(x, y, z)
         return self.blocktypes[ID, meta]
 
+    # These read and write single elements through the multi_block helpers, so packed or uniform section arrays are
+    # not unpacked, reading leaves the section clean, and writing marks only that section dirty.
+
     def getBlockID(self, x, y, z, default=0):
-        cx = x >> 4
-        cy = y >> 4
-        cz = z >> 4
-        if self.containsChunk(cx, cz):
-            chunk = self.getChunk(cx, cz)
-            sec = chunk.getSection(cy)
-            if sec:
-                array = sec.Blocks
-                if array is not None:
-                    return array[y & 0xf, z & 0xf, x & 0xf]
+        sec = self._getSectionAt(x, y, z)
+        if sec:
+            Blocks = getSectionBlocksFlat(sec, numpy.array([sectionIndex(x, y, z)]), return_Blocks=True)[0]
+            if Blocks is not None:
+                return Blocks[0]
         return default
 
     def setBlockID(self, x, y, z, value):
-        cx = x >> 4
-        cy = y >> 4
-        cz = z >> 4
-        if self.containsChunk(cx, cz):
-            chunk = self.getChunk(cx, cz)
-            sec = chunk.getSection(cy, create=True)
-            if sec:
-                array = sec.Data
-                assert array is not None
-                if array is not None:
-                    array[y & 0xf, z & 0xf, x & 0xf] = value
-            chunk.dirty = True
+        sec = self._getSectionAt(x, y, z, create=True)
+        if sec:
+            setSectionBlocksFlat(sec, numpy.array([sectionIndex(x, y, z)]), Blocks=numpy.array([value]))
+            self.getChunk(x >> 4, z >> 4).markSectionsDirty([y >> 4])
 
     def getBlockData(self, x, y, z, default=0):
-        cx = x >> 4
-        cy = y >> 4
-        cz = z >> 4
-        if self.containsChunk(cx, cz):
-            chunk = self.getChunk(cx, cz)
-            sec = chunk.getSection(cy)
-            if sec:
-                array = sec.Data
-                if array is not None:
-                    return array[y & 0xf, z & 0xf, x & 0xf]
+        sec = self._getSectionAt(x, y, z)
+        if sec:
+            Data = getSectionBlocksFlat(sec, numpy.array([sectionIndex(x, y, z)]),
+                                        return_Blocks=False, return_Data=True)[1]
+            if Data is not None:
+                return Data[0]
         return default
 
     def setBlockData(self, x, y, z, value):
+        sec = self._getSectionAt(x, y, z, create=True)
+        if sec:
+            setSectionBlocksFlat(sec, numpy.array([sectionIndex(x, y, z)]), Data=numpy.array([value]))
+            self.getChunk(x >> 4, z >> 4).markSectionsDirty([y >> 4])
+
+    def _getSectionAt(self, x, y, z, create=False):
         cx = x >> 4
-        cy = y >> 4
         cz = z >> 4
         if self.containsChunk(cx, cz):
-            chunk = self.getChunk(cx, cz)
-            sec = chunk.getSection(cy, create=True)
-            if sec:
-                array = sec.Data
-                assert array is not None
-                if array is not None:
-                    array[y & 0xf, z & 0xf, x & 0xf] = value
-            chunk.dirty = True
+            return self.getChunk(cx, cz).getSection(y >> 4, create)
 
     # --- Blocks by coordinate arrays ---
 